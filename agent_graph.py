@@ -10,7 +10,6 @@ from langchain_openai import ChatOpenAI
 from langchain_core.messages import (
     BaseMessage, HumanMessage, ToolMessage, AIMessage)
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langgraph.prebuilt import ToolNode
 from typing import Literal
 from langchain_core.messages import BaseMessage
 import asyncio
@@ -18,7 +17,8 @@ from socket_server import sio
 from langchain_core.runnables import RunnableConfig
 from tenacity import retry, stop_after_attempt, wait_exponential
 import base64
-from langgraph.checkpoint.memory import MemorySaver
+from checkpointer import checkpointer
+from transactional_tools import TransactionalToolNode, session_lock
 import re
 from global_store import global_store
 from agent_helpers import inject_sid, get_element_characteristics
@@ -169,7 +169,7 @@ async def chat_node(state: State, config: RunnableConfig):
         logger.error(f"Error in chat_node: {str(e)}\n{traceback.format_exc()}")
         raise
 
-tool_node = ToolNode(tools=tools)
+tool_node = TransactionalToolNode(tools=tools)
 
 
 def route_tools(state: State) -> Literal["tools", "__end__"]:
@@ -210,7 +210,7 @@ buildsync_graph_builder.add_conditional_edges(
 )
 
 # memory = AsyncSqliteSaver.from_conn_string(":memory:", )
-memory = MemorySaver()
+memory = checkpointer
 graph = buildsync_graph_builder.compile(
     checkpointer=memory
 )
@@ -298,6 +298,31 @@ async def stream_with_backoff(sid: str, data: dict, config: dict):
         raise
 
 
+async def flush_and_notify(sid):
+    """
+    Writes the session's pending canvas changes and tells the viewer what changed:
+    fileChange for clients that reload the whole file, canvasDelta for clients that apply
+    the per-GUID changes since the last version they were sent.
+    """
+    file_name = f"public/{sid}/canvas.ifc"
+    ifc_model = global_store.sid_to_ifc_model.get(sid, None)
+    delta = None
+    if ifc_model is not None:
+        save_future = ifc_model.flush()
+        if save_future is not None:
+            try:
+                await asyncio.wrap_future(save_future)
+            except Exception as e:
+                logger.error(f"Error saving canvas for sid {sid}: {str(e)}")
+                return
+        delta = ifc_model.get_delta(ifc_model.announced_version)
+        ifc_model.announced_version = delta['to_version']
+    await sio.emit('fileChange', {'userId': 'BuildSync', 'message': 'A new change has been made to the file', 'file_name': file_name,
+                                  'version': delta['to_version'] if delta else None}, room=sid)
+    if delta is not None:
+        await sio.emit('canvasDelta', dict(delta, file_name=file_name), room=sid)
+
+
 async def model_streamer(sid, data: dict, unique_hash: str, curHighlightedObjects: dict=None):
     try:
         loop = asyncio.get_running_loop()
@@ -307,7 +332,9 @@ async def model_streamer(sid, data: dict, unique_hash: str, curHighlightedObject
         logger.info(f"Created new event loop for sid {sid}")
 
     tools_end = False
-    config = {"configurable": {"thread_id": sid, "sid": sid}}
+    # Set when a tool finished; the canvas is flushed and announced once per tools step.
+    file_changed = False
+    config = {"configurable": {"thread_id": global_store.session_id(sid), "sid": sid}}
 
     try:
         if curHighlightedObjects:
@@ -356,9 +383,7 @@ async def model_streamer(sid, data: dict, unique_hash: str, curHighlightedObject
                         await sio.emit('toolEnd', {'word': message, 'hash': unique_hash}, room=sid)
                     else:
                         message = f"{event.get('name')} execution failed"
-                    print("emitting fileChange")
-                    await sio.emit('fileChange', {'userId': 'BuildSync', 'message': 'A new change has been made to the file', 'file_name': f"public/{sid}/canvas.ifc"}, room=sid)
-                    print("fileChange emitted")
+                    file_changed = True
                     # print('file contents: ', open('public/canvas.ifc', 'rb').read())
                 elif kind == "on_chain_start":
                     # print("event_data", event['data'])
@@ -373,6 +398,11 @@ async def model_streamer(sid, data: dict, unique_hash: str, curHighlightedObject
                             await sio.emit('chainStart', {'word': message, 'hash': unique_hash, 'tools_end': tools_end}, room=sid)
                     except (KeyError, IndexError, TypeError, AttributeError) as e:
                         print(e)
+                elif kind == "on_chain_end" and event.get('name') == 'tools':
+                    # All tool calls of this step are done: write the canvas once and notify.
+                    if file_changed:
+                        file_changed = False
+                        await flush_and_notify(sid)
                 elif kind == "on_chain_end":
                     # print("event_data", event['data'])
                     messages = event['data']['output']
@@ -400,3 +430,25 @@ async def model_streamer(sid, data: dict, unique_hash: str, curHighlightedObject
     except Exception as e:
         logger.error(f"Error in model_streamer for sid {sid}: {str(e)}\n{traceback.format_exc()}")
         raise
+    finally:
+        # End of the turn: drop orphaned entities if there are enough of them, and leave nothing unsaved.
+        # Compaction takes the session lock, since another message from the same sid may be running tools.
+        ifc_model = global_store.sid_to_ifc_model.get(sid, None)
+        if ifc_model is not None:
+            try:
+                async with session_lock(sid):
+                    report = await asyncio.to_thread(ifc_model.maybe_compact)
+                if report and report['compacted']:
+                    logger.info(f"Compacted IFC model for sid {sid}: {report}")
+            except Exception as e:
+                logger.error(f"Error compacting IFC model for sid {sid}: {str(e)}\n{traceback.format_exc()}")
+        if file_changed:
+            await flush_and_notify(sid)
+        elif ifc_model is not None:
+            ifc_model.flush()
+        # Persist the turn's checkpoints and model once, rather than after every node.
+        if hasattr(memory, "apersist_turn"):
+            try:
+                await memory.apersist_turn(global_store.session_id(sid), ifc_model)
+            except Exception as e:
+                logger.error(f"Error persisting the session {sid}: {str(e)}\n{traceback.format_exc()}")
@@ -1,6 +1,5 @@
 from copy import deepcopy
 from global_store import global_store
-from feature_extractor import IfcEntityFeatureExtractor
 from tool_helpers import format_output_search_result
 
 
@@ -25,6 +24,5 @@ def get_element_characteristics(sid, object_id):
     if ifc_model is None:
         return "No IFC model found for this session."
     ifc_entity = ifc_model.ifcfile.by_id(object_id)
-    feature_extractor = IfcEntityFeatureExtractor()
-    features = feature_extractor.extract_entity_features(ifc_entity)
+    features = ifc_model.feature_cache.extract_entity_features(ifc_entity)
     return format_output_search_result([features])
\ No newline at end of file
@@ -0,0 +1,121 @@
+"""
+Benchmark: durable sessions with SqliteCheckpointer. Compares persisting after every node checkpoint, as a
+plain durable saver does, against persisting once per turn, and measures how long a fresh worker takes to
+resume the session (load the thread and restore the model). Run from the repository root:
+
+    python benchmarks/bench_checkpointer.py --turns 20 --nodes 4 --columns 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage  # noqa: E402
+from langgraph.checkpoint.base import empty_checkpoint  # noqa: E402
+from checkpointer import SqliteCheckpointer  # noqa: E402
+from ifc import IfcModel  # noqa: E402
+
+X = 1., 0., 0.
+Z = 0., 0., 1.
+
+
+def build_model(count):
+    """
+    Builds a model with one story and `count` W12X53 columns, the way the create_column tool does.
+
+    Parameters:
+    - count: the number of columns to create.
+    """
+    model = IfcModel(creator="Benchmark", organization="BuildSync", application="IfcOpenShell",
+                     application_version="0.5", project_name="Checkpointer Benchmark")
+    model.create_building_stories(0.0, "Level 1")
+    for i in range(count):
+        add_column(model, i)
+    model.commit_version()
+    return model
+
+
+def add_column(model, i):
+    story = model.building_story_list[0]
+    placement = model.create_ifclocalplacement(
+        (float(i % 20) * 10, float(i // 20) * 10, 0.0), Z, X, relative_to=story.ObjectPlacement)
+    column = model.create_column(context=model.model_context, owner_history=model.owner_history,
+                                 column_placement=placement, height=10.0, section_name="W12X53", material="steel")
+    model.ifcfile.createIfcRelContainedInSpatialStructure(
+        model.create_guid(), model.owner_history, "Building story Container", None, [column], story)
+    model.record_added(column)
+
+
+def run_turns(saver, model, thread_id, turns, nodes, per_node):
+    """
+    Plays `turns` turns of `nodes` checkpoints each, adding a column per turn.
+
+    Parameters:
+    - per_node: whether to persist after every checkpoint instead of once per turn.
+
+    Returns:
+    float: the seconds spent persisting.
+    """
+    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+    messages = []
+    persisting = 0.0
+    for turn in range(turns):
+        add_column(model, 10_000 + turn)
+        model.commit_version()
+        messages.append(HumanMessage(content=f"Add a column at grid {turn}"))
+        for node in range(nodes):
+            if node % 2:
+                messages.append(ToolMessage(content="Matches: 1 (IfcColumn)\n" + "x" * 3000,
+                                            tool_call_id=f"call-{turn}-{node}"))
+            else:
+                messages.append(AIMessage(content=f"Step {node} of turn {turn}"))
+            checkpoint = empty_checkpoint()
+            checkpoint["channel_values"] = {"messages": list(messages)}
+            config = saver.put(config, checkpoint, {"source": "loop", "step": node, "writes": None}, {})
+            if per_node:
+                start = time.perf_counter()
+                saver.persist_turn(thread_id, model)
+                persisting += time.perf_counter() - start
+        if not per_node:
+            start = time.perf_counter()
+            saver.persist_turn(thread_id, model)
+            persisting += time.perf_counter() - start
+    return persisting
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--turns", type=int, default=20, help="turns per session")
+    parser.add_argument("--nodes", type=int, default=4, help="node checkpoints per turn")
+    parser.add_argument("--columns", type=int, default=200, help="columns in the session's model")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    print(f"{args.turns} turns of {args.nodes} checkpoints, model with {args.columns} columns")
+    for label, per_node in (("persist every node", True), ("persist every turn", False)):
+        path = os.path.join(directory, f"{'node' if per_node else 'turn'}.sqlite3")
+        saver = SqliteCheckpointer(path)
+        seconds = run_turns(saver, build_model(args.columns), "session", args.turns, args.nodes, per_node)
+        stats = saver.stats()
+        print(f"{label:20s} {stats['persisted_turns']:5d} writes {stats['persisted_bytes'] / 1024:9.1f} KiB "
+              f"{stats['model_snapshots']:4d} model snapshots {seconds * 1000:8.1f} ms")
+
+    # A fresh worker resumes the last session from the database.
+    start = time.perf_counter()
+    saver = SqliteCheckpointer(path)
+    checkpoint = saver.get_tuple({"configurable": {"thread_id": "session", "checkpoint_ns": ""}})
+    loaded = time.perf_counter()
+    model = build_model(0)
+    built = time.perf_counter()
+    model.restore_snapshot(saver.load_model_snapshot("session"))
+    restored = time.perf_counter()
+    print(f"resume: thread {(loaded - start) * 1000:.1f} ms, model restore {(restored - built) * 1000:.1f} ms, "
+          f"{len(checkpoint.checkpoint['channel_values']['messages'])} messages, "
+          f"{len(model.ifcfile.by_type('IfcColumn'))} columns")
+
+
+if __name__ == "__main__":
+    main()
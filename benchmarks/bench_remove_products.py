@@ -0,0 +1,99 @@
+"""
+Benchmark: deleting many products with IfcModel.remove_products against the old per-GUID loop
+(ifcfile.remove + save_ifc for every object). Run from the repository root:
+
+    python benchmarks/bench_remove_products.py --count 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ifc import IfcModel  # noqa: E402
+
+X = 1., 0., 0.
+Z = 0., 0., 1.
+
+
+def build_model(count):
+    """
+    Builds a model with one story and `count` W12X53 columns, the way the create_column tool does.
+
+    Parameters:
+    - count: the number of columns to create.
+    """
+    model = IfcModel(creator="Benchmark", organization="BuildSync", application="IfcOpenShell",
+                     application_version="0.5", project_name="Remove Products Benchmark")
+    model.create_building_stories(0.0, "Level 1")
+    story = model.building_story_list[0]
+    context = model.model_context
+    owner_history = model.owner_history
+    guids = []
+    for i in range(count):
+        placement = model.create_ifclocalplacement(
+            (float(i % 20) * 10, float(i // 20) * 10, 0.0), Z, X, relative_to=story.ObjectPlacement)
+        column = model.create_column(context=context, owner_history=owner_history, column_placement=placement,
+                                     height=10.0, section_name="W12X53", material="steel")
+        model.ifcfile.createIfcRelContainedInSpatialStructure(
+            model.create_guid(), owner_history, "Building story Container", None, [column], story)
+        model.record_added(column)
+        guids.append(column.GlobalId)
+    return model, guids
+
+
+def entity_count(model):
+    return sum(1 for _ in model.ifcfile)
+
+
+def bench_loop(model, guids, filename):
+    """
+    The previous delete_objects behaviour: remove each product and rewrite the file every time.
+    """
+    start = time.perf_counter()
+    for guid in guids:
+        model.ifcfile.remove(model.ifcfile.by_guid(guid))
+        model.ifcfile.write(filename)
+    return time.perf_counter() - start
+
+
+def bench_remove_products(model, guids, filename):
+    """
+    One batched removal and one save.
+    """
+    model.save_path = filename
+    start = time.perf_counter()
+    model.remove_products(guids)
+    model.flush(wait=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=200,
+                        help="number of columns to create and delete")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = []
+        for name, bench in (("loop (remove + save per GUID)", bench_loop),
+                            ("IfcModel.remove_products", bench_remove_products)):
+            model, guids = build_model(args.count)
+            model.flush_idle_window = 0
+            before = entity_count(model)
+            filename = os.path.join(directory, f"{bench.__name__}.ifc")
+            elapsed = bench(model, guids, filename)
+            after = entity_count(model)
+            results.append((name, elapsed, before, after,
+                           os.path.getsize(filename)))
+
+    print(f"Deleting {args.count} columns")
+    for name, elapsed, before, after, size in results:
+        print(f"{name:32s} {elapsed * 1000:10.1f} ms   entities {before} -> {after}   file {size} bytes")
+    print(f"speedup: {results[0][1] / results[1][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark: creating a session model by building the project, site, building, contexts and materials from
+scratch against cloning the process-wide base model. Run from the repository root:
+
+    python benchmarks/bench_session_create.py --count 100
+"""
+import argparse
+import os
+import sys
+import time
+
+import ifcopenshell
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ifc  # noqa: E402
+from ifc import IfcModel  # noqa: E402
+
+SESSION_ARGS = dict(creator="Benchmark", organization="BuildSync", application="IfcOpenShell",
+                    application_version="0.5", project_name="Session Benchmark")
+
+
+def bench_build(count):
+    """
+    The previous create_session behaviour: every model is built from scratch.
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        ifc._BASE_MODELS.clear()
+        IfcModel(**SESSION_ARGS)
+    return time.perf_counter() - start
+
+
+def bench_clone(count):
+    """
+    The base model is built once and every session gets a clone of it.
+    """
+    ifc._BASE_MODELS.clear()
+    IfcModel(**SESSION_ARGS)
+    start = time.perf_counter()
+    for _ in range(count):
+        IfcModel(**SESSION_ARGS)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=100,
+                        help="number of session models to create")
+    args = parser.parse_args()
+
+    build = bench_build(args.count)
+    clone = bench_clone(args.count)
+    print(f"Creating {args.count} session models (ifcopenshell {ifcopenshell.version})")
+    print(f"{'build from scratch':20s} {build * 1000 / args.count:8.2f} ms per session")
+    print(f"{'clone base model':20s} {clone * 1000 / args.count:8.2f} ms per session")
+    print(f"speedup: {build / clone:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
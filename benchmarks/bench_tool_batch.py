@@ -0,0 +1,90 @@
+"""
+Benchmark: the cost of IfcModel.begin_batch / end_batch around the tool calls of one AI message on large models.
+A message with a single call only records the highest entity id, and a failure removes what was created since;
+a message with several calls takes a full STEP snapshot, which a failure parses back. Each batch adds a few
+columns. Run from the repository root:
+
+    python benchmarks/bench_tool_batch.py --columns 900 5000 --batch 4
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ifcopenshell  # noqa: E402
+from ifc import IfcModel  # noqa: E402
+
+X = 1., 0., 0.
+Z = 0., 0., 1.
+
+
+def build_model(count):
+    """
+    Builds a model with one story and `count` W12X53 columns, the way the create_column tool does.
+
+    Parameters:
+    - count: the number of columns to create.
+    """
+    model = IfcModel(creator="Benchmark", organization="BuildSync", application="IfcOpenShell",
+                     application_version="0.5", project_name="Tool Batch Benchmark")
+    model.create_building_stories(0.0, "Level 1")
+    for i in range(count):
+        add_column(model, i)
+    model.commit_version()
+    return model
+
+
+def add_column(model, i):
+    story = model.building_story_list[0]
+    placement = model.create_ifclocalplacement(
+        (float(i % 20) * 10, float(i // 20) * 10, 0.0), Z, X, relative_to=story.ObjectPlacement)
+    column = model.create_column(context=model.model_context, owner_history=model.owner_history,
+                                 column_placement=placement, height=10.0, section_name="W12X53", material="steel")
+    model.ifcfile.createIfcRelContainedInSpatialStructure(
+        model.create_guid(), model.owner_history, "Building story Container", None, [column], story)
+    model.record_added(column)
+
+
+def run_batch(model, batch, full, rollback):
+    """
+    Applies one batch of `batch` new columns.
+
+    Parameters:
+    - full: whether begin_batch takes a full snapshot, instead of recording the highest entity id.
+    - rollback: whether the batch fails and is undone.
+
+    Returns:
+    tuple: the seconds spent in begin_batch, applying the batch, and end_batch.
+    """
+    start = time.perf_counter()
+    snapshot = model.begin_batch(full=full)
+    begun = time.perf_counter()
+    for i in range(batch):
+        add_column(model, 100_000 + i)
+    applied = time.perf_counter()
+    model.end_batch(snapshot if rollback else None)
+    ended = time.perf_counter()
+    return begun - start, applied - begun, ended - applied
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--columns", type=int, nargs="+", default=[900, 5000], help="columns in the model")
+    parser.add_argument("--batch", type=int, default=4, help="columns each batch adds")
+    args = parser.parse_args()
+
+    print(f"ifcopenshell {ifcopenshell.version}, batches of {args.batch} columns")
+    for count in args.columns:
+        model = build_model(count)
+        entities = sum(1 for _ in model.ifcfile)
+        for label, full, rollback in (("id mark, keep", False, False), ("id mark, rollback", False, True),
+                                      ("snapshot, keep", True, False), ("snapshot, rollback", True, True)):
+            begin, apply, end = run_batch(model, args.batch, full, rollback)
+            print(f"{count:5d} columns ({entities} entities) {label:18s} begin {begin * 1000:7.1f} ms "
+                  f"apply {apply * 1000:7.1f} ms end {end * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""
+Bounded conversation memory for the agent graph. BoundedMemorySaver is a MemorySaver that, on every checkpoint:
+- keeps at most CONVERSATION_MAX_MESSAGES messages per thread, cutting at the start of a user turn so tool
+  results stay with the AI message that called them;
+- truncates tool outputs of earlier turns to TOOL_MESSAGE_MAX_CHARS, keeping their head (search_canvas puts its
+  aggregate statistics first);
+- keeps only the latest CONVERSATION_CHECKPOINTS checkpoints of each thread;
+and evicts threads idle for longer than CONVERSATION_IDLE_TTL seconds.
+
+SqliteCheckpointer adds durability: the in-memory saver absorbs the checkpoints of every node, and at the end of
+each turn the thread's state and a snapshot of its IfcModel are written to SQLite in one transaction, so a
+restarted or different worker can resume the session. Threads are keyed by the session id the client sends when
+it connects (see socket_server.connect), which outlives its socket.io sid, and expire after DURABLE_SESSION_TTL.
+"""
+import asyncio
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from langgraph.checkpoint.memory import MemorySaver
+
+CONVERSATION_MAX_MESSAGES = int(os.getenv("CONVERSATION_MAX_MESSAGES", "40"))
+TOOL_MESSAGE_MAX_CHARS = int(os.getenv("TOOL_MESSAGE_MAX_CHARS", "2000"))
+CONVERSATION_CHECKPOINTS = int(os.getenv("CONVERSATION_CHECKPOINTS", "2"))
+CONVERSATION_IDLE_TTL = float(os.getenv("CONVERSATION_IDLE_TTL", "3600"))
+# "sqlite" persists sessions to CHECKPOINT_DB_PATH; "memory" keeps them in this process only.
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "sqlite")
+CHECKPOINT_DB_PATH = os.getenv("CHECKPOINT_DB_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tmp", "checkpoints.sqlite3"))
+# Seconds a persisted session is kept after its last turn, for its client to reconnect.
+DURABLE_SESSION_TTL = float(os.getenv("DURABLE_SESSION_TTL", str(7 * 24 * 3600)))
+# Seconds between sweeps for idle threads.
+EVICTION_INTERVAL = 60
+
+
+def _turn_starts(messages):
+    """
+    Returns the indexes where user turns start: each user message, or the context (system) messages sent just
+    before it, such as the highlighted selection.
+    """
+    starts = []
+    for index, message in enumerate(messages):
+        if getattr(message, "type", None) != "human":
+            continue
+        while index > 0 and getattr(messages[index - 1], "type", None) == "system":
+            index -= 1
+        starts.append(index)
+    return starts
+
+
+def compact_messages(messages, max_messages=CONVERSATION_MAX_MESSAGES, tool_chars=TOOL_MESSAGE_MAX_CHARS):
+    """
+    Returns a conversation capped to max_messages, with the tool outputs of earlier turns truncated.
+
+    Parameters:
+    - messages: the thread's messages, oldest first.
+    - max_messages: the most messages to keep.
+    - tool_chars: the most characters kept of a tool output from an earlier turn.
+    """
+    messages = list(messages)
+    # 1. Drop the oldest turns. A cut is only made where a user turn starts, so a user message keeps the context
+    # sent with it.
+    if len(messages) > max_messages:
+        turn_starts = _turn_starts(messages)
+        keep_from = next((index for index in turn_starts if len(messages) - index <= max_messages),
+                         turn_starts[-1] if turn_starts else 0)
+        messages = messages[keep_from:]
+
+    # 2. Truncate the tool outputs of every turn but the current one.
+    current_turn = max(_turn_starts(messages), default=0)
+    for index in range(current_turn):
+        message = messages[index]
+        content = getattr(message, "content", None)
+        if getattr(message, "type", None) != "tool" or not isinstance(content, str) or len(content) <= tool_chars:
+            continue
+        truncated = content[:tool_chars] + f"\n... [{len(content) - tool_chars} characters of earlier tool output removed]"
+        messages[index] = message.model_copy(update={"content": truncated})
+    return messages
+
+
+def _size(value):
+    """
+    Returns the bytes held by serialized checkpoint data: nested tuples, dicts and lists of bytes and strings.
+    """
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_size(item) for item in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(_size(item) for item in value)
+    return 0
+
+
+class BoundedMemorySaver(MemorySaver):
+    def __init__(self, max_messages=CONVERSATION_MAX_MESSAGES, tool_chars=TOOL_MESSAGE_MAX_CHARS,
+                 checkpoints=CONVERSATION_CHECKPOINTS, idle_ttl=CONVERSATION_IDLE_TTL, **kwargs):
+        """
+        Initializes an empty saver.
+
+        Parameters:
+        - max_messages: the most messages kept per thread.
+        - tool_chars: the most characters kept of a tool output from an earlier turn.
+        - checkpoints: the checkpoints kept per thread.
+        - idle_ttl: seconds after which an unused thread is evicted.
+        """
+        super().__init__(**kwargs)
+        self.max_messages = max_messages
+        self.tool_chars = tool_chars
+        self.checkpoints = checkpoints
+        self.idle_ttl = idle_ttl
+        self._last_used = dict()
+        self._last_sweep = time.monotonic()
+        self.evicted_threads = 0
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"].get("thread_id")
+        if thread_id in self.storage:
+            self._last_used[thread_id] = time.monotonic()
+        return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        """
+        Stores a checkpoint with its messages compacted, then drops the thread's older checkpoints.
+        """
+        # 1. Compact a copy: the checkpoint's values are the graph's live state.
+        channel_values = checkpoint.get("channel_values", {})
+        if isinstance(channel_values.get("messages"), list):
+            checkpoint = dict(checkpoint)
+            checkpoint["channel_values"] = dict(channel_values)
+            checkpoint["channel_values"]["messages"] = compact_messages(
+                channel_values["messages"], self.max_messages, self.tool_chars)
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+
+        # 2. Only the latest checkpoints are ever resumed from.
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        self._prune(thread_id, checkpoint_ns)
+        self._last_used[thread_id] = time.monotonic()
+        if time.monotonic() - self._last_sweep > EVICTION_INTERVAL:
+            self.evict_idle()
+        return next_config
+
+    def _prune(self, thread_id, checkpoint_ns):
+        """
+        Drops all but the latest checkpoints of a thread namespace, with their pending writes.
+        """
+        stored = self.storage[thread_id][checkpoint_ns]
+        # Checkpoint ids are time-ordered, so the latest sort last.
+        for checkpoint_id in sorted(stored)[:-self.checkpoints]:
+            del stored[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+    def delete_thread(self, thread_id):
+        """
+        Drops everything stored for a thread.
+
+        Parameters:
+        - thread_id: the thread, i.e. the session id.
+        """
+        self.storage.pop(thread_id, None)
+        for key in [key for key in self.writes if key[0] == thread_id]:
+            del self.writes[key]
+        blobs = getattr(self, "blobs", None)
+        if blobs is not None:
+            for key in [key for key in blobs if key[0] == thread_id]:
+                del blobs[key]
+        self._last_used.pop(thread_id, None)
+
+    def evict_idle(self):
+        """
+        Drops the threads that have not been used for idle_ttl seconds.
+
+        Returns:
+        list: the evicted thread ids.
+        """
+        now = time.monotonic()
+        self._last_sweep = now
+        idle = [thread_id for thread_id in list(self.storage)
+                if now - self._last_used.get(thread_id, now) > self.idle_ttl]
+        for thread_id in idle:
+            self.delete_thread(thread_id)
+        self.evicted_threads += len(idle)
+        return idle
+
+    def stats(self):
+        """
+        Returns the resident bytes, checkpoint count and idle time of the threads, as aggregates only. Thread ids
+        are session ids, which give access to a session's files, so they are never published.
+        """
+        now = time.monotonic()
+        blobs = getattr(self, "blobs", {})
+        sizes, checkpoints, idle = [], 0, []
+        for thread_id, namespaces in list(self.storage.items()):
+            resident = _size(namespaces)
+            resident += sum(_size(value) for key, value in list(self.writes.items()) if key[0] == thread_id)
+            resident += sum(_size(value) for key, value in list(blobs.items()) if key[0] == thread_id)
+            sizes.append(resident)
+            checkpoints += sum(len(stored) for stored in namespaces.values())
+            idle.append(now - self._last_used.get(thread_id, now))
+        sizes.sort()
+        def percentile(fraction):
+            return sizes[min(int(len(sizes) * fraction), len(sizes) - 1)] if sizes else 0
+        return {
+            "threads": len(sizes),
+            "bytes": sum(sizes),
+            "bytes_max": sizes[-1] if sizes else 0,
+            "bytes_p50": percentile(0.5),
+            "bytes_p95": percentile(0.95),
+            "checkpoints": checkpoints,
+            "idle_seconds_max": round(max(idle, default=0.0), 1),
+            "evicted_threads": self.evicted_threads,
+        }
+
+
+class SqliteCheckpointer(BoundedMemorySaver):
+    def __init__(self, path=CHECKPOINT_DB_PATH, session_ttl=DURABLE_SESSION_TTL, **kwargs):
+        """
+        Initializes the saver. The database is opened on first use.
+
+        Parameters:
+        - path: the SQLite file, shared by every worker.
+        - session_ttl: seconds a persisted session is kept after its last turn.
+        - kwargs: the BoundedMemorySaver limits.
+        """
+        super().__init__(**kwargs)
+        self.path = path
+        self.session_ttl = session_ttl
+        self._connection = None
+        self._db_lock = threading.Lock()
+        # The turn of each thread this process holds, to notice when another worker has moved it on.
+        self._turns = dict()
+        self._model_versions = dict()
+        self._last_prune = 0.0
+        self.puts = 0
+        self.put_bytes = 0
+        self.persisted_turns = 0
+        self.persisted_bytes = 0
+        self.model_snapshots = 0
+        self.resumed_threads = 0
+        self.resume_seconds = 0.0
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS threads (thread_id TEXT PRIMARY KEY, turn INTEGER NOT NULL, "
+                "state BLOB NOT NULL, updated REAL NOT NULL)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS models (sid TEXT PRIMARY KEY, version INTEGER NOT NULL, "
+                "snapshot BLOB NOT NULL, updated REAL NOT NULL)")
+            self._connection.commit()
+        return self._connection
+
+    def get_tuple(self, config):
+        """
+        Returns a checkpoint, first loading the thread from the database if this process does not hold it or
+        another worker has persisted a newer turn.
+        """
+        self._refresh_thread(config["configurable"].get("thread_id"))
+        return super().get_tuple(config)
+
+    async def aget_tuple(self, config):
+        """
+        get_tuple for the event loop: the database lookup runs in a worker thread.
+        """
+        await asyncio.to_thread(self._refresh_thread, config["configurable"].get("thread_id"))
+        return super().get_tuple(config)
+
+    def _refresh_thread(self, thread_id):
+        """
+        Loads a thread from the database if this process does not hold it or holds an older turn of it.
+        """
+        if thread_id is None:
+            return
+        with self._db_lock:
+            row = self._connect().execute("SELECT turn FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is not None and (thread_id not in self.storage or row[0] > self._turns.get(thread_id, -1)):
+            self._load_thread(thread_id)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        configurable = next_config["configurable"]
+        stored = self.storage[configurable["thread_id"]][configurable.get("checkpoint_ns", "")]
+        self.puts += 1
+        self.put_bytes += _size(stored.get(configurable.get("checkpoint_id")))
+        return next_config
+
+    def _load_thread(self, thread_id):
+        """
+        Replaces this process's copy of a thread with the persisted one.
+        """
+        start = time.perf_counter()
+        with self._db_lock:
+            row = self._connect().execute(
+                "SELECT turn, state FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None:
+            return
+        state = pickle.loads(zlib.decompress(row[1]))
+        super().delete_thread(thread_id)
+        for checkpoint_ns, checkpoints in state["storage"].items():
+            self.storage[thread_id][checkpoint_ns].update(checkpoints)
+        self.writes.update(state["writes"])
+        self._turns[thread_id] = row[0]
+        self._last_used[thread_id] = time.monotonic()
+        self.resumed_threads += 1
+        self.resume_seconds += time.perf_counter() - start
+
+    def persist_turn(self, thread_id, ifc_model=None):
+        """
+        Writes a thread's checkpoints and, if it changed since the last turn, a snapshot of its model, in one
+        transaction. Called once at the end of every turn.
+
+        Parameters:
+        - thread_id: the thread, i.e. the client's session id.
+        - ifc_model: the session's IfcModel, or None.
+
+        Returns:
+        int: the bytes written.
+        """
+        # 1. Serialize outside the database lock.
+        state = {
+            "storage": {checkpoint_ns: dict(checkpoints)
+                        for checkpoint_ns, checkpoints in list(self.storage.get(thread_id, {}).items())},
+            "writes": {key: value for key, value in list(self.writes.items()) if key[0] == thread_id},
+        }
+        blob = zlib.compress(pickle.dumps(state), 1)
+        snapshot = None
+        if ifc_model is not None and self._model_versions.get(thread_id) != ifc_model.version:
+            snapshot = zlib.compress(pickle.dumps(ifc_model.snapshot()), 1)
+
+        # 2. Write both together, and now and then drop sessions past their TTL.
+        now = time.time()
+        turn = self._turns.get(thread_id, 0) + 1
+        with self._db_lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("INSERT OR REPLACE INTO threads VALUES (?, ?, ?, ?)", (thread_id, turn, blob, now))
+                if snapshot is not None:
+                    connection.execute("INSERT OR REPLACE INTO models VALUES (?, ?, ?, ?)",
+                                       (thread_id, ifc_model.version, snapshot, now))
+                if now - self._last_prune > EVICTION_INTERVAL:
+                    self._last_prune = now
+                    connection.execute("DELETE FROM threads WHERE updated < ?", (now - self.session_ttl,))
+                    connection.execute("DELETE FROM models WHERE updated < ?", (now - self.session_ttl,))
+        self._turns[thread_id] = turn
+        written = len(blob)
+        if snapshot is not None:
+            self._model_versions[thread_id] = ifc_model.version
+            self.model_snapshots += 1
+            written += len(snapshot)
+        self.persisted_turns += 1
+        self.persisted_bytes += written
+        return written
+
+    async def apersist_turn(self, thread_id, ifc_model=None):
+        """
+        persist_turn in a worker thread, for the event loop.
+        """
+        return await asyncio.to_thread(self.persist_turn, thread_id, ifc_model)
+
+    def load_model_snapshot(self, session_id):
+        """
+        Returns the last persisted snapshot of a session's IfcModel, or None.
+
+        Parameters:
+        - session_id: the client's session id. The models table keeps it in its sid column.
+        """
+        with self._db_lock:
+            row = self._connect().execute("SELECT version, snapshot FROM models WHERE sid = ?",
+                                          (session_id,)).fetchone()
+        if row is None:
+            return None
+        self._model_versions[session_id] = row[0]
+        return pickle.loads(zlib.decompress(row[1]))
+
+    def forget(self, thread_id):
+        """
+        Drops a thread from memory and from the database.
+
+        Parameters:
+        - thread_id: the thread, i.e. the client's session id.
+        """
+        self.delete_thread(thread_id)
+        self._turns.pop(thread_id, None)
+        self._model_versions.pop(thread_id, None)
+        with self._db_lock:
+            connection = self._connect()
+            with connection:
+                connection.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+                connection.execute("DELETE FROM models WHERE sid = ?", (thread_id,))
+
+    def stats(self):
+        """
+        Returns the in-memory stats plus write amplification (node checkpoints absorbed per persisted turn) and
+        resume latency.
+        """
+        stats = super().stats()
+        stats.update({
+            "checkpoint_puts": self.puts,
+            "checkpoint_put_bytes": self.put_bytes,
+            "persisted_turns": self.persisted_turns,
+            "persisted_bytes": self.persisted_bytes,
+            "model_snapshots": self.model_snapshots,
+            "puts_per_persisted_turn": self.puts / self.persisted_turns if self.persisted_turns else None,
+            "resumed_threads": self.resumed_threads,
+            "resume_ms_avg": self.resume_seconds / self.resumed_threads * 1000 if self.resumed_threads else None,
+        })
+        return stats
+
+
+def create_checkpointer():
+    """
+    Returns the checkpointer CHECKPOINT_BACKEND selects.
+    """
+    if CHECKPOINT_BACKEND == "memory":
+        return BoundedMemorySaver()
+    return SqliteCheckpointer()
+
+
+# Singleton checkpointer of the agent graph.
+checkpointer = create_checkpointer()
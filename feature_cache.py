@@ -0,0 +1,104 @@
+"""
+Per-session cache of extracted features, keyed by entity id. Each entry remembers the model's version of the
+entity when it was extracted; IfcModel bumps that version whenever it records the entity (or its placement or
+representation) as modified or removed, so stale entries are never served.
+"""
+import threading
+from feature_extractor import BATCHED_CLASSES, IfcEntityFeatureExtractor
+
+
+class FeatureCache:
+    def __init__(self, model, feature_extractor=None):
+        """
+        Initializes an empty cache for a model.
+
+        Parameters:
+        - model: the IfcModel whose entities are cached; its entity_version decides freshness.
+        - feature_extractor: the extractor used on a miss. Defaults to a new one.
+        """
+        self.model = model
+        self.feature_extractor = feature_extractor or IfcEntityFeatureExtractor()
+        self._entries = dict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _lookup(self, entity):
+        """
+        Returns the cached features of an entity if they are still current, otherwise None.
+        """
+        entry = self._entries.get(entity.id())
+        if entry is not None and entry[0] == entity.GlobalId and entry[1] == self.model.entity_version(entry[0]):
+            self.hits += 1
+            return dict(entry[2])
+        self.misses += 1
+        return None
+
+    def _store(self, entity, features):
+        guid = entity.GlobalId
+        self._entries[entity.id()] = (guid, self.model.entity_version(guid), features)
+
+    def extract_entity_features(self, entity):
+        """
+        Returns an entity's features, extracting them only if they are not cached or have changed.
+        """
+        with self._lock:
+            features = self._lookup(entity)
+        if features is not None:
+            return features
+        features = self.feature_extractor.extract_entity_features(entity)
+        with self._lock:
+            self._store(entity, features)
+        return dict(features)
+
+    def extract_features_batched(self, entities):
+        """
+        Returns the features of many entities in order, batch-extracting only the ones that missed.
+        Classes without an extraction function are skipped, as in extract_features_batched.
+        """
+        entities = [entity for entity in entities if entity.is_a() in BATCHED_CLASSES]
+        with self._lock:
+            rows = [self._lookup(entity) for entity in entities]
+        missing = [entity for entity, row in zip(entities, rows) if row is None]
+        if missing:
+            extracted = iter(self.feature_extractor.extract_features_batched(missing))
+            with self._lock:
+                for position, row in enumerate(rows):
+                    if row is None:
+                        features = next(extracted)
+                        self._store(entities[position], features)
+                        rows[position] = dict(features)
+        return rows
+
+    def invalidate(self, entity_id):
+        """
+        Drops the cached features of an entity, e.g. when it is removed.
+
+        Parameters:
+        - entity_id: the entity's step id.
+        """
+        with self._lock:
+            if self._entries.pop(entity_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        """
+        Drops every entry, e.g. when the model's file is replaced.
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache's size and hit, miss and invalidation counts.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "invalidations": self.invalidations,
+            }
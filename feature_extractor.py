@@ -4,7 +4,22 @@ Class to extract features (parameters to BuildSync create functions) from IFC En
 import numpy as np
 import warnings
 
+# Columns extract_batch returns. Float columns use NaN, object columns None, where the entity lacks the value.
+BATCH_COLUMNS = ("name", "global_id", "type", "storey_name", "start_xyz", "end_xyz", "height", "thickness",
+                 "section_name", "elevation", "point_list")
+# Classes extract_batch understands; the same classes extract_entity_features has functions for.
+BATCHED_CLASSES = ("IfcWall", "IfcWallStandardCase", "IfcColumn", "IfcBeam", "IfcSlab", "IfcBuildingStorey", "IfcRoof")
+
 class IfcEntityFeatureExtractor:
+    def get_body_item(self, product, index=0):
+        """
+        Returns the first item of a product's representation, looking through a mapped item to the
+        shared geometry it instances.
+        """
+        item = product.Representation.Representations[index].Items[0]
+        if item.is_a("IfcMappedItem"):
+            item = item.MappingSource.MappedRepresentation.Items[0]
+        return item
     def extract_entity_features(self, entity):
         function_mapping = {
             'IfcWall': self.extract_wall_features,
@@ -160,12 +175,12 @@ class IfcEntityFeatureExtractor:
             warnings.warn("Column does not have a relative placement coordinate")
         try:
             # get the height of the column
-            height = column.Representation.Representations[0].Items[0].Depth
+            height = self.get_body_item(column).Depth
         except:
             warnings.warn("Column does not have a height")
         try:
             # get the section name of the column
-            section_name = column.Representation.Representations[0].Items[0].SweptArea.ProfileName
+            section_name = self.get_body_item(column).SweptArea.ProfileName
         except:
             warnings.warn("Column does not have a section name")
         features = {
@@ -223,12 +238,12 @@ class IfcEntityFeatureExtractor:
             warnings.warn("Beam does not have a relative placement coordinate and/or axis placement coordinate")
         try:
             # get the length of the column
-            length = beam.Representation.Representations[0].Items[0].Depth
+            length = self.get_body_item(beam).Depth
         except:
             warnings.warn("Beam does not have a height")
         try:
             # get the section name of the column
-            section_name = beam.Representation.Representations[0].Items[0].SweptArea.ProfileName
+            section_name = self.get_body_item(beam).SweptArea.ProfileName
         except:
             warnings.warn("Beam does not have a section name")
         
@@ -380,4 +395,204 @@ class IfcEntityFeatureExtractor:
             'elevation': story_elevation
         }
         return features
-    
\ No newline at end of file
+
+    def _xyz(self, values):
+        """
+        Returns values as 3-D coordinates, padding 2-D ones with z = 0 and NaN for None.
+        """
+        if values is None:
+            return (np.nan, np.nan, np.nan)
+        values = tuple(values)
+        return (values + (0.0, 0.0, 0.0))[:3]
+    def extract_batch(self, entities):
+        """
+        Extracts the features of many entities of one class at once, as columns rather than one dict per
+        entity. Attributes are gathered in one pass and the geometry is computed on whole arrays, with no
+        per-attribute warnings: a missing value is NaN in float columns and None in object columns.
+        - name, global_id, type, storey_name, section_name: object arrays
+        - start_xyz, end_xyz: (n, 3) float arrays of placement start and member end
+        - height: extrusion depth along the member (wall and column height, beam length)
+        - thickness: wall thickness, slab and roof depth
+        - elevation: storey elevation
+        - point_list: object array of the slab and roof outline point arrays
+
+        Parameters:
+        - entities: the entities, all of the same IFC class.
+
+        Returns:
+        dict: the columns named in BATCH_COLUMNS, each of length len(entities).
+        """
+        entities = list(entities)
+        classes = {entity.is_a() for entity in entities}
+        if len(classes) > 1:
+            raise ValueError(f"extract_batch takes entities of one class, got {sorted(classes)}")
+        ifc_class = classes.pop() if classes else None
+        n = len(entities)
+        is_wall = ifc_class in ("IfcWall", "IfcWallStandardCase")
+        is_member = ifc_class in ("IfcColumn", "IfcBeam")
+        is_plate = ifc_class in ("IfcSlab", "IfcRoof")
+
+        # 1. Gather the raw attributes in one pass. Points, directions, mapped geometry and containment
+        # relations are shared by many entities, so each shared entity is read once per batch.
+        memo = {}
+        def shared(entity, read):
+            if entity is None:
+                return read(None)
+            if entity not in memo:
+                memo[entity] = read(entity)
+            return memo[entity]
+        def coordinates(point):
+            return self._xyz(point.Coordinates if point is not None else None)
+        def ratios(direction):
+            return self._xyz(direction.DirectionRatios if direction is not None else None)
+        def storey_of(rel):
+            return rel.RelatingStructure.Name if rel is not None else None
+        def body_values(body):
+            depth = getattr(body, "Depth", None)
+            swept_area = getattr(body, "SweptArea", None)
+            curve_points = getattr(getattr(swept_area, "OuterCurve", None), "Points", None)
+            return (float(depth) if depth is not None else np.nan, getattr(swept_area, "ProfileName", None),
+                    [point.Coordinates for point in curve_points] if curve_points else None)
+        def body_of(entity, index):
+            try:
+                item = entity.Representation.Representations[index].Items[0]
+            except (AttributeError, IndexError, TypeError):
+                return body_values(None)
+            if item.is_a("IfcMappedItem"):
+                return shared(item.MappingSource, lambda source: body_values(source.MappedRepresentation.Items[0]))
+            return body_values(item)
+
+        names, guids, storeys, sections, outlines = [], [], [], [], []
+        starts, directions, axis_lengths, depths, elevations = [], [], [], [], []
+        profiles = []
+        for entity in entities:
+            names.append(entity.Name)
+            guids.append(entity.GlobalId)
+            if ifc_class == "IfcBuildingStorey":
+                storeys.append(None)
+                elevations.append(entity.Elevation)
+            else:
+                rels = getattr(entity, "ContainedInStructure", None)
+                storeys.append(shared(rels[0], storey_of) if rels else None)
+                elevations.append(None)
+            placement = getattr(getattr(entity, "ObjectPlacement", None), "RelativePlacement", None)
+            starts.append(shared(getattr(placement, "Location", None), coordinates))
+            # Walls run along RefDirection for the length of their axis; beams along their Axis.
+            direction = None
+            if is_wall:
+                direction = getattr(placement, "RefDirection", None)
+            elif ifc_class == "IfcBeam":
+                direction = getattr(placement, "Axis", None)
+            directions.append(shared(direction, ratios))
+            axis_length = np.nan
+            depth, section, outline = body_values(None)
+            if is_wall:
+                try:
+                    points = entity.Representation.Representations[0].Items[0].Points
+                    axis_length = float(np.linalg.norm(
+                        np.subtract(shared(points[1], coordinates), shared(points[0], coordinates))))
+                except (AttributeError, IndexError, TypeError):
+                    pass
+                depth, section, outline = body_of(entity, 1)
+            elif is_member or is_plate:
+                depth, section, outline = body_of(entity, 0)
+            axis_lengths.append(axis_length)
+            depths.append(depth)
+            sections.append(section if is_member else None)
+            profiles.append(outline if is_wall else None)
+            outlines.append(np.array(outline) if is_plate and outline else None)
+
+        # 2. Compute the geometry on whole arrays.
+        start_xyz = np.array(starts, dtype=float).reshape(n, 3)
+        direction_xyz = np.array(directions, dtype=float).reshape(n, 3)
+        depth = np.array(depths, dtype=float)
+        end_xyz = np.full((n, 3), np.nan)
+        if is_wall:
+            end_xyz = start_xyz + direction_xyz * np.array(axis_lengths, dtype=float)[:, None]
+        elif ifc_class == "IfcBeam":
+            # create_beam stores the Axis unnormalized (end - start), so scale its unit vector by the length.
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                unit_xyz = direction_xyz / np.linalg.norm(direction_xyz, axis=1)[:, None]
+            end_xyz = start_xyz + unit_xyz * depth[:, None]
+        thickness = np.full(n, np.nan)
+        if is_wall and n:
+            # The wall profile is centred on its axis, so its extent across the axis is the thickness.
+            width = max((len(profile) for profile in profiles if profile), default=0)
+            padded = np.full((n, max(width, 1)), np.nan)
+            for row, profile in enumerate(profiles):
+                if profile:
+                    padded[row, :len(profile)] = [point[1] for point in profile]
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                thickness = np.nanmax(padded, axis=1) - np.nanmin(padded, axis=1)
+        elif is_plate:
+            thickness = depth
+        height = depth if (is_wall or is_member) else np.full(n, np.nan)
+
+        def objects(values):
+            column = np.empty(n, dtype=object)
+            column[:] = values
+            return column
+
+        return {
+            "name": objects(names),
+            "global_id": objects(guids),
+            "type": objects([ifc_class] * n),
+            "storey_name": objects(storeys),
+            "start_xyz": start_xyz,
+            "end_xyz": end_xyz,
+            "height": height,
+            "thickness": thickness,
+            "section_name": objects(sections),
+            "elevation": np.array([value if value is not None else np.nan for value in elevations], dtype=float),
+            "point_list": objects(outlines),
+        }
+    def batch_rows(self, columns):
+        """
+        Converts the columns of extract_batch into the per-entity feature dicts extract_entity_features
+        returns, with the keys that entity's class uses.
+        """
+        def number(value):
+            return None if np.isnan(value) else float(value)
+        def coordinate(value):
+            return str(None) if np.isnan(value).all() else str(value)
+
+        rows = []
+        for i in range(len(columns["global_id"])):
+            ifc_class = columns["type"][i]
+            row = {"name": columns["name"][i], "global_id": columns["global_id"][i], "type": ifc_class}
+            if ifc_class == "IfcBuildingStorey":
+                row["elevation"] = number(columns["elevation"][i])
+                rows.append(row)
+                continue
+            row["storey_name"] = columns["storey_name"][i]
+            if ifc_class in ("IfcWall", "IfcWallStandardCase"):
+                row.update(start_coord=coordinate(columns["start_xyz"][i]), end_coord=coordinate(columns["end_xyz"][i]),
+                           height=number(columns["height"][i]), thickness=number(columns["thickness"][i]))
+            elif ifc_class == "IfcColumn":
+                row.update(start_coord=coordinate(columns["start_xyz"][i]), height=number(columns["height"][i]),
+                           section_name=columns["section_name"][i])
+            elif ifc_class == "IfcBeam":
+                row.update(start_coord=coordinate(columns["start_xyz"][i]), end_coord=coordinate(columns["end_xyz"][i]),
+                           length=number(columns["height"][i]), section_name=columns["section_name"][i])
+            elif ifc_class in ("IfcSlab", "IfcRoof"):
+                key = "slab_thickness" if ifc_class == "IfcSlab" else "roof_thickness"
+                row["point_list"] = str(columns["point_list"][i])
+                row[key] = number(columns["thickness"][i])
+            rows.append(row)
+        return rows
+    def extract_features_batched(self, entities):
+        """
+        Returns the feature dicts of entities of any classes, extracting each class in one batch and keeping
+        the input order. Classes without an extraction function are skipped, as in extract_entity_features.
+        """
+        groups = {}
+        for position, entity in enumerate(entities):
+            if entity.is_a() in BATCHED_CLASSES:
+                groups.setdefault(entity.is_a(), []).append((position, entity))
+        rows = []
+        for group in groups.values():
+            batch_rows = self.batch_rows(self.extract_batch([entity for _, entity in group]))
+            rows.extend(zip((position for position, _ in group), batch_rows))
+        return [row for _, row in sorted(rows, key=lambda entry: entry[0])]
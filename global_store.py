@@ -15,7 +15,22 @@ class GlobalStore:
             
             # Dictionary to map sid -> ifc_model
             cls._instance.sid_to_ifc_model = {}
+
+            # Dictionary to map sid -> results of the last search_canvas, for paging
+            cls._instance.sid_to_search_results = {}
+
+            # Dictionary to map sid -> asyncio lock serializing the tool calls that change its model
+            cls._instance.sid_to_lock = {}
+
+            # Dictionary to map sid -> the session id its client sent on connect, which survives reconnects
+            cls._instance.sid_to_session = {}
         return cls._instance
 
+    def session_id(self, sid):
+        """
+        Returns the durable session id of a connection: the one its client sent, or the sid itself.
+        """
+        return self.sid_to_session.get(sid, sid)
+
 # Singleton instance of GlobalStore
 global_store = GlobalStore()
\ No newline at end of file
@@ -1,4 +1,6 @@
-import pandas as pd
+from section_catalog import section_catalog
+from spatial_index import SpatialIndex
+from feature_cache import FeatureCache
 import numpy as np
 import math
 import ifcopenshell.guid
@@ -8,6 +10,10 @@ import ifcopenshell.api.style
 import ifcopenshell.api.context
 import time
 import tempfile
+import threading
+from collections import OrderedDict, deque
+import os
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 import ifcopenshell
 import uuid
 import sys
@@ -15,12 +21,69 @@ import pdb
 
 print("version: ifc openshell", ifcopenshell.version)
 
+# Seconds without a new change after which a dirty model is written to disk on its own.
+# Set to 0 to only flush at the end of a turn or when a reader asks for the file.
+FLUSH_IDLE_WINDOW = float(os.getenv("IFC_FLUSH_IDLE_WINDOW", "2.0"))
+
+# Number of committed versions whose deltas are kept for clients catching up.
+DELTA_HISTORY = int(os.getenv("IFC_DELTA_HISTORY", "50"))
+
+# Share of unreachable entities above which the model is compacted at the end of a turn.
+COMPACTION_THRESHOLD = float(os.getenv("IFC_COMPACTION_THRESHOLD", "0.2"))
+# The orphan check walks the whole model, so it only runs every this many versions.
+COMPACTION_CHECK_EVERY = int(os.getenv("IFC_COMPACTION_CHECK_EVERY", "10"))
+
+# Coordinates closer than this (in model units) share one interned IfcCartesianPoint or IfcDirection.
+INTERN_TOLERANCE = float(os.getenv("IFC_INTERN_TOLERANCE", "1e-6"))
+
+# Bounded pool shared by every session so canvas writes never run on the event loop.
+SAVE_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv(
+    "IFC_SAVE_WORKERS", "4")), thread_name_prefix="ifc-save")
+
 
 O = 0., 0., 0.
 X = 1., 0., 0.
 Y = 0., 1., 0.
 Z = 0., 0., 1.
 
+# Materials every new model starts with: (name, red, green, blue, profile method for support types).
+DEFAULT_MATERIALS = [
+    ("wood", 1, 0.5764705882, 0, "get_rectangle"),
+    ("brick", 1, 0, 0, None),
+    ("concrete", 0.662745098, 0.662745098, 0.662745098, "get_rectangle"),
+    ("steel", 106 / 255, 127 / 255, 169 / 255, "get_steel_shape_profile"),
+]
+
+# Entities of the base model that IfcModel keeps a handle to, rebound by id on every clone.
+BASE_MODEL_HANDLES = ("owner_history", "model_context", "body_context", "site_placement", "site",
+                      "building_placement", "building", "story_placement", "footprint_context")
+
+# Serialized base models, keyed by the constructor arguments that end up in the file.
+_BASE_MODELS = {}
+_BASE_MODELS_LOCK = threading.Lock()
+
+
+def file_from_string(step):
+    """
+    Parses STEP text into an ifcopenshell file in memory. Builds of ifcopenshell without file.from_string
+    parse it from a temporary file instead.
+
+    Parameters:
+    - step: the STEP text, e.g. from ifcfile.to_string().
+
+    Returns:
+    ifcopenshell.file: the parsed file.
+    """
+    if hasattr(ifcopenshell.file, "from_string"):
+        return ifcopenshell.file.from_string(step)
+    temp_handle, temp_filename = tempfile.mkstemp(suffix=".ifc")
+    try:
+        with os.fdopen(temp_handle, "w") as handle:
+            handle.write(step)
+        return ifcopenshell.open(temp_filename)
+    finally:
+        os.remove(temp_filename)
+
 
 class IfcModel:
     def __init__(self, creator, organization, application, application_version, project_name, filename=None):
@@ -49,52 +112,51 @@ class IfcModel:
         self.steel_types = dict()
         self.object_types = dict()
         self.project_globalid = self.create_guid()
-        # 2. If there is no file name provided, create a new file. anad store all the necessary info
+        # Write-behind state: tools mark the model dirty and the file is written once per burst of changes.
+        # lock guards the ifcfile while it is serialized, _save_lock only the bookkeeping below,
+        # and _write_lock keeps two writes of this model from replacing the file out of order.
+        self.lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self.save_path = None
+        self.dirty = False
+        self.flush_idle_window = FLUSH_IDLE_WINDOW
+        self._flush_timer = None
+        self.save_future = None
+        # Open batches: while a batch of tool calls is applied, the idle window does not write the file.
+        self._batch_depth = 0
+        # Change journal: products added, modified and removed since the last committed version.
+        self._journal_lock = threading.RLock()
+        self.version = 0
+        self.announced_version = 0
+        self._pending_changes = OrderedDict()
+        self._change_log = deque(maxlen=DELTA_HISTORY)
+        self.compaction_threshold = COMPACTION_THRESHOLD
+        self._last_compaction_check = 0
+        # Interned points and directions, keyed by their coordinates rounded to intern_tolerance.
+        self.intern_tolerance = INTERN_TOLERANCE
+        self._interned_points = dict()
+        self._interned_directions = dict()
+        self._intern_requests = 0
+        self._intern_created = 0
+        # Representation maps shared by structural members, keyed by (section, length, material).
+        self._member_maps = dict()
+        self._identity_operator = None
+        # Profile definitions shared by members of the same section or rectangle size.
+        self._profiles = dict()
+        # Extracted features, checked against each product's version, which record_modified/removed bump.
+        self._entity_versions = dict()
+        self.feature_cache = FeatureCache(self)
+        # 2. If there is no file name provided, clone the process-wide base model (built on first use).
         if filename is None:
-            self.ifcfile = self.initialize_ifc()
-            self.owner_history = self.ifcfile.by_type("IfcOwnerHistory")[0]
-            self.site_placement = self.create_ifclocalplacement()
-            self.site = self.ifcfile.createIfcSite(self.create_guid(
-            ), self.owner_history, "Site", None, None, self.site_placement, None, None, "ELEMENT", None, None, None, None, None)
-            self.building_placement = self.create_ifclocalplacement(
-                relative_to=self.site_placement)
-            self.building = self.ifcfile.createIfcBuilding(self.create_guid(
-            ), self.owner_history, "Building", None, None, self.building_placement, None, None, "ELEMENT", None, None, None)
-            self.story_placement = self.create_ifclocalplacement(
-                relative_to=self.building_placement)
-            self.building_story_list = []
-
-            # 3. Create the world coordinate system.
-            WorldCoordinateSystem = self.ifcfile.createIfcAxis2Placement3D()
-            WorldCoordinateSystem.Location = self.ifcfile.createIfcCartesianPoint(
-                O)
-            WorldCoordinateSystem.Axis = self.ifcfile.createIfcDirection(Z)
-            WorldCoordinateSystem.RefDirection = self.ifcfile.createIfcDirection(
-                X)
-
-            # 4. Define the context
-            context = self.ifcfile.createIfcGeometricRepresentationContext()
-            context.ContextType = "Model"
-            context.CoordinateSpaceDimension = 3
-            context.Precision = 1.e-05
-            context.WorldCoordinateSystem = WorldCoordinateSystem
-            # 5. Store the rest.
-            self.footprint_context = self.ifcfile.createIfcGeometricRepresentationSubContext()
-            self.footprint_context.ContextIdentifier = 'Footprint'
-            self.footprint_context.ContextType = "Model"
-            self.footprint_context.ParentContext = context
-            self.footprint_context.TargetView = 'MODEL_VIEW'
+            self.clone_base_model()
 
         # 2. Otherwise open the existing file.
         else:
             self.ifcfile = ifcopenshell.open(filename)
+            self.register_contexts()
+            self.add_default_materials()
 
-        self.add_support_type("wood", 1, 0.5764705882, 0, self.get_rectangle)
-        self.add_material("brick", 1, 0, 0)
-        self.add_support_type("concrete", 0.662745098,
-                              0.662745098, 0.662745098, self.get_rectangle)
-        self.add_support_type("steel", 106 / 255, 127 /
-                              255, 169 / 255, self.get_steel_shape_profile)
         # print("Support Types/Materials:", self.support_types, self.materials)
         self.support_types.setdefault(self.get_rectangle)
         self.steel_types["L"] = self.get_lshape_profile
@@ -112,6 +174,128 @@ class IfcModel:
         self.object_types['slab'] = 'IfcSlab'
         self.object_types['floor'] = 'IfcSlab'
         self.object_types['story'] = 'IfcBuildingStorey'
+        # 3. Index the products the file starts with; record_added/modified/removed keep the indexes current.
+        self.rebuild_indexes()
+
+    def build_base_model(self):
+        """
+        Builds the project, site, building, representation contexts and default materials from scratch.
+        """
+        # 1. Start from the project template.
+        self.ifcfile = self.initialize_ifc()
+        self.register_contexts()
+        self.site_placement = self.create_ifclocalplacement()
+        self.site = self.ifcfile.createIfcSite(self.create_guid(
+        ), self.owner_history, "Site", None, None, self.site_placement, None, None, "ELEMENT", None, None, None, None, None)
+        self.building_placement = self.create_ifclocalplacement(
+            relative_to=self.site_placement)
+        self.building = self.ifcfile.createIfcBuilding(self.create_guid(
+        ), self.owner_history, "Building", None, None, self.building_placement, None, None, "ELEMENT", None, None, None)
+        self.story_placement = self.create_ifclocalplacement(
+            relative_to=self.building_placement)
+        self.building_story_list = []
+
+        # 2. Create the world coordinate system.
+        WorldCoordinateSystem = self.ifcfile.createIfcAxis2Placement3D()
+        WorldCoordinateSystem.Location = self.intern_point(
+            O)
+        WorldCoordinateSystem.Axis = self.intern_direction(Z)
+        WorldCoordinateSystem.RefDirection = self.intern_direction(
+            X)
+
+        # 3. Define the context
+        context = self.ifcfile.createIfcGeometricRepresentationContext()
+        context.ContextType = "Model"
+        context.CoordinateSpaceDimension = 3
+        context.Precision = 1.e-05
+        context.WorldCoordinateSystem = WorldCoordinateSystem
+        # 4. Store the rest.
+        self.footprint_context = self.ifcfile.createIfcGeometricRepresentationSubContext()
+        self.footprint_context.ContextIdentifier = 'Footprint'
+        self.footprint_context.ContextType = "Model"
+        self.footprint_context.ParentContext = context
+        self.footprint_context.TargetView = 'MODEL_VIEW'
+
+        # 5. Add the materials every session starts with.
+        self.add_default_materials()
+
+    def register_contexts(self):
+        """
+        Finds the owner history and the project's 3D model context, and the Body subcontext under it, creating
+        the contexts if the file has none. Every creation path uses these handles instead of looking them up.
+        """
+        # 1. The owner history stamped on every new product.
+        owner_histories = self.ifcfile.by_type("IfcOwnerHistory")
+        self.owner_history = owner_histories[0] if owner_histories else None
+
+        # 2. The project's 3D model context.
+        self.model_context = None
+        for project in self.ifcfile.by_type("IfcProject"):
+            for context in project.RepresentationContexts or ():
+                if context.is_a("IfcGeometricRepresentationContext") and context.ContextType == "Model":
+                    self.model_context = context
+                    break
+        if self.model_context is None:
+            self.model_context = ifcopenshell.api.context.add_context(
+                self.ifcfile, context_type="Model")
+
+        # 3. The Body subcontext product shapes and material styles live in.
+        self.body_context = None
+        for context in self.ifcfile.by_type("IfcGeometricRepresentationSubContext"):
+            if context.ContextIdentifier == "Body" and context.ParentContext == self.model_context:
+                self.body_context = context
+                break
+        if self.body_context is None:
+            self.body_context = ifcopenshell.api.context.add_context(self.ifcfile, context_type="Model", context_identifier="Body",
+                                                                     target_view="MODEL_VIEW", parent=self.model_context)
+
+    def clone_base_model(self):
+        """
+        Gives this model its own copy of the base model for its creator and project, building the base the
+        first time it is asked for. Cloning parses the base's STEP text in memory, which is much cheaper than
+        creating the site, building, contexts and styled materials through the API for every session.
+        """
+        key = (self.creator, self.organization, self.application,
+               self.application_version, self.project_name)
+        # 1. The first model for a key is built from scratch and becomes the base for the rest.
+        with _BASE_MODELS_LOCK:
+            base = _BASE_MODELS.get(key)
+            if base is None:
+                self.build_base_model()
+                _BASE_MODELS[key] = {
+                    "step": self.ifcfile.to_string(),
+                    "handles": {name: getattr(self, name).id() for name in BASE_MODEL_HANDLES},
+                    "materials": {name: (material.id(), style.id()) for name, (material, style) in self.materials.items()},
+                }
+                return
+
+        # 2. Parse the copy and point the handles at its entities.
+        self.ifcfile = file_from_string(base["step"])
+        for name, entity_id in base["handles"].items():
+            setattr(self, name, self.ifcfile.by_id(entity_id))
+        self.building_story_list = []
+        for name, (material_id, style_id) in base["materials"].items():
+            self.materials[name] = (self.ifcfile.by_id(
+                material_id), self.ifcfile.by_id(style_id))
+        for name, red, green, blue, shaper in DEFAULT_MATERIALS:
+            if shaper is not None:
+                self.support_types[name] = getattr(self, shaper)
+
+        # 3. A session's project, site and building must not share GlobalIds with any other session's.
+        for root in self.ifcfile.by_type("IfcRoot"):
+            root.GlobalId = self.create_guid()
+        self.ifcfile.by_type("IfcProject")[0].GlobalId = self.project_globalid
+        self.owner_history.CreationDate = int(self.timestamp)
+
+    def add_default_materials(self):
+        """
+        Adds the materials and support types in DEFAULT_MATERIALS to the model.
+        """
+        for name, red, green, blue, shaper in DEFAULT_MATERIALS:
+            if shaper is None:
+                self.add_material(name, red, green, blue)
+            else:
+                self.add_support_type(name, red, green, blue, getattr(self, shaper))
 
     def add_material(self, name, red, green, blue):
         style = ifcopenshell.api.style.add_style(self.ifcfile)
@@ -119,6 +303,9 @@ class IfcModel:
         ifcopenshell.api.style.add_surface_style(self.ifcfile, style=style, ifc_class="IfcSurfaceStyleShading", attributes={
             "SurfaceColour": {"Name": None, "Red": red, "Green": green, "Blue": blue}
         })
+        # The style belongs to the material, so it is assigned once here rather than for every product.
+        ifcopenshell.api.style.assign_material_style(
+            self.ifcfile, material=material, style=style, context=self.body_context)
         self.materials[name] = (material, style)
         return self.materials[name]
 
@@ -177,12 +364,70 @@ class IfcModel:
             "project_name": self.project_name
         }
 
-        temp_handle, temp_filename = tempfile.mkstemp(suffix=".ifc")
-        with open(temp_filename, "w") as f:
-            f.write(template)
+        return file_from_string(template)
+
+    def intern_point(self, coordinates):
+        """
+        Returns the model's IfcCartesianPoint at the given coordinates, creating it the first time. Points are
+        immutable once created, so every placement, polyline and profile at the same spot shares one.
+
+        Parameters:
+        - coordinates: the 2D or 3D coordinates of the point.
+        """
+        return self._intern("IfcCartesianPoint", self._interned_points, coordinates)
+
+    def intern_direction(self, ratios):
+        """
+        Returns the model's IfcDirection with the given direction ratios, creating it the first time.
+
+        Parameters:
+        - ratios: the 2D or 3D direction ratios.
+        """
+        return self._intern("IfcDirection", self._interned_directions, ratios)
+
+    def _intern(self, ifc_class, table, values):
+        """
+        Looks up a primitive by its values rounded to the interning tolerance, and creates it if it is missing.
+        """
+        values = tuple(float(value) for value in values)
+        key = tuple(round(value / self.intern_tolerance) for value in values)
+        self._intern_requests += 1
+        entity = table.get(key)
+        if entity is None:
+            entity = self.ifcfile.create_entity(ifc_class, values)
+            table[key] = entity
+            self._intern_created += 1
+        return entity
+
+    def interning_stats(self):
+        """
+        Returns how many primitives were asked for, how many had to be created and the share that was shared.
+        """
+        requests = self._intern_requests
+        return {
+            "requests": requests,
+            "created": self._intern_created,
+            "points": len(self._interned_points),
+            "directions": len(self._interned_directions),
+            "dedup_ratio": 1 - self._intern_created / requests if requests else 0.0,
+        }
+
+    def _invalidate_caches(self, removed_ids):
+        """
+        Drops cached handles to entities that were just removed from the file.
 
-        ifcfile = ifcopenshell.open(temp_filename)
-        return ifcfile
+        Parameters:
+        - removed_ids: the ids of the removed entities.
+        """
+        if not removed_ids:
+            return
+        for table in (self._interned_points, self._interned_directions, self._member_maps, self._profiles):
+            for key in [key for key, entity in table.items() if entity.id() in removed_ids]:
+                del table[key]
+        if self._identity_operator is not None and self._identity_operator.id() in removed_ids:
+            self._identity_operator = None
+        for entity_id in removed_ids:
+            self.feature_cache.invalidate(entity_id)
 
     def create_ifcaxis2placement(self, point=(0., 0., 0.), dir1=(0., 0., 1.), dir2=(1., 0., 0.)):
         """
@@ -194,9 +439,9 @@ class IfcModel:
         - dir2: the second 3D directional vector. Defaults to the x-unit vector.
         """
         # 1. Create the IFC file representations of the point and directions.
-        point = self.ifcfile.createIfcCartesianPoint(point)
-        dir1 = self.ifcfile.createIfcDirection(dir1)
-        dir2 = self.ifcfile.createIfcDirection(dir2)
+        point = self.intern_point(point)
+        dir1 = self.intern_direction(dir1)
+        dir2 = self.intern_direction(dir2)
         # 2. Combine the representations and return them.
         axis2placement = self.ifcfile.createIfcAxis2Placement3D(
             point, dir1, dir2)
@@ -227,7 +472,7 @@ class IfcModel:
         - point_list: the points to be connected.
         """
         # 1. Creates the IFC representation of the point list.
-        ifcpts = [self.ifcfile.createIfcCartesianPoint(
+        ifcpts = [self.intern_point(
             point) for point in point_list]
         # 2. Creates the IFC file version of the line and returns it.
         polyline = self.ifcfile.createIfcPolyLine(ifcpts)
@@ -248,7 +493,7 @@ class IfcModel:
         ifcclosedprofile = self.ifcfile.createIfcArbitraryClosedProfileDef(
             "AREA", None, polyline)
         # 2. Create the IFC representation of the extrusion direction.
-        ifcdir = self.ifcfile.createIfcDirection(extrude_dir)
+        ifcdir = self.intern_direction(extrude_dir)
         # 3. Create and return the solid in its place
         ifcextrudedareasolid = self.ifcfile.createIfcExtrudedAreaSolid(
             ifcclosedprofile, ifcaxis2placement, ifcdir, extrusion)
@@ -269,6 +514,7 @@ class IfcModel:
         building_story = self.ifcfile.createIfcBuildingStorey(self.create_guid(), self.owner_history, str(
             name), None, None, story_placement, None, None, "ELEMENT", float(elevation))
         self.building_story_list.append(building_story)
+        self.record_added(building_story)
 
     def create_wall(self, context, owner_history, wall_placement, length, height, thickness, material):
         """
@@ -323,22 +569,11 @@ class IfcModel:
         - height: how tall the column is.
         - section_name: the name of the section.
         """
-        # 1. Create the column profile
-        ifcclosedprofile = self.get_wshape_profile(section_name)
-        # print('IFC Closed Profile: ', dir(ifcclosedprofile))
-        ifcclosedprofile.ProfileName = section_name
-        # 2. Create the 3D extrusion.
-        extrusion_placement = self.create_ifcaxis2placement()
-        ifcdir = self.ifcfile.createIfcDirection((0.0, 0.0, 1.0))
-        solid = self.ifcfile.createIfcExtrudedAreaSolid(
-            ifcclosedprofile, extrusion_placement, ifcdir, height)
-        # 3. Create the shape representation.
-        body_rep = self.ifcfile.createIfcShapeRepresentation(
-            context, "Body", "SweptSolid", [solid])
-        # 4. Create the product shape.
-        product_shape = self.ifcfile.createIfcProductDefinitionShape(None, None, [
-                                                                     body_rep])
-        # 4. Create the final column and return it
+        # 1. Share the extruded section with every column of the same section, height and material.
+        member_map = self.get_member_map(context, section_name, height, material)
+        # 2. Instance it through a mapped item; the column placement positions it.
+        product_shape = self.create_mapped_shape(context, member_map)
+        # 3. Create the final column and return it
         column = self.ifcfile.createIfcColumn(self.create_guid(
         ), owner_history, "W-Shaped Column", None, None, column_placement, product_shape, None)
         self.add_style_to_product(material, column)
@@ -355,31 +590,64 @@ class IfcModel:
         - length: how long the beam is.
         - section_name: the name of the section.
         """
-        # 1. Create the beam profile
-        point_list = self.get_wshape_points(section_name)
-
-        # 2. Create extrusion
-        extrusion_placement = self.create_ifcaxis2placement()
-        # solid = self.create_ifcextrudedareasolid(
-        #     point_list, extrusion_placement, (1.0, 0.0, 0.0), length)
-
-        solid = self.create_ifcextrudedareasolid(
-            point_list, extrusion_placement, (0.0, 1.0, 0.0), length)
-
-        # 3. Create shape representation
-        body_rep = self.ifcfile.createIfcShapeRepresentation(
-            context, "Body", "SweptSolid", [solid])
+        # 1. Share the extruded section with every member of the same section, length and material.
+        # The beam placement's axis runs along the beam, so the section is extruded along local Z like a column.
+        member_map = self.get_member_map(context, section_name, length, material)
 
-        # 4. Create product shape
-        product_shape = self.ifcfile.createIfcProductDefinitionShape(None, None, [
-                                                                     body_rep])
+        # 2. Instance it through a mapped item.
+        product_shape = self.create_mapped_shape(context, member_map)
 
-        # 5. Create the beam and return it
+        # 3. Create the beam and return it
         beam = self.ifcfile.createIfcBeam(self.create_guid(), owner_history, "Beam", None, None,
                                           beam_placement, product_shape, None)
         self.add_style_to_product(material, beam)
         return beam
 
+    def get_member_map(self, context, section_name, length, material):
+        """
+        Returns the representation map of a structural member, creating it the first time the section,
+        length and material are asked for. Every column and beam with the same key instances this one map.
+
+        Parameters:
+        - context: the representation context of the member's body.
+        - section_name: the name of the section.
+        - length: how long the member is, along its local Z axis.
+        - material: the member's material.
+        """
+        key = (section_name, round(float(length) / self.intern_tolerance), material)
+        member_map = self._member_maps.get(key)
+        if member_map is None:
+            # 1. Extrude the section profile along local Z.
+            ifcclosedprofile = self.get_steel_shape_profile(section_name, length, None)
+            solid = self.ifcfile.createIfcExtrudedAreaSolid(
+                ifcclosedprofile, self.create_ifcaxis2placement(), self.intern_direction(Z), float(length))
+            # 2. Wrap the solid in a map whose origin is the member's own placement.
+            body_rep = self.ifcfile.createIfcShapeRepresentation(
+                context, "Body", "SweptSolid", [solid])
+            member_map = self.ifcfile.createIfcRepresentationMap(
+                self.create_ifcaxis2placement(), body_rep)
+            self._member_maps[key] = member_map
+        return member_map
+
+    def create_mapped_shape(self, context, representation_map):
+        """
+        Creates and returns a product shape that instances a representation map in place.
+
+        Parameters:
+        - context: the representation context of the product's body.
+        - representation_map: the map to instance.
+        """
+        # 1. The product placement already positions the instance, so every mapped item shares one identity transform.
+        if self._identity_operator is None:
+            self._identity_operator = self.ifcfile.createIfcCartesianTransformationOperator3D(
+                None, None, self.intern_point(O), None, None)
+        mapped_item = self.ifcfile.createIfcMappedItem(
+            representation_map, self._identity_operator)
+        # 2. Wrap the mapped item in the product's own shape.
+        body_rep = self.ifcfile.createIfcShapeRepresentation(
+            context, "Body", "MappedRepresentation", [mapped_item])
+        return self.ifcfile.createIfcProductDefinitionShape(None, None, [body_rep])
+
     def create_isolated_footing(self, location: tuple, length: float, width: float, thickness: float) -> None:
         """
         Creates an IFC footing entity with the specified parameters.
@@ -392,9 +660,8 @@ class IfcModel:
         """
         try:
             # Get geometric representation context (not the storey)
-            context = self.ifcfile.by_type(
-                "IfcGeometricRepresentationContext")[0]
-            owner_history = self.ifcfile.by_type("IfcOwnerHistory")[0]
+            context = self.model_context
+            owner_history = self.owner_history
 
             # Create footing entity
             footing = self.ifcfile.create_entity("IfcFooting", GlobalId=self.create_guid(
@@ -408,15 +675,15 @@ class IfcModel:
             half_length = float(length / 2)
             half_width = float(width / 2)
             points = [
-                self.ifcfile.createIfcCartesianPoint(
+                self.intern_point(
                     (-half_length, -half_width, 0.0)),
-                self.ifcfile.createIfcCartesianPoint(
+                self.intern_point(
                     (half_length, -half_width, 0.0)),
-                self.ifcfile.createIfcCartesianPoint(
+                self.intern_point(
                     (half_length, half_width, 0.0)),
-                self.ifcfile.createIfcCartesianPoint(
+                self.intern_point(
                     (half_length, half_width, 0.0)),
-                self.ifcfile.createIfcCartesianPoint(
+                self.intern_point(
                     (-half_length, half_width, 0.0))
             ]
 
@@ -424,12 +691,12 @@ class IfcModel:
             footing_line = self.ifcfile.createIfcPolyline(Points=points)
             footing_profile = self.ifcfile.createIfcArbitraryClosedProfileDef(
                 ProfileType="AREA", ProfileName=None, OuterCurve=footing_line)
-            ifc_direction = self.ifcfile.createIfcDirection((0.0, 0.0, 1.0))
+            ifc_direction = self.intern_direction((0.0, 0.0, 1.0))
 
             # Create local axis placement
-            point = self.ifcfile.createIfcCartesianPoint([0.0, 0.0, 0.0])
-            dir1 = self.ifcfile.createIfcDirection((0.0, 0.0, 1.0))
-            dir2 = self.ifcfile.createIfcDirection((1.0, 0.0, 0.0))
+            point = self.intern_point([0.0, 0.0, 0.0])
+            dir1 = self.intern_direction((0.0, 0.0, 1.0))
+            dir2 = self.intern_direction((1.0, 0.0, 0.0))
             axis2placement = self.ifcfile.createIfcAxis2Placement3D(
                 Location=point, Axis=dir1, RefDirection=dir2)
 
@@ -463,19 +730,18 @@ class IfcModel:
         """
         try:
             # Get geometric representation context (not the storey)
-            context = self.ifcfile.by_type(
-                "IfcGeometricRepresentationContext")[0]
-            owner_history = self.ifcfile.by_type("IfcOwnerHistory")[0]
+            context = self.model_context
+            owner_history = self.owner_history
 
             # Create footing entity
             footing = self.ifcfile.create_entity("IfcFooting", GlobalId=self.create_guid(
             ), OwnerHistory=owner_history, Name="Continuous Footing", ObjectPlacement=None, Representation=None, Tag=None, PredefinedType="FOOTING_BEAM")
 
             # Calculate direction and length
-            direction = self.ifcfile.createIfcDirection(
+            direction = self.intern_direction(
                 self.calc_direction(start_point, end_point))
             length = self.calc_length(start_point, end_point)
-            crossprod = self.ifcfile.createIfcDirection(
+            crossprod = self.intern_direction(
                 self.calc_cross(self.calc_direction(start_point, end_point), Z))
 
             # Create local placement for the footing
@@ -487,23 +753,23 @@ class IfcModel:
             half_width = width / 2
             length = float(length)
             points = [
-                self.ifcfile.createIfcCartesianPoint((0.0, -half_width, 0.0)),
-                self.ifcfile.createIfcCartesianPoint(
+                self.intern_point((0.0, -half_width, 0.0)),
+                self.intern_point(
                     (length, -half_width, 0.0)),
-                self.ifcfile.createIfcCartesianPoint(
+                self.intern_point(
                     (length, half_width, 0.0)),
-                self.ifcfile.createIfcCartesianPoint((0.0, half_width, 0.0)),
-                self.ifcfile.createIfcCartesianPoint((0.0, -half_width, 0.0))
+                self.intern_point((0.0, half_width, 0.0)),
+                self.intern_point((0.0, -half_width, 0.0))
             ]
 
             # Create boundary polyline
             footing_line = self.ifcfile.createIfcPolyline(Points=points)
             footing_profile = self.ifcfile.createIfcArbitraryClosedProfileDef(
                 ProfileType="AREA", ProfileName=None, OuterCurve=footing_line)
-            ifc_direction = self.ifcfile.createIfcDirection((0.0, 0.0, 1.0))
+            ifc_direction = self.intern_direction((0.0, 0.0, 1.0))
 
             # Create local axis placement
-            start = self.ifcfile.createIfcCartesianPoint(start_point)
+            start = self.intern_point(start_point)
             axis2placement = self.ifcfile.createIfcAxis2Placement3D(
                 start, Axis=direction, RefDirection=crossprod)
 
@@ -540,9 +806,8 @@ class IfcModel:
             print(
                 f"Wall: {wall}, Width: {width}, Height: {height}, Depth: {depth}, Void Location: {void_location}")
             # Get geometric representation context
-            context = self.ifcfile.by_type(
-                "IfcGeometricRepresentationContext")[0]
-            owner_history = self.ifcfile.by_type("IfcOwnerHistory")[0]
+            context = self.model_context
+            owner_history = self.owner_history
 
             # pdb.set_trace()
             wall_placement = wall.ObjectPlacement  # Get wall placement
@@ -615,6 +880,8 @@ class IfcModel:
                 print(
                     f"An error occurred while relating the opening element to the wall: {e}")
                 raise
+            self.record_added(opening_element)
+            self.record_modified(wall)
 
             # # Now create the window within the void
             # try:
@@ -732,9 +999,9 @@ class IfcModel:
         """
 
         # 1. Create the points for the polyline.
-        pnt1 = self.ifcfile.createIfcCartesianPoint(
+        pnt1 = self.intern_point(
             (grid_info['distance'], xMin))
-        pnt2 = self.ifcfile.createIfcCartesianPoint(
+        pnt2 = self.intern_point(
             (grid_info['distance'], xMax))
         # 2. Create the polyline based on the point.
         line = self.ifcfile.createIfcPolyline([pnt1, pnt2])
@@ -781,105 +1048,888 @@ class IfcModel:
 
     def save_ifc(self, filename):
         """
-        Save self to the given filename.
+        Save self to the given filename. The write runs on the shared save pool: the model is
+        written to a temporary file next to the target and renamed into place, so readers never
+        see a half-written file.
 
         Parameters:
         - filename: the name of the file to save to.
+
+        Returns:
+        Future: resolves once the file is in place. Also kept as self.save_future.
+        """
+        with self._save_lock:
+            self.save_path = filename
+            self.dirty = False
+            # 1. A save that has not started yet will serialize the current state anyway.
+            pending = self.save_future
+            if pending is not None and not pending.running() and not pending.done() \
+                    and getattr(pending, "filename", None) == filename:
+                return pending
+            # 2. Otherwise queue a new write.
+            future = SAVE_EXECUTOR.submit(self._write_atomic, filename)
+            future.filename = filename
+            future.add_done_callback(self._on_save_done)
+            self.save_future = future
+            return future
+
+    def _write_atomic(self, filename):
         """
-        self.ifcfile.write(filename)
+        Writes the model to a temporary file and renames it over the given filename.
 
-    def get_steel_shape_profile(self, section_name, length, width):
+        Parameters:
+        - filename: the name of the file to save to.
         """
-        Returns the shape of the specified section.
+        directory = os.path.dirname(filename) or "."
+        os.makedirs(directory, exist_ok=True)
+        with self._write_lock:
+            temp_handle, temp_filename = tempfile.mkstemp(
+                prefix=".canvas-", suffix=".ifc", dir=directory)
+            os.close(temp_handle)
+            try:
+                # Tools change the ifcfile while holding the same lock (see tools_graph.locked_model).
+                with self.lock:
+                    self.ifcfile.write(temp_filename)
+                os.replace(temp_filename, filename)
+            except Exception:
+                if os.path.exists(temp_filename):
+                    os.remove(temp_filename)
+                raise
+        return filename
+
+    def _on_save_done(self, future):
+        """
+        Puts the model back to dirty if its write failed so the next flush retries it.
+        """
+        if future.cancelled():
+            return
+        error = future.exception()
+        if error is not None:
+            print(f"An error occurred while saving {future.filename}: {error}")
+            with self._save_lock:
+                self.dirty = True
+
+    def mark_dirty(self, filename=None):
+        """
+        Records that the model changed without writing it. The file is written by the next flush,
+        which happens at the end of the turn, after the idle window, or when a reader needs the file.
 
         Parameters:
-        - section_name: the name of the section to get the shape of.
+        - filename: the file the model should be flushed to. Defaults to the last saved path.
+        """
+        with self._save_lock:
+            if filename is not None:
+                self.save_path = filename
+            self.dirty = True
+            # 1. Restart the idle window so a burst of tool calls ends in a single write.
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self.flush_idle_window and self.flush_idle_window > 0 and self._batch_depth == 0:
+                self._flush_timer = threading.Timer(
+                    self.flush_idle_window, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+
+    def begin_batch(self, snapshot=True, full=True):
+        """
+        Starts applying a batch of changes, e.g. every tool call of one AI message. Until end_batch the idle
+        window does not write the file, so a half-applied batch is never saved or announced.
+
+        Parameters:
+        - snapshot: whether to take a snapshot to roll back to.
+        - full: whether the snapshot serializes the whole file. Otherwise it only records the highest entity id,
+          which is enough to undo a batch that only added to the file.
+
+        Returns:
+        dict: the snapshot for end_batch(rollback_to=...), or None.
+        """
+        with self._save_lock:
+            self._batch_depth += 1
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+        # Flushes queued from now on wait for end_batch. One queued before must finish serializing the file
+        # before the batch changes it; a flush holds the file lock until its save is queued.
+        with self.lock:
+            pending = self.save_future
+        if pending is not None:
+            wait_futures([pending])
+        return self.snapshot(full) if snapshot else None
+
+    def end_batch(self, rollback_to=None):
+        """
+        Ends a batch started by begin_batch, first undoing it if it failed.
+
+        Parameters:
+        - rollback_to: the snapshot begin_batch returned, to discard the batch's changes. None keeps them.
         """
-        # 1. Read in the csv file with profile data.
         try:
-            wshapes_df = pd.read_csv(
-                "aisc-shapes-database-v15.0.csv", encoding='utf-8')
-        except UnicodeDecodeError:
+            if rollback_to is not None:
+                self.restore_snapshot(rollback_to)
+        finally:
+            with self._save_lock:
+                self._batch_depth = max(self._batch_depth - 1, 0)
+                restart_window = self._batch_depth == 0 and self.dirty
+            # Changes made during the batch start their idle window now.
+            if restart_window:
+                self.mark_dirty()
+
+    def flush(self, wait=False):
+        """
+        Queues a write of the model if it changed since the last save.
+        Must be called before anything reads the file from disk. While a batch is being applied nothing is
+        written, since the batch may still be rolled back; end_batch restarts the save window.
+
+        Parameters:
+        - wait: block until the file is in place. Only for callers that are not on the event loop.
+
+        Returns:
+        Future: the latest save of this model (None if it was never saved). Async callers
+        await it with asyncio.wrap_future before telling a reader about the file.
+        """
+        # Under the file lock, a batch cannot start changing the file between the check and the queued save.
+        with self.lock:
+            with self._save_lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                save_path = self.save_path if self.dirty and self._batch_depth == 0 else None
+            if save_path is not None:
+                self.commit_version()
+                future = self.save_ifc(save_path)
+            else:
+                future = self.save_future
+        if wait and future is not None:
+            future.result()
+        return future
+
+    def close(self):
+        """
+        Drops any pending write, e.g. when the session's directory is being removed.
+        """
+        with self._save_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            self.dirty = False
+            if self.save_future is not None:
+                self.save_future.cancel()
+
+    def _protected_ids(self):
+        """
+        Returns the ids of the entities the model keeps handles to. They are never removed
+        as a dependent of something else.
+        """
+        handles = [getattr(self, name, None) for name in (
+            "owner_history", "model_context", "body_context", "site_placement", "site", "building_placement",
+            "building", "story_placement", "footprint_context")]
+        handles.extend(getattr(self, "building_story_list", []))
+        for material, style in self.materials.values():
+            handles.extend((material, style))
+        return {handle.id() for handle in handles if handle is not None}
+
+    def _is_emptied_by(self, relationship, doomed):
+        """
+        Checks whether a relationship would lose one of its sides if the doomed entities were removed.
+
+        Parameters:
+        - relationship: the IfcRelationship to check.
+        - doomed: ids of the entities about to be removed.
+        """
+        for index in range(len(relationship)):
+            if relationship.attribute_name(index) == "OwnerHistory":
+                continue
+            value = relationship[index]
+            if isinstance(value, ifcopenshell.entity_instance):
+                if value.id() in doomed:
+                    return True
+            elif isinstance(value, tuple) and value and isinstance(value[0], ifcopenshell.entity_instance):
+                if all(item.id() in doomed for item in value):
+                    return True
+        return False
+
+    def remove_products(self, guids):
+        """
+        Removes products together with everything only they use (placements, representations,
+        profiles, openings) and the relationships they leave empty, in one batch, and marks the
+        model dirty once.
+
+        Parameters:
+        - guids: the GlobalIds of the products to remove.
+
+        Returns:
+        list: the GlobalIds that were removed. Ids not in the model are skipped.
+        """
+        # Held for the whole removal so a save never serializes a half-removed model.
+        with self.lock:
+            return self._remove_products(guids)
+
+    def _remove_products(self, guids):
+        # 1. Resolve the targets, including the openings cut into them.
+        targets = OrderedDict()
+        queue = [str(guid).strip() for guid in guids]
+        while queue:
+            guid = queue.pop(0)
+            if guid in targets:
+                continue
             try:
-                wshapes_df = pd.read_csv(
-                    "aisc-shapes-database-v15.0.csv", encoding='ISO-8859-1')
-            except FileNotFoundError:
-                print('File not found: aisc-shapes-database-v15.0.csv')
-                raise
-            except Exception as e:
-                print(
-                    f'An unexpected error occurred while reading the file with ISO-8859-1 encoding: {e}')
-                raise
-        except FileNotFoundError:
-            print('File not found: aisc-shapes-database-v15.0.csv')
-            raise
-        except Exception as e:
-            print(
-                f'An unexpected error occurred while reading the file with utf-8 encoding: {e}')
-            raise
+                product = self.ifcfile.by_guid(guid)
+            except RuntimeError:
+                print(f"No product found with GlobalId: {guid}")
+                continue
+            targets[guid] = product
+            for opening_rel in getattr(product, "HasOpenings", None) or ():
+                queue.append(opening_rel.RelatedOpeningElement.GlobalId)
+        if not targets:
+            return []
+        doomed = OrderedDict((product.id(), product)
+                             for product in targets.values())
+
+        # 2. Relationships left with an empty side go with them. Each is checked once, however many of
+        #    the targets it relates (a storey's containment can relate thousands).
+        relationships = OrderedDict()
+        for product in targets.values():
+            for inverse in self.ifcfile.get_inverse(product):
+                if inverse.is_a("IfcRelationship") and inverse.id() not in doomed:
+                    relationships[inverse.id()] = inverse
+        for relationship_id, relationship in relationships.items():
+            if self._is_emptied_by(relationship, doomed):
+                doomed[relationship_id] = relationship
+
+        # 3. Everything they reference goes too, unless something that stays still uses it
+        #    (shared geometry, storeys, materials, the owner history...).
+        protected = self._protected_ids()
+        candidates = OrderedDict()
+        for entity in list(doomed.values()):
+            for child in self.ifcfile.traverse(entity):
+                child_id = child.id()
+                if child_id == 0 or child_id in doomed or child_id in protected:
+                    continue
+                if child.is_a("IfcRoot") and not child.is_a("IfcTypeObject"):
+                    continue
+                candidates[child_id] = child
+        referrers = {entity_id: [inverse.id() for inverse in self.ifcfile.get_inverse(entity)]
+                     for entity_id, entity in candidates.items()}
+        changed = True
+        while changed:
+            changed = False
+            for entity_id in list(candidates):
+                if all(referrer in doomed for referrer in referrers[entity_id]):
+                    doomed[entity_id] = candidates.pop(entity_id)
+                    changed = True
+
+        # 4. Journal and remove in one pass, referrers before what they reference.
+        for product in targets.values():
+            self.record_removed(product)
+        if hasattr(self, "building_story_list"):
+            self.building_story_list = [
+                story for story in self.building_story_list if story.id() not in doomed]
+        self._invalidate_caches(set(doomed))
+        for entity in doomed.values():
+            self.ifcfile.remove(entity)
+        self.mark_dirty()
+        return list(targets)
+
+    def _mark_reachable(self, roots, live):
+        """
+        Adds the ids of the roots and everything they reference to the live set.
 
-        # 2. Get the necessary dimensions.
-        section_data = wshapes_df[wshapes_df["AISC_Manual_Label"]
-                                  == section_name]
+        Parameters:
+        - roots: the entities to start from.
+        - live: the set of live entity ids, updated in place.
+        """
+        stack = list(roots)
+        while stack:
+            entity = stack.pop()
+            entity_id = entity.id()
+            if entity_id in live:
+                continue
+            live.add(entity_id)
+            for child in self.ifcfile.traverse(entity, max_levels=1):
+                if child.id() and child.id() not in live:
+                    stack.append(child)
+
+    def _is_attached(self, relationship, live):
+        """
+        Checks whether a relationship still connects live objects: at least one of the objects it
+        relates is live and none of its single-object sides points at a dead one.
 
-        if not section_data.empty:  # check that section exists in database
-            if self.steel_types[section_name[0]] != None:
-                return self.steel_types[section_name[0]](section_data, section_name)
+        Parameters:
+        - relationship: the IfcRelationship to check.
+        - live: the set of live entity ids.
+        """
+        attached = False
+        for index in range(len(relationship)):
+            if relationship.attribute_name(index) == "OwnerHistory":
+                continue
+            value = relationship[index]
+            if isinstance(value, ifcopenshell.entity_instance):
+                if value.is_a("IfcObject"):
+                    if value.id() not in live:
+                        return False
+                    attached = True
+            elif isinstance(value, tuple):
+                if any(isinstance(item, ifcopenshell.entity_instance) and item.is_a("IfcObject")
+                       and item.id() in live for item in value):
+                    attached = True
+        return attached
+
+    def _is_placed(self, product):
+        """
+        Checks whether a product is part of the model's structure rather than left over
+        from a tool call that failed before it was contained.
+
+        Parameters:
+        - product: the IfcProduct to check.
+        """
+        if product.is_a("IfcSpatialStructureElement"):
+            return True
+        for inverse_name, relating_name in (("ContainedInStructure", "RelatingStructure"), ("Decomposes", "RelatingObject"),
+                                            ("VoidsElements", "RelatingBuildingElement"), ("FillsVoids", "RelatingOpeningElement")):
+            for relationship in getattr(product, inverse_name, None) or ():
+                if getattr(relationship, relating_name, None) is not None:
+                    return True
+        return False
+
+    def find_orphans(self):
+        """
+        Sweeps the model from IfcProject, the placed products and the model's own handles,
+        following the relationships and presentation items that hang off live entities.
+
+        Returns:
+        tuple: (unreachable entities, total number of entities).
+        """
+        live = set()
+        # 1. Roots: the project, placed products and the handles the model keeps.
+        roots = list(self.ifcfile.by_type("IfcProject"))
+        roots.extend(product for product in self.ifcfile.by_type(
+            "IfcProduct") if self._is_placed(product))
+        roots.extend(self.ifcfile.by_id(entity_id)
+                     for entity_id in self._protected_ids())
+        self._mark_reachable(roots, live)
+
+        # 2. Relationships and presentation items are live when what they attach to is live.
+        attachments = list(self.ifcfile.by_type("IfcRelationship"))
+        for ifc_class in ("IfcMaterialDefinitionRepresentation", "IfcStyledItem", "IfcPresentationLayerAssignment"):
+            attachments.extend(self.ifcfile.by_type(ifc_class))
+        changed = True
+        while changed:
+            changed = False
+            for attachment in attachments:
+                if attachment.id() in live:
+                    continue
+                if attachment.is_a("IfcRelationship"):
+                    attached = self._is_attached(attachment, live)
+                elif attachment.is_a("IfcMaterialDefinitionRepresentation"):
+                    attached = attachment.RepresentedMaterial is not None and attachment.RepresentedMaterial.id() in live
+                elif attachment.is_a("IfcStyledItem"):
+                    attached = attachment.Item is not None and attachment.Item.id() in live
+                else:
+                    attached = any(item.id() in live for item in attachment.AssignedItems or ())
+                if attached:
+                    self._mark_reachable([attachment], live)
+                    changed = True
+
+        # 3. Whatever was not reached is an orphan.
+        orphans = []
+        total = 0
+        for entity in self.ifcfile:
+            total += 1
+            if entity.id() not in live:
+                orphans.append(entity)
+        return orphans, total
+
+    def compact(self, threshold=None):
+        """
+        Removes every entity that is no longer reachable from the project or a placed product.
+
+        Parameters:
+        - threshold: only compact when the share of orphaned entities is above this. Defaults to always.
+
+        Returns:
+        dict: entities before, entities and bytes reclaimed, the orphan ratio and whether it ran.
+        """
+        orphans, total = self.find_orphans()
+        ratio = len(orphans) / total if total else 0.0
+        report = {"entities_before": total, "entities_reclaimed": 0,
+                  "bytes_reclaimed": 0, "orphan_ratio": ratio, "compacted": False}
+        if not orphans or (threshold is not None and ratio < threshold):
+            return report
+        # 1. Size the orphans as they would have been written, then drop them.
+        report["bytes_reclaimed"] = sum(
+            len(str(entity)) + 1 for entity in orphans)
+        for entity in orphans:
+            if entity.is_a("IfcProduct"):
+                self.record_removed(entity)
+        self._invalidate_caches({entity.id() for entity in orphans})
+        for entity in orphans:
+            self.ifcfile.remove(entity)
+        report["entities_reclaimed"] = len(orphans)
+        report["compacted"] = True
+        self.mark_dirty()
+        print(
+            f"Compacted IFC model: {len(orphans)}/{total} entities, {report['bytes_reclaimed']} bytes reclaimed")
+        return report
+
+    def maybe_compact(self):
+        """
+        Compacts the model if enough versions went by since the last check and the orphan ratio
+        is above the threshold. Only call when no tool is changing the model, e.g. at the end of a turn.
+
+        Returns:
+        dict: the compaction report, or None if the check was skipped.
+        """
+        if self.version - self._last_compaction_check < COMPACTION_CHECK_EVERY:
+            return None
+        self._last_compaction_check = self.version
+        with self.lock:
+            return self.compact(threshold=self.compaction_threshold)
+
+    def record_added(self, product):
+        """
+        Records a product created since the last version.
+
+        Parameters:
+        - product: the new IfcProduct.
+        """
+        with self._journal_lock:
+            self._pending_changes[product.GlobalId] = "added"
+            self._index_product(product)
+
+    def record_modified(self, product):
+        """
+        Records a product whose attributes, placement or representation changed.
+
+        Parameters:
+        - product: the changed IfcProduct.
+        """
+        with self._journal_lock:
+            if self._pending_changes.get(product.GlobalId) != "added":
+                self._pending_changes[product.GlobalId] = "modified"
+            self._bump_version(product.GlobalId)
+            if product.is_a("IfcBuildingStorey"):
+                # Contained products report their storey's name.
+                for guid in self._products_by_storey.get(product.GlobalId, {}):
+                    self._bump_version(guid)
+            self._index_product(product)
+
+    def record_removed(self, product):
+        """
+        Records a product that is about to be removed. Must be called before ifcfile.remove.
+
+        Parameters:
+        - product: the IfcProduct being removed.
+        """
+        with self._journal_lock:
+            if self._pending_changes.get(product.GlobalId) == "added":
+                # Never made it into a version, so clients have nothing to drop.
+                del self._pending_changes[product.GlobalId]
             else:
-                raise NotImplementedError(
-                    f"AISC Shape Type {section_name[0]} not implemented for use")
-        else:
-            raise ValueError(
-                f"Section {section_name} not found in AISC database.")
+                self._pending_changes[product.GlobalId] = "removed"
+            self._bump_version(product.GlobalId)
+            self._unindex_product(product.GlobalId)
+
+    def _bump_version(self, guid):
+        self._entity_versions[guid] = self._entity_versions.get(guid, 0) + 1
 
-    def get_wshape_profile(self, section_name):
+    def entity_version(self, guid):
         """
-        Returns the shape of the specified section.
+        Returns how many times a product has been recorded as modified or removed, so caches of its
+        derived data can tell whether they are current.
 
         Parameters:
-        - section_name: the name of the section to get the shape of.
+        - guid: the product's GlobalId.
+        """
+        return self._entity_versions.get(guid, 0)
+
+    def rebuild_indexes(self, boxes=None):
+        """
+        Rebuilds the GUID, class, storey and spatial indexes from every product in the file.
+
+        Parameters:
+        - boxes: bounding boxes by GlobalId known to be current, e.g. from a snapshot. Others are computed.
+        """
+        boxes = boxes or {}
+        with self._journal_lock:
+            self._products_by_guid = dict()
+            self._products_by_class = dict()
+            self._products_by_storey = dict()
+            self._storey_of_product = dict()
+            self.spatial_index = SpatialIndex()
+            self.feature_cache.clear()
+            for product in self.ifcfile.by_type("IfcProduct"):
+                self._index_product(product, boxes.get(product.GlobalId))
+
+    def _index_product(self, product, box=None):
+        """
+        Adds a product to the indexes, or refreshes its storey if it is already there.
+        """
+        guid = product.GlobalId
+        self._products_by_guid[guid] = product
+        self._products_by_class.setdefault(product.is_a(), dict())[guid] = product
+        # A product can move between storeys, so drop its previous storey entry first.
+        previous = self._storey_of_product.pop(guid, None)
+        if previous is not None:
+            self._products_by_storey.get(previous, {}).pop(guid, None)
+        storey = self._resolve_storey(product)
+        if storey is not None:
+            self._storey_of_product[guid] = storey.GlobalId
+            self._products_by_storey.setdefault(storey.GlobalId, dict())[guid] = product
+        self.spatial_index.update(product, box)
+
+    def _unindex_product(self, guid):
+        """
+        Removes a product from the indexes.
+        """
+        product = self._products_by_guid.pop(guid, None)
+        if product is None:
+            return
+        self.spatial_index.remove(guid)
+        self._products_by_class.get(product.is_a(), {}).pop(guid, None)
+        storey = self._storey_of_product.pop(guid, None)
+        if storey is not None:
+            self._products_by_storey.get(storey, {}).pop(guid, None)
+        self._products_by_storey.pop(guid, None)
+
+    def _resolve_storey(self, product):
+        """
+        Returns the storey a product sits on: the structure containing it, the host of an opening, or the
+        parent it decomposes. Returns None for storeys themselves and for products that are not placed yet.
+        """
+        for _ in range(8):
+            if product.is_a("IfcBuildingStorey"):
+                return None
+            for rel in getattr(product, "ContainedInStructure", None) or ():
+                if rel.RelatingStructure is not None and rel.RelatingStructure.is_a("IfcBuildingStorey"):
+                    return rel.RelatingStructure
+            parent = None
+            for rel in getattr(product, "VoidsElements", None) or ():
+                parent = rel.RelatingBuildingElement
+            for rel in getattr(product, "Decomposes", None) or ():
+                parent = rel.RelatingObject
+            if parent is None:
+                return None
+            if parent.is_a("IfcBuildingStorey"):
+                return parent
+            product = parent
+        return None
+
+    def get_by_guid(self, guid):
+        """
+        Returns the product with the given GlobalId, or None if the model does not have it.
+
+        Parameters:
+        - guid: the GlobalId to look up.
+        """
+        return self._products_by_guid.get(str(guid).strip())
+
+    def products_of_class(self, ifc_class, include_subtypes=True):
+        """
+        Returns the products of an IFC class, e.g. IfcWall.
+
+        Parameters:
+        - ifc_class: the IFC class name.
+        - include_subtypes: whether subclasses count too, as with by_type.
+        """
+        with self._journal_lock:
+            products = []
+            for class_name, bucket in self._products_by_class.items():
+                if not bucket:
+                    continue
+                if class_name == ifc_class or (include_subtypes and next(iter(bucket.values())).is_a(ifc_class)):
+                    products.extend(bucket.values())
+            return products
+
+    def get_storey(self, storey):
+        """
+        Returns a storey entity given the entity itself, its GlobalId or its name (e.g. "Level 3").
+
+        Parameters:
+        - storey: the storey, its GlobalId or its name.
+        """
+        if storey is None or not isinstance(storey, str):
+            return storey
+        by_guid = self.get_by_guid(storey)
+        if by_guid is not None and by_guid.is_a("IfcBuildingStorey"):
+            return by_guid
+        for candidate in self._products_by_class.get("IfcBuildingStorey", {}).values():
+            if str(candidate.Name).strip().lower() == storey.strip().lower():
+                return candidate
+        return None
+
+    def products_on_storey(self, storey):
+        """
+        Returns the products on a storey, including openings cut into its elements.
+
+        Parameters:
+        - storey: the storey, its GlobalId or its name.
+        """
+        storey = self.get_storey(storey)
+        if storey is None:
+            return []
+        with self._journal_lock:
+            return list(self._products_by_storey.get(storey.GlobalId, {}).values())
+
+    def storey_of(self, product):
+        """
+        Returns the storey a product is on, or None.
+
+        Parameters:
+        - product: the product or its GlobalId.
+        """
+        guid = product if isinstance(product, str) else product.GlobalId
+        storey = self._storey_of_product.get(str(guid).strip())
+        return self.get_by_guid(storey) if storey is not None else None
+
+    def query_products(self, ifc_class=None, storey=None):
+        """
+        Returns the products matching every given filter, using the smallest index first.
+
+        Parameters:
+        - ifc_class: an IFC class name, subclasses included.
+        - storey: a storey, its GlobalId or its name.
+        """
+        if storey is not None:
+            products = self.products_on_storey(storey)
+            if ifc_class is not None:
+                products = [product for product in products if product.is_a(ifc_class)]
+            return products
+        if ifc_class is not None:
+            return self.products_of_class(ifc_class)
+        with self._journal_lock:
+            return list(self._products_by_guid.values())
+
+    def step_fragment(self, product):
+        """
+        Returns the STEP lines a client needs to upsert the product: the product, everything it
+        references and the relationships that point at it.
+
+        Parameters:
+        - product: the IfcProduct to serialize.
+        """
+        entities = {entity.id(): entity for entity in self.ifcfile.traverse(product)}
+        for inverse in self.ifcfile.get_inverse(product):
+            if inverse.is_a("IfcRelationship"):
+                entities[inverse.id()] = inverse
+        return "\n".join(str(entities[entity_id]) for entity_id in sorted(entities))
+
+    def commit_version(self):
+        """
+        Freezes the pending changes into a new version of the model.
+
+        Returns:
+        int: the new version number.
+        """
+        # The file lock keeps tools from changing the products while their STEP fragments are read.
+        with self.lock, self._journal_lock:
+            changes = OrderedDict()
+            for guid, change in self._pending_changes.items():
+                entry = {"change": change}
+                if change != "removed":
+                    try:
+                        product = self.ifcfile.by_guid(guid)
+                    except RuntimeError:
+                        continue
+                    entry["ifc_class"] = product.is_a()
+                    entry["step"] = self.step_fragment(product)
+                changes[guid] = entry
+            self._pending_changes = OrderedDict()
+            self.version += 1
+            self._change_log.append((self.version, changes))
+            return self.version
+
+    def get_delta(self, since_version):
+        """
+        Returns the changes between a version the client has and the latest committed version,
+        as a JSON patch keyed by GlobalId.
+
+        Parameters:
+        - since_version: the version the client last applied.
+
+        Returns:
+        dict: {"from_version", "to_version", "full_reload", "changes"}. full_reload is True when
+        the requested version is no longer in the journal and the client must fetch the whole file.
+        """
+        with self._journal_lock:
+            delta = {"from_version": since_version,
+                     "to_version": self.version, "full_reload": False, "changes": {}}
+            oldest = self._change_log[0][0] if self._change_log else self.version + 1
+            if since_version > self.version or since_version < oldest - 1:
+                delta["full_reload"] = since_version != self.version
+                return delta
+            changes = delta["changes"]
+            for version, version_changes in self._change_log:
+                if version <= since_version:
+                    continue
+                for guid, entry in version_changes.items():
+                    previous = changes.get(guid)
+                    if previous is None:
+                        changes[guid] = entry
+                    elif entry["change"] == "removed":
+                        if previous["change"] == "added":
+                            del changes[guid]
+                        else:
+                            changes[guid] = entry
+                    elif previous["change"] == "added":
+                        changes[guid] = dict(entry, change="added")
+                    elif previous["change"] == "removed":
+                        changes[guid] = dict(entry, change="modified")
+                    else:
+                        changes[guid] = entry
+            return delta
+
+    def snapshot(self, full=True):
+        """
+        Returns a snapshot of the model that restore_snapshot can bring back, in this process or another one:
+        the STEP text, the ids of the entities the model keeps handles to, and the change journal.
+
+        Parameters:
+        - full: whether to include the STEP text. Without it the snapshot can only be restored into this model,
+          by removing the entities created since; changes to earlier entities are not undone.
+
+        Returns:
+        dict: plain data that can be pickled.
+        """
+        with self.lock, self._journal_lock:
+            return {
+                "step": self.ifcfile.to_string() if full else None,
+                "max_id": self._max_entity_id(),
+                "handles": {name: getattr(self, name).id() for name in BASE_MODEL_HANDLES
+                            if getattr(self, name, None) is not None},
+                "materials": {name: (material.id(), style.id()) for name, (material, style) in self.materials.items()},
+                "stories": [story.id() for story in self.building_story_list],
+                "project_globalid": self.project_globalid,
+                "version": self.version,
+                "announced_version": self.announced_version,
+                "pending_changes": list(self._pending_changes.items()),
+                "change_log": list(self._change_log),
+                "entity_versions": dict(self._entity_versions),
+                "boxes": dict(self.spatial_index.boxes),
+            }
+
+    def restore_snapshot(self, snapshot):
+        """
+        Replaces the model's contents with a snapshot from snapshot(), and marks it dirty so the file on disk
+        follows.
+
+        Parameters:
+        - snapshot: the snapshot to restore.
+        """
+        with self.lock, self._journal_lock:
+            # 1. The file and the handles into it.
+            if snapshot["step"] is not None:
+                self.ifcfile = file_from_string(snapshot["step"])
+            else:
+                self._remove_created_since(snapshot["max_id"])
+            for name, entity_id in snapshot["handles"].items():
+                setattr(self, name, self.ifcfile.by_id(entity_id))
+            self.materials = {name: (self.ifcfile.by_id(material_id), self.ifcfile.by_id(style_id))
+                              for name, (material_id, style_id) in snapshot["materials"].items()}
+            self.building_story_list = [self.ifcfile.by_id(story_id) for story_id in snapshot["stories"]]
+            self.project_globalid = snapshot["project_globalid"]
+
+            # 2. The journal, so deltas continue from the snapshot's version.
+            changed = [guid for guid, version in self._entity_versions.items()
+                       if version != snapshot["entity_versions"].get(guid, 0)]
+            self.version = snapshot["version"]
+            self.announced_version = snapshot["announced_version"]
+            self._pending_changes = OrderedDict(snapshot["pending_changes"])
+            self._change_log = deque(snapshot["change_log"], maxlen=DELTA_HISTORY)
+            # Versions only grow, so features cached before the restore are never served after it.
+            for guid in set(snapshot["entity_versions"]) | set(self._entity_versions):
+                self._entity_versions[guid] = max(snapshot["entity_versions"].get(guid, 0),
+                                                  self._entity_versions.get(guid, 0)) + 1
+
+            # 3. Caches hold entities of the old file. Without a new file, only the products recorded since the
+            # snapshot are indexed again.
+            if snapshot["step"] is not None:
+                self._interned_points = dict()
+                self._interned_directions = dict()
+                self._member_maps = dict()
+                self._profiles = dict()
+                self._identity_operator = None
+                self.rebuild_indexes(snapshot.get("boxes"))
+            else:
+                for guid in changed:
+                    try:
+                        self._index_product(self.ifcfile.by_guid(guid))
+                    except RuntimeError:
+                        self._unindex_product(guid)
+        self.mark_dirty()
+
+    def _max_entity_id(self):
+        """
+        Returns the highest entity id in the file. New entities always get a higher one.
         """
-        # 1. Read in the csv file with profile data.
         try:
-            wshapes_df = pd.read_csv(
-                "aisc-shapes-database-v15.0.csv", encoding='utf-8')
-        except UnicodeDecodeError:
+            return self.ifcfile.wrapped_data.getMaxId()
+        except AttributeError:
+            return max((entity.id() for entity in self.ifcfile), default=0)
+
+    def _remove_created_since(self, max_id):
+        """
+        Removes the entities with an id above max_id, newest first, and drops the cached handles to them.
+
+        Parameters:
+        - max_id: the highest entity id to keep.
+        """
+        created = []
+        for entity_id in range(self._max_entity_id(), max_id, -1):
             try:
-                wshapes_df = pd.read_csv(
-                    "aisc-shapes-database-v15.0.csv", encoding='ISO-8859-1')
-            except FileNotFoundError:
-                print('File not found: aisc-shapes-database-v15.0.csv')
-                raise
-            except Exception as e:
-                print(
-                    f'An unexpected error occurred while reading the file with ISO-8859-1 encoding: {e}')
-                raise
-        except FileNotFoundError:
-            print('File not found: aisc-shapes-database-v15.0.csv')
-            raise
-        except Exception as e:
-            print(
-                f'An unexpected error occurred while reading the file with utf-8 encoding: {e}')
-            raise
+                created.append(self.ifcfile.by_id(entity_id))
+            except RuntimeError:
+                continue
+        # Handles to a removed entity must not be touched, so they are dropped first.
+        self._invalidate_caches({entity.id() for entity in created})
+        for entity in created:
+            if entity.is_a("IfcProduct"):
+                self._unindex_product(entity.GlobalId)
+            self.ifcfile.remove(entity)
 
-        # 2. Get the necessary dimensions.
-        section_data = wshapes_df[wshapes_df["AISC_Manual_Label"]
-                                  == section_name]
-
-        if not section_data.empty:  # check that section exists in database
-            d = float(section_data['d'].iloc[0]) / 12  # depth [feet]
-            bf = float(section_data['bf'].iloc[0]) / 12  # width [feet]
-            kdes = float(section_data['kdes'].iloc[0]
-                         ) / 12  # fillet radius [feet]
-            tf = float(section_data['tf'].iloc[0]) / \
-                12  # thickness of flange [feet]
-            tw = float(section_data['tw'].iloc[0]) / \
-                12  # thickness of web [feet]
-        else:
-            raise ValueError(
-                f"Section {section_name} not found in AISC database.")
+    def get_steel_shape_profile(self, section_name, length, width):
+        """
+        Returns the shape of the specified section.
+
+        Parameters:
+        - section_name: the name of the section to get the shape of.
+        """
+        # 1. Look the section up in the process-wide AISC catalog.
+        section = section_catalog.require(section_name)
+
+        # 2. Every member of the same section shares one profile.
+        key = ("section", section["label"])
+        profile = self._profiles.get(key)
+        if profile is not None:
+            return profile
+
+        # 3. Build the profile with the builder for its shape type.
+        shaper = self.steel_types.get(section["type"])
+        if shaper is None:
+            raise NotImplementedError(
+                f"AISC Shape Type {section['type']} not implemented for use")
+        profile = shaper(section=section, section_name=section["label"])
+        profile.ProfileName = section["label"]
+        self._profiles[key] = profile
+        return profile
 
-        # 3. Create the point list of the profile.
+    def get_wshape_profile(self, section_name, section=None):
+        """
+        Returns the shape of the specified section.
+
+        Parameters:
+        - section_name: the name of the section to get the shape of.
+        - section: the section's catalog entry, if the caller already looked it up.
+        """
+        # 1. Get the necessary dimensions, already in feet.
+        if section is None:
+            section = section_catalog.require(section_name)
+        d = section['d']  # depth [feet]
+        bf = section['bf']  # width [feet]
+        tf = section['tf']  # thickness of flange [feet]
+        tw = section['tw']  # thickness of web [feet]
+
+        # 2. Create the point list of the profile.
         point_list = [
             (bf/2, 0.0), (bf/2, tf), (tw/2, tf),  # lower right
             (tw/2, d-tf), (bf/2, d-tf), (bf/2, d),  # upper right
@@ -887,44 +1937,34 @@ class IfcModel:
             (-tw/2, tf), (-bf/2, tf), (-bf/2, 0.0)  # lower left
         ]
 
-        # 4. Convert the point list to a closed profile.
-        ifcpts = [self.ifcfile.createIfcCartesianPoint(
+        # 3. Convert the point list to a closed profile.
+        ifcpts = [self.intern_point(
             point) for point in point_list]
         polyline = self.ifcfile.createIfcPolyline(ifcpts)
         ifcclosedprofile = self.ifcfile.createIfcArbitraryClosedProfileDef(
             "AREA", None, polyline)
 
-        # 5. Return the closed profile
+        # 4. Return the closed profile
         return ifcclosedprofile
 
     def add_style_to_product(self, name, product):
         try:
-            print(f"Product type: {type(product)}")
             material_set = self.materials[name]
-            print(f"Material set: {material_set}")
-            print(f"Material set for {name}: {material_set}")
-            file3D = ifcopenshell.api.context.add_context(
-                self.ifcfile, context_type="Model")
-            print(f"3D file context created: {file3D}")
-            body = ifcopenshell.api.context.add_context(self.ifcfile, context_type="Model", context_identifier="Body",
-                                                        target_view="MODEL_VIEW", parent=file3D)
-            print(f"Body context created: {body}")
-            ifcopenshell.api.material.assign_material(
+            # The material already carries its style in the Body context (see add_material).
+            result = ifcopenshell.api.material.assign_material(
                 self.ifcfile, products=[product], material=material_set[0])
             print(f"Material {material_set[0]} assigned to product {product}")
-            result = ifcopenshell.api.style.assign_material_style(
-                self.ifcfile, material=material_set[0], style=material_set[1], context=body)
             return result
 
         except Exception as e:
             print(f"An error occurred in add_style_to_product: {e}")
 
-    def get_cshape_profile(self, section_data, section_name):
-        d = float(section_data['d'].iloc[0]) / 12
-        t = float(section_data['T'].iloc[0]) / 12
-        k = float(section_data['k'].iloc[0]) / 12
-        bf = float(section_data['bf'].iloc[0]) / 12
-        tw = float(section_data['tw'].iloc[0]) / 12
+    def get_cshape_profile(self, section, section_name):
+        d = section['d']
+        t = section['T']
+        k = section['k']
+        bf = section['bf']
+        tw = section['tw']
         point_list = [
             (bf/2, 0.0), (bf/2, k), (-bf/2 + tw, d - t),  # Lower right corner
             (-bf/2 + tw, t), (bf/2, t + k), (bf/2, d),  # Upper right corner
@@ -932,7 +1972,7 @@ class IfcModel:
             (-bf/2, 0.0)  # Lower right corner
         ]
         # 4. Convert the point list to a closed profile.
-        ifcpts = [self.ifcfile.createIfcCartesianPoint(
+        ifcpts = [self.intern_point(
             point) for point in point_list]
         polyline = self.ifcfile.createIfcPolyline(ifcpts)
         ifcclosedprofile = self.ifcfile.createIfcArbitraryClosedProfileDef(
@@ -941,13 +1981,13 @@ class IfcModel:
         # 5. Return the closed profile
         return ifcclosedprofile
 
-    def get_hss_profile(self, section_data, section_name):
+    def get_hss_profile(self, section, section_name):
         if section_name.count('X') == 1:
-            return self.get_hssround_profile(section_data, section_name)
+            return self.get_hssround_profile(section, section_name)
         else:
-            return self.get_hssrect_profile(section_data, section_name)
+            return self.get_hssrect_profile(section, section_name)
 
-    def get_lshape_profile(self, section_data, section_name):
+    def get_lshape_profile(self, section, section_name):
         parameters = section_name.removeprefix('L')
         numbers = parameters.split(sep='X')
         x = self.get_parameter(numbers[0])
@@ -958,7 +1998,7 @@ class IfcModel:
             (x, d), (x, 0.0)
         ]
         # 4. Convert the point list to a closed profile.
-        ifcpts = [self.ifcfile.createIfcCartesianPoint(
+        ifcpts = [self.intern_point(
             point) for point in point_list]
         polyline = self.ifcfile.createIfcPolyline(ifcpts)
         ifcclosedprofile = self.ifcfile.createIfcArbitraryClosedProfileDef(
@@ -979,10 +2019,10 @@ class IfcModel:
             rtn = float(data)
         return rtn
 
-    def get_hssrect_profile(self, section_data, section_name):
-        b = float(section_data['b'].iloc[0]) / 12
-        h = float(section_data['h'].iloc[0]) / 12
-        t = float(section_data['t'].iloc[0]) / 12
+    def get_hssrect_profile(self, section, section_name):
+        b = section['b']
+        h = section['h']
+        t = section['t']
         right_points = [
             (0.0, -h/2), (b/2, -h/2), (b/2, h/2), (0.0, h/2),
             (0.0, h/2 - t), (b/2 - t, h/2 - t), (b/2 - t, -h/2 + t), (0.0, -h/2 + t)
@@ -993,9 +2033,9 @@ class IfcModel:
             (0.0, h/2 - t), (-b/2 + t, h/2 -
                              t), (-b/2 + t, -h/2 + t), (0.0, -h/2 + t)
         ]
-        ifcpts_r = [self.ifcfile.createIfcCartesianPoint(
+        ifcpts_r = [self.intern_point(
             point_r) for point_r in right_points]
-        ifcpts_l = [self.ifcfile.createIfcCartesianPoint(
+        ifcpts_l = [self.intern_point(
             point_l) for point_l in left_points]
         polyline_r = self.ifcfile.createIfcPolyline(ifcpts_r)
         polyline_l = self.ifcfile.createIfcPolyline(ifcpts_l)
@@ -1007,9 +2047,9 @@ class IfcModel:
             "AREA", None, [profile_l, profile_r], None)
         return profile
 
-    def get_hssround_profile(self, section_data, section_name):
-        r = float(section_data['r'].iloc[0]) / 12
-        t = float(section_data['t'].iloc[0]) / 12
+    def get_hssround_profile(self, section, section_name):
+        r = section['r']
+        t = section['t']
         right_points = [
             (0.0, r), (r, 0.0), (0.0, -r),
             (0.0, -r + t), (r - t, 0.0), (0.0, r - t)
@@ -1045,6 +2085,11 @@ class IfcModel:
         return profile
 
     def get_rectangle(self, section_name, length, width):
+        # Rectangles of the same size share one profile.
+        key = ("rectangle", round(float(length) / self.intern_tolerance),
+               round(float(width) / self.intern_tolerance))
+        if key in self._profiles:
+            return self._profiles[key]
         points = [
             [0.0, 0.0, 0.0], [0.0, width, 0.0], [
                 length, width, 0.0], [length, 0.0, 0.0]
@@ -1054,7 +2099,7 @@ class IfcModel:
         for point in points:
             # Ensure all values are floats
             coords = list(map(float, point))
-            ifc_point = self.ifcfile.createIfcCartesianPoint(coords)
+            ifc_point = self.intern_point(coords)
             ifcpts.append(ifc_point)
 
         # # Print the created IFC points
@@ -1066,6 +2111,7 @@ class IfcModel:
         ifcclosedprofile = self.ifcfile.createIfcArbitraryClosedProfileDef(
             "AREA", None, polyline)
         print(f"IFC Closed Profile: {ifcclosedprofile}")
+        self._profiles[key] = ifcclosedprofile
 
         # 5. Return the closed profile
         return ifcclosedprofile
@@ -0,0 +1,159 @@
+"""
+On-disk cache of LLM responses, so repeated search queries and planner requests are answered without a
+provider round trip. Entries live in SQLite, keyed by provider, model, request options, a hash of the system
+prompt and the normalized user prompt. They expire after a TTL and the least recently used are evicted past
+a size limit.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "tmp", "llm_cache.sqlite3"))
+# Seconds a response stays valid, and the most megabytes of responses kept.
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "50"))
+# Set to 1 to send every request to the provider.
+LLM_CACHE_DISABLED = os.getenv("LLM_CACHE_DISABLED", "0") == "1"
+
+# Words that do not change what a short query asks for: "find all walls" and "find the walls" mean "find walls".
+FILLER_WORDS = {"a", "an", "the", "all", "every", "please", "me", "of", "my", "any"}
+
+
+def normalize_prompt(text, drop_filler=False):
+    """
+    Returns the cache form of a prompt: lower case, single spaces, without trailing punctuation, and optionally
+    without filler words.
+
+    Parameters:
+    - text: the prompt.
+    - drop_filler: whether to drop FILLER_WORDS, for short queries.
+    """
+    text = re.sub(r"\s+", " ", str(text).lower()).strip().rstrip(".?!")
+    if drop_filler:
+        text = " ".join(word for word in text.split(" ") if word not in FILLER_WORDS)
+    return text
+
+
+def cache_key(provider, model, messages, options, drop_filler=False):
+    """
+    Returns the cache key of a chat request: the provider, model and options, a hash of the system prompts and
+    the normalized other messages.
+
+    Parameters:
+    - provider: the provider's name.
+    - model: the model name.
+    - messages: the chat messages.
+    - options: the other request arguments, e.g. temperature and response_format.
+    - drop_filler: whether user messages drop filler words.
+    """
+    system = hashlib.sha256("\n".join(
+        message["content"] for message in messages if message["role"] == "system").encode()).hexdigest()
+    prompt = [(message["role"], normalize_prompt(message["content"], drop_filler))
+              for message in messages if message["role"] != "system"]
+    raw = json.dumps([provider, model, sorted(options.items()), system, prompt], default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(self, path, ttl, max_bytes, disabled=False):
+        """
+        Initializes the cache. The database is opened on first use.
+
+        Parameters:
+        - path: the SQLite file.
+        - ttl: seconds a response stays valid.
+        - max_bytes: the most bytes of responses kept.
+        - disabled: whether every lookup misses and nothing is stored.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.disabled = disabled
+        self._connection = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def _connect(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+                "created REAL NOT NULL, used REAL NOT NULL, size INTEGER NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+            self._connection.commit()
+        return self._connection
+
+    def get(self, key):
+        """
+        Returns the cached response for a key, or None if there is none or it has expired.
+        """
+        if self.disabled:
+            self.bypassed += 1
+            return None
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT content, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    connection.commit()
+                self.misses += 1
+                return None
+            connection.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            connection.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, content):
+        """
+        Stores a response, then drops expired entries and the least recently used past the size limit.
+        """
+        if self.disabled or content is None:
+            return
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                               (key, content, now, now, len(content.encode())))
+            evicted = connection.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,)).rowcount
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, size in connection.execute(
+                        "SELECT key, size FROM responses ORDER BY used").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    connection.execute("DELETE FROM responses WHERE key = ?", (old_key,))
+                    total -= size
+                    evicted += 1
+            connection.commit()
+            self.evictions += evicted
+
+    def stats(self):
+        """
+        Returns the cache's hit, miss, bypass and eviction counts.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "disabled": self.disabled,
+        }
+
+
+# Singleton cache shared by every session.
+llm_cache = LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_TTL, int(LLM_CACHE_MAX_MB * 1024 * 1024),
+                             disabled=LLM_CACHE_DISABLED)
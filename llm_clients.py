@@ -0,0 +1,164 @@
+"""
+Async LLM clients for calls made from inside tools. Each provider has one client with a shared connection pool,
+a timeout, and a semaphore capping its concurrent requests, so a slow provider never blocks the event loop and
+one busy session cannot exhaust a provider's rate limit for the others. Latency and in-flight gauges are kept
+per provider for /metrics. cached_chat_content answers repeated requests from the on-disk response cache.
+"""
+import asyncio
+import os
+import threading
+import time
+import httpx
+from openai import AsyncOpenAI
+from groq import AsyncGroq
+from llm_cache import cache_key, llm_cache
+
+# Seconds before an LLM request is abandoned, and how many times a failed request is retried.
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+# Connections kept open to each provider.
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+# Requests in flight per provider; further requests wait for a slot.
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))
+GROQ_CONCURRENCY = int(os.getenv("GROQ_CONCURRENCY", "4"))
+
+
+class LLMProvider:
+    def __init__(self, name, client_class, api_key_env, concurrency):
+        """
+        Initializes a provider. The client is created on first use, so a missing API key only fails the calls
+        that need it.
+
+        Parameters:
+        - name: the provider's name in /metrics.
+        - client_class: the async SDK client, e.g. AsyncOpenAI.
+        - api_key_env: the environment variable holding the API key.
+        - concurrency: the most requests in flight at once.
+        """
+        self.name = name
+        self.client_class = client_class
+        self.api_key_env = api_key_env
+        self.concurrency = concurrency
+        self._client = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    @property
+    def client(self):
+        """
+        The provider's async client, created with a pooled HTTP client on first use.
+        """
+        with self._lock:
+            if self._client is None:
+                http_client = httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                        max_keepalive_connections=LLM_MAX_CONNECTIONS),
+                    timeout=LLM_TIMEOUT)
+                self._client = self.client_class(api_key=os.getenv(self.api_key_env), timeout=LLM_TIMEOUT,
+                                                 max_retries=LLM_MAX_RETRIES, http_client=http_client)
+            return self._client
+
+    async def chat(self, **kwargs):
+        """
+        Sends a chat completion request once a concurrency slot is free and returns the response.
+
+        Parameters:
+        - kwargs: the arguments of chat.completions.create (model, messages, ...).
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            return await self.client.chat.completions.create(**kwargs)
+        except Exception as e:
+            self.errors += 1
+            if isinstance(e, (asyncio.TimeoutError, httpx.TimeoutException)) or "Timeout" in type(e).__name__:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.in_flight -= 1
+            self.requests += 1
+            self.latency_total += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+            self._semaphore.release()
+
+    def metrics(self):
+        """
+        Returns the provider's in-flight, waiting, request, error and latency gauges.
+        """
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "concurrency": self.concurrency,
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "latency_ms_avg": self.latency_total / self.requests * 1000 if self.requests else None,
+            "latency_ms_max": self.latency_max * 1000,
+        }
+
+
+# Singleton providers shared by every session.
+llm_providers = {
+    "openai": LLMProvider("openai", AsyncOpenAI, "OPENAI_API_KEY", OPENAI_CONCURRENCY),
+    "groq": LLMProvider("groq", AsyncGroq, "GROQ_API_KEY", GROQ_CONCURRENCY),
+}
+
+
+async def chat_completion(provider, **kwargs):
+    """
+    Sends a chat completion request through a provider's shared client.
+
+    Parameters:
+    - provider: "openai" or "groq".
+    - kwargs: the arguments of chat.completions.create (model, messages, ...).
+    """
+    return await llm_providers[provider].chat(**kwargs)
+
+
+async def cached_chat_content(provider, bypass_cache=False, drop_filler=False, **kwargs):
+    """
+    Returns the message content of a chat completion, from the response cache when the same request has been
+    answered before.
+
+    Parameters:
+    - provider: "openai" or "groq".
+    - bypass_cache: whether to skip the lookup and always ask the provider. The answer is still stored.
+    - drop_filler: whether the cache key ignores filler words in the prompt, for short queries.
+    - kwargs: the arguments of chat.completions.create (model, messages, ...).
+    """
+    options = {key: value for key, value in kwargs.items() if key not in ("model", "messages")}
+    key = cache_key(provider, kwargs["model"], kwargs["messages"], options, drop_filler)
+    if bypass_cache:
+        llm_cache.bypassed += 1
+    else:
+        content = await asyncio.to_thread(llm_cache.get, key)
+        if content is not None:
+            return content
+    response = await chat_completion(provider, **kwargs)
+    content = response.choices[0].message.content
+    await asyncio.to_thread(llm_cache.put, key, content)
+    return content
+
+
+def llm_metrics():
+    """
+    Returns the gauges of every provider and the response cache.
+    """
+    metrics = {name: provider.metrics() for name, provider in llm_providers.items()}
+    metrics["cache"] = llm_cache.stats()
+    return metrics
@@ -0,0 +1,126 @@
+"""
+Pool of ready-made IfcModels so that starting a session never waits on building one.
+"""
+import os
+import threading
+import time
+from collections import deque
+from ifc import IfcModel
+
+# Number of idle models the pool keeps ready. Set to 0 to build every model on demand.
+MODEL_POOL_SIZE = int(os.getenv("IFC_MODEL_POOL_SIZE", "4"))
+
+# The arguments every session model is created with.
+SESSION_MODEL_ARGS = dict(
+    creator="Aliyan",
+    organization="BuildSync",
+    application="IfcOpenShell",
+    application_version="0.5",
+    project_name="Modular IFC Project",
+)
+
+
+def new_session_model():
+    """
+    Creates an IfcModel for a new session.
+    """
+    return IfcModel(filename=None, **SESSION_MODEL_ARGS)
+
+
+class IfcModelPool:
+    def __init__(self, factory, size):
+        """
+        Initializes an empty pool. Models are built by a background thread once the pool is started.
+
+        Parameters:
+        - factory: a callable returning a new IfcModel.
+        - size: the number of idle models to keep ready.
+        """
+        self.factory = factory
+        self.size = size
+        self._models = deque()
+        self._condition = threading.Condition()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.refill_errors = 0
+        self.refill_seconds_total = 0.0
+        self.last_refill_seconds = None
+
+    def start(self):
+        """
+        Starts the background thread that keeps the pool full. Safe to call more than once.
+        """
+        with self._condition:
+            if self._thread is None and self.size > 0:
+                self._thread = threading.Thread(
+                    target=self._refill_loop, name="ifc-model-pool", daemon=True)
+                self._thread.start()
+
+    def acquire(self):
+        """
+        Takes a ready model out of the pool, or builds one right away if the pool is empty.
+
+        Returns:
+        An IfcModel that belongs to nobody else.
+        """
+        # 1. Make sure the refill thread runs, then take an idle model if there is one.
+        self.start()
+        with self._condition:
+            model = self._models.popleft() if self._models else None
+            if model is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._condition.notify()
+        # 2. On a miss the caller pays for the build, as it did before the pool existed.
+        if model is None:
+            model = self.factory()
+        return model
+
+    def _refill_loop(self):
+        """
+        Builds models until the pool is full, then waits for one to be taken.
+        """
+        while True:
+            with self._condition:
+                while len(self._models) >= self.size:
+                    self._condition.wait()
+            start = time.perf_counter()
+            try:
+                model = self.factory()
+            except Exception as e:
+                print(f"Error refilling IfcModel pool: {e}")
+                with self._condition:
+                    self.refill_errors += 1
+                time.sleep(1.0)
+                continue
+            elapsed = time.perf_counter() - start
+            with self._condition:
+                self._models.append(model)
+                self.refills += 1
+                self.refill_seconds_total += elapsed
+                self.last_refill_seconds = elapsed
+
+    def metrics(self):
+        """
+        Returns the pool's hit rate and refill latency.
+        """
+        with self._condition:
+            requests = self.hits + self.misses
+            return {
+                "size": self.size,
+                "idle": len(self._models),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else None,
+                "refills": self.refills,
+                "refill_errors": self.refill_errors,
+                "refill_latency_avg_ms": 1000 * self.refill_seconds_total / self.refills if self.refills else None,
+                "refill_latency_last_ms": 1000 * self.last_refill_seconds if self.last_refill_seconds is not None else None,
+            }
+
+
+# Singleton pool shared by every session.
+model_pool = IfcModelPool(new_session_model, MODEL_POOL_SIZE)
@@ -0,0 +1,126 @@
+"""
+Memory-bounded LRU of parsed IFC files, so an uploaded file is parsed once rather than on every search.
+Entries are keyed by content hash; a file's hash is only recomputed when its mtime or size changes.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import ifcopenshell
+
+# Memory budget of the cache, in megabytes.
+PARSED_CACHE_MB = float(os.getenv("IFC_PARSED_CACHE_MB", "256"))
+# A parsed file takes several times its size on disk; entries are charged at file size times this factor.
+PARSED_MEMORY_FACTOR = float(os.getenv("IFC_PARSED_MEMORY_FACTOR", "8"))
+
+
+def file_digest(path):
+    """
+    Returns the sha256 of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ParsedFileCache:
+    def __init__(self, max_bytes, memory_factor=PARSED_MEMORY_FACTOR):
+        """
+        Initializes an empty cache.
+
+        Parameters:
+        - max_bytes: the memory budget, in bytes.
+        - memory_factor: the multiple of the file size an entry is charged.
+        """
+        self.max_bytes = max_bytes
+        self.memory_factor = memory_factor
+        self._entries = OrderedDict()
+        self._digests = dict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _digest_of(self, path, stat):
+        """
+        Returns the content hash of a file, reusing the last one while its mtime and size are unchanged.
+        """
+        known = self._digests.get(path)
+        if known is not None and known[0] == stat.st_mtime_ns and known[1] == stat.st_size:
+            return known[2]
+        digest = file_digest(path)
+        self._digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def open(self, path):
+        """
+        Returns the parsed file at a path, parsing it only if its contents are not cached.
+
+        Parameters:
+        - path: the IFC file.
+        """
+        # 1. Identify the contents.
+        stat = os.stat(path)
+        with self._lock:
+            digest = self._digest_of(path, stat)
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # 2. Parse outside the lock so other files can be served meanwhile.
+        ifcfile = ifcopenshell.open(path)
+        cost = int(stat.st_size * self.memory_factor)
+
+        # 3. Store it and evict the least recently used files past the budget.
+        with self._lock:
+            if digest not in self._entries:
+                self._entries[digest] = (ifcfile, cost)
+                self.bytes += cost
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, evicted_cost) = self._entries.popitem(last=False)
+                self.bytes -= evicted_cost
+                self.evictions += 1
+        return ifcfile
+
+    def forget_directory(self, directory):
+        """
+        Drops the hashes of files under a directory, e.g. when a session's folder is deleted. Their parsed
+        entries age out of the LRU unless another path has the same contents.
+
+        Parameters:
+        - directory: the directory whose files are gone.
+        """
+        prefix = os.path.join(directory, "")
+        with self._lock:
+            for path in [path for path in self._digests if path.startswith(prefix)]:
+                digest = self._digests.pop(path)[2]
+                if not any(known[2] == digest for known in self._digests.values()):
+                    entry = self._entries.pop(digest, None)
+                    if entry is not None:
+                        self.bytes -= entry[1]
+
+    def stats(self):
+        """
+        Returns the cache's hit, miss and eviction counts and memory use.
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else None,
+                "evictions": self.evictions,
+            }
+
+
+# Singleton cache shared by every session.
+parsed_file_cache = ParsedFileCache(int(PARSED_CACHE_MB * 1024 * 1024))
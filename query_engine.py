@@ -0,0 +1,416 @@
+"""
+Local structured query engine for search_canvas. Parses queries such as "walls on Level 2 with height > 10",
+"columns with section W16X40" or "leftmost wall" into a structured query and answers it from the model's
+in-memory indexes. Queries it cannot parse return None so the caller can fall back to the LLM.
+"""
+import math
+import re
+import threading
+from feature_extractor import BATCHED_CLASSES, IfcEntityFeatureExtractor
+from spatial_index import element_bounds
+
+# Words that name every element rather than one class.
+ALL_ELEMENT_WORDS = {"object", "objects", "element", "elements", "everything", "item", "items", "thing", "things"}
+
+# Numeric features the predicates can test. Thickness means whichever thickness the element type has.
+NUMERIC_FIELDS = {
+    "height": ("height",),
+    "length": ("length",),
+    "thickness": ("thickness", "slab_thickness", "roof_thickness"),
+    "elevation": ("elevation",),
+}
+
+COMPARISONS = {
+    ">": lambda a, b: a > b, "greater than": lambda a, b: a > b, "more than": lambda a, b: a > b,
+    "over": lambda a, b: a > b, "above": lambda a, b: a > b, "larger than": lambda a, b: a > b,
+    "taller than": lambda a, b: a > b, "higher than": lambda a, b: a > b, "longer than": lambda a, b: a > b,
+    "thicker than": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b, "at least": lambda a, b: a >= b,
+    "<": lambda a, b: a < b, "less than": lambda a, b: a < b, "under": lambda a, b: a < b,
+    "below": lambda a, b: a < b, "smaller than": lambda a, b: a < b, "shorter than": lambda a, b: a < b,
+    "thinner than": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b, "at most": lambda a, b: a <= b,
+    "=": lambda a, b: abs(a - b) < 1e-6, "==": lambda a, b: abs(a - b) < 1e-6, "of": lambda a, b: abs(a - b) < 1e-6,
+    "is": lambda a, b: abs(a - b) < 1e-6, "exactly": lambda a, b: abs(a - b) < 1e-6,
+}
+
+# Extremes: the word, then either a bounding-box axis or a numeric field, and whether the largest value wins.
+SPATIAL_EXTREMES = {
+    "leftmost": ("x", False), "left most": ("x", False), "rightmost": ("x", True), "right most": ("x", True),
+    "frontmost": ("y", False), "front most": ("y", False), "backmost": ("y", True), "back most": ("y", True),
+    "lowest": ("z", False), "bottommost": ("z", False), "highest": ("z", True), "topmost": ("z", True),
+}
+FEATURE_EXTREMES = {
+    "tallest": ("height", True), "shortest": ("height", False), "longest": ("length", True),
+    "thickest": ("thickness", True), "thinnest": ("thickness", False),
+}
+
+# Comparatives that name their field: "taller than 12" tests the height.
+COMPARATIVE_FIELDS = {
+    "taller": "height", "higher": "height", "shorter": "height",
+    "longer": "length", "thicker": "thickness", "thinner": "thickness",
+}
+
+# Units after a value; the model is in feet, so they only need consuming.
+UNIT = r"(?:\s*(?:feet|foot|ft)\b|\s*')?"
+FIELD_PATTERN = re.compile(
+    r"\b(height|length|thickness|elevation)\b\s*(?:is\s+)?(" +
+    "|".join(sorted((re.escape(word) for word in COMPARISONS), key=len, reverse=True)) +
+    r")?\s*(-?\d+(?:\.\d+)?)" + UNIT)
+COMPARATIVE_PATTERN = re.compile(
+    r"\b(" + "|".join(COMPARATIVE_FIELDS) + r")\s+than\s+(-?\d+(?:\.\d+)?)" + UNIT)
+SECTION_PATTERN = re.compile(r"\b((?:HSS|HP|MC|W|C|L|M|S)\d+(?:\.\d+)?X\d+(?:\.\d+)?(?:X\d+(?:\.\d+)?)?)\b", re.IGNORECASE)
+STOREY_PATTERN = re.compile(r"\b(?:level|story|storey)\s+(\d+)\b", re.IGNORECASE)
+# Relations between elements ("the beam above column 3") need geometry reasoning the parser does not do.
+RELATIONAL_PATTERN = re.compile(
+    r"\b(?:above|below|under|over|near|next to|between|adjacent|beside|closest to|nearest|connected|touching|"
+    r"intersect\w*|inside|within|except|not|without)\b(?!\s*-?\d)", re.IGNORECASE)
+
+# Words a query may contain without changing what it asks for. Any other word the parser does not consume
+# ("red", "3", a GlobalId) means it did not understand the query, which then goes to the LLM.
+QUERY_FILLER_WORDS = {
+    "find", "show", "list", "get", "select", "highlight", "search", "delete", "remove", "erase", "me", "please",
+    "all", "every", "each", "both", "the", "a", "an", "any", "those", "these", "and", "with", "on", "in", "at",
+    "of", "for", "that", "which", "whose", "where", "are", "is", "there", "have", "has", "section", "sections",
+    "profile", "size", "model", "canvas",
+}
+
+# Which path answered search_canvas, for /metrics.
+query_stats = {"local": 0, "llm": 0, "local_ms_total": 0.0, "llm_ms_total": 0.0}
+_stats_lock = threading.Lock()
+
+
+def record_query(path, elapsed):
+    """
+    Counts a search answered by the given path ("local" or "llm") and how long it took, in seconds.
+    """
+    with _stats_lock:
+        query_stats[path] += 1
+        query_stats[f"{path}_ms_total"] += elapsed * 1000
+
+
+def class_vocabulary(object_types):
+    """
+    Returns the words that name IFC classes: the model's object_types, their plurals, and the class names.
+    """
+    vocabulary = {}
+    for word, ifc_class in object_types.items():
+        vocabulary[word] = ifc_class
+        vocabulary[word + "s"] = ifc_class
+        vocabulary[ifc_class.lower()] = ifc_class
+    vocabulary["stories"] = vocabulary["storeys"] = vocabulary["storey"] = "IfcBuildingStorey"
+    vocabulary["levels"] = vocabulary["level"] = "IfcBuildingStorey"
+    vocabulary["footing"] = vocabulary["footings"] = "IfcFooting"
+    vocabulary["opening"] = vocabulary["openings"] = vocabulary["void"] = vocabulary["voids"] = "IfcOpeningElement"
+    vocabulary["grid"] = vocabulary["grids"] = "IfcGrid"
+    return vocabulary
+
+
+def _normalize(text):
+    """
+    Returns a query in lower case, padded with spaces, without the punctuation between words. Comparison signs
+    and decimal points carry meaning and are kept.
+    """
+    return " " + re.sub(r"[,;:!?()\"]|\.(?!\d)", " ", str(text).lower()).strip() + " "
+
+
+def parse_query(text, object_types, storey_names=()):
+    """
+    Parses a search query into a structured query, or returns None if it cannot be answered locally.
+
+    Parameters:
+    - text: the user's search query.
+    - object_types: the model's word -> IFC class mapping.
+    - storey_names: the names of the storeys in the searched file.
+
+    Returns:
+    dict: classes, storey, predicates (field, comparison, value), section and extreme, or None.
+    """
+    query = {"classes": [], "storey": None, "predicates": [], "section": None, "extreme": None}
+    lowered = _normalize(text)
+    if RELATIONAL_PATTERN.search(lowered):
+        return None
+
+    # 1. Storey filter: a storey named in the query, or "level N".
+    remaining = lowered
+    for name in sorted(storey_names, key=len, reverse=True):
+        if name and re.search(r"\b" + re.escape(name.lower()) + r"\b", remaining):
+            query["storey"] = name
+            remaining = re.sub(r"\b(?:on|in|at)?\s*(?:the\s+)?" + re.escape(name.lower()) + r"\b", " ", remaining)
+            break
+    if query["storey"] is None:
+        match = STOREY_PATTERN.search(remaining)
+        if match:
+            query["storey"] = f"Level {match.group(1)}"
+            remaining = remaining[:match.start()] + " " + remaining[match.end():]
+
+    # 2. Section and numeric predicates.
+    match = SECTION_PATTERN.search(remaining)
+    if match:
+        query["section"] = match.group(1).upper()
+        remaining = remaining[:match.start()] + " " + remaining[match.end():]
+    query["predicates"], remaining = extract_predicates(remaining)
+
+    # 3. Extremes.
+    for word, (axis, largest) in SPATIAL_EXTREMES.items():
+        if re.search(r"\b" + word + r"\b", remaining):
+            query["extreme"] = ("axis", axis, largest)
+            remaining = remaining.replace(word, " ")
+            break
+    else:
+        for word, (field, largest) in FEATURE_EXTREMES.items():
+            if re.search(r"\b" + word + r"\b", remaining):
+                query["extreme"] = ("field", field, largest)
+                remaining = remaining.replace(word, " ")
+                break
+
+    # 4. Classes. A query with no class it can name, or with words left over, goes to the LLM.
+    vocabulary = class_vocabulary(object_types)
+    for word in remaining.split():
+        if word in vocabulary:
+            if vocabulary[word] not in query["classes"]:
+                query["classes"].append(vocabulary[word])
+        elif word in ALL_ELEMENT_WORDS:
+            if "IfcElement" not in query["classes"]:
+                query["classes"].append("IfcElement")
+        elif word not in QUERY_FILLER_WORDS:
+            return None
+    if not query["classes"]:
+        return None
+    # "the floor on level 2" names a storey as well as a slab; the storey only narrows the slabs.
+    if query["storey"] is not None and len(query["classes"]) > 1 and "IfcBuildingStorey" in query["classes"]:
+        query["classes"].remove("IfcBuildingStorey")
+    return query
+
+
+def extract_predicates(text):
+    """
+    Finds the numeric predicates in a query: "height > 10", "length of 20 feet", "taller than 12".
+
+    Parameters:
+    - text: the lower-case query.
+
+    Returns:
+    tuple: the predicates (field, comparison, value), and the text with them removed.
+    """
+    predicates = []
+    for match in FIELD_PATTERN.finditer(text):
+        predicates.append((match.group(1), match.group(2) or "=", float(match.group(3))))
+    text = FIELD_PATTERN.sub(" ", text)
+    for match in COMPARATIVE_PATTERN.finditer(text):
+        predicates.append((COMPARATIVE_FIELDS[match.group(1)], match.group(1) + " than", float(match.group(2))))
+    text = COMPARATIVE_PATTERN.sub(" ", text)
+    return predicates, text
+
+
+def parse_condition(text):
+    """
+    Parses a condition such as "height > 10" or "taller than 12 and shorter than 20" into predicates.
+
+    Parameters:
+    - text: the condition.
+
+    Returns:
+    list: the predicates (field, comparison, value), or None if the condition has none or has words that are
+    not part of one.
+    """
+    predicates, remaining = extract_predicates(_normalize(text))
+    if not predicates or any(word not in QUERY_FILLER_WORDS for word in remaining.split()):
+        return None
+    return predicates
+
+
+def wants_many(text, object_types):
+    """
+    Returns whether a query asks for several objects: it says all, every, each or both, or names a class in the
+    plural ("walls"). A singular query ("delete the wall") that matches several objects is ambiguous.
+
+    Parameters:
+    - text: the user's query.
+    - object_types: the model's word -> IFC class mapping.
+    """
+    words = re.findall(r"[a-z]+", text.lower())
+    if any(word in ("all", "every", "each", "both") for word in words):
+        return True
+    vocabulary = class_vocabulary(object_types)
+    singular = set(object_types) | {"storey", "level", "footing", "opening", "void", "grid"}
+    return any(word in vocabulary and word not in singular and word.endswith("s") for word in words)
+
+
+def storey_names_of(source):
+    """
+    Returns the storey names of an IfcModel or an ifcopenshell file.
+    """
+    if hasattr(source, "products_of_class"):
+        storeys = source.products_of_class("IfcBuildingStorey")
+    else:
+        storeys = source.by_type("IfcBuildingStorey")
+    return [str(storey.Name) for storey in storeys if storey.Name]
+
+
+def _candidates(source, ifc_class, storey):
+    """
+    Returns the products of a class on a storey, from the model's indexes or by scanning a file.
+    """
+    # A storey is not contained in itself: "storey Level 2" names the storey.
+    if ifc_class == "IfcBuildingStorey" and storey is not None:
+        return [product for product in _candidates(source, ifc_class, None)
+                if str(product.Name).strip().lower() == storey.strip().lower()]
+    if hasattr(source, "query_products"):
+        return source.query_products(ifc_class, storey)
+    try:
+        products = source.by_type(ifc_class)
+    except RuntimeError:
+        return []
+    if storey is None:
+        return products
+    matching = []
+    for product in products:
+        for rel in getattr(product, "ContainedInStructure", None) or ():
+            if str(rel.RelatingStructure.Name).strip().lower() == storey.strip().lower():
+                matching.append(product)
+                break
+    return matching
+
+
+def _bounds(source, product):
+    """
+    Returns a product's bounding box, from the spatial index when the source is an IfcModel.
+    """
+    spatial_index = getattr(source, "spatial_index", None)
+    if spatial_index is not None and product.GlobalId in spatial_index.boxes:
+        return spatial_index.boxes[product.GlobalId]
+    return element_bounds(product)
+
+
+def _coordinates(value):
+    """
+    Returns a point from a feature, which is a list or the text of a numpy array ("[ 0. 15.  0.]"), or None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = re.findall(r"-?\d+(?:\.\d*)?(?:e[-+]?\d+)?", value)
+    try:
+        point = [float(coordinate) for coordinate in value]
+    except (TypeError, ValueError):
+        return None
+    return point if len(point) == 3 else None
+
+
+def _numeric(features, field):
+    for key in NUMERIC_FIELDS[field]:
+        value = features.get(key)
+        if value is not None:
+            try:
+                return float(value)
+            except (TypeError, ValueError):
+                return None
+    # Walls record their end points rather than a length.
+    if field == "length":
+        start, end = _coordinates(features.get("start_coord")), _coordinates(features.get("end_coord"))
+        if start is not None and end is not None:
+            return math.dist(start, end)
+    return None
+
+
+def run_query(source, query, feature_extractor=None, extract=True):
+    """
+    Answers a structured query against an IfcModel (using its indexes) or an ifcopenshell file.
+
+    Parameters:
+    - source: the IfcModel or ifcopenshell file to search.
+    - query: the structured query from parse_query.
+    - feature_extractor: the extractor turning products into feature dicts. Defaults to the model's
+      feature cache, or a new extractor for a file.
+    - extract: whether to return feature dicts. If False the matching products are returned, and features are
+      only extracted for the filters that need them.
+
+    Returns:
+    list: the feature dicts of the matching products, or the products.
+    """
+    feature_extractor = feature_extractor or getattr(source, "feature_cache", None) or IfcEntityFeatureExtractor()
+    # 1. Candidates from the class and storey indexes.
+    products, seen = [], set()
+    for ifc_class in query["classes"]:
+        for product in _candidates(source, ifc_class, query["storey"]):
+            if product.GlobalId not in seen:
+                seen.add(product.GlobalId)
+                products.append(product)
+
+    # 2. Predicates on the extracted features. Features are only extracted when a filter needs them,
+    # so "rightmost column" extracts one column rather than all of them.
+    def features_of(product):
+        features = feature_extractor.extract_entity_features(product)
+        return features or {"name": product.Name, "global_id": product.GlobalId, "type": product.is_a()}
+
+    needs_features = query["section"] is not None or query["predicates"] or (
+        query["extreme"] is not None and query["extreme"][0] == "field")
+    def extract_all(products):
+        # Each class is extracted in one batch.
+        batched = iter(feature_extractor.extract_features_batched(products))
+        return [next(batched) if product.is_a() in BATCHED_CLASSES else features_of(product)
+                for product in products]
+
+    extracted = extract_all(products) if needs_features else [None] * len(products)
+    results = []
+    for product, features in zip(products, extracted):
+        if not needs_features:
+            results.append((product, None))
+            continue
+        if query["section"] is not None and str(features.get("section_name") or "").upper() != query["section"]:
+            continue
+        matched = True
+        for field, comparison, value in query["predicates"]:
+            actual = _numeric(features, field)
+            if actual is None or not COMPARISONS[comparison](actual, value):
+                matched = False
+                break
+        if matched:
+            results.append((product, features))
+
+    # 3. Extremes keep the single best match.
+    if query["extreme"] is not None and results:
+        kind, key, largest = query["extreme"]
+        scored = []
+        for product, features in results:
+            if kind == "axis":
+                box = _bounds(source, product)
+                if box is None:
+                    continue
+                index = "xyz".index(key)
+                score = box[1][index] if largest else box[0][index]
+            else:
+                score = _numeric(features, key)
+                if score is None and key == "height":
+                    score = _numeric(features, "length")
+                if score is None:
+                    continue
+            scored.append((score, product, features))
+        if not scored:
+            return []
+        best = max(scored, key=lambda entry: entry[0]) if largest else min(scored, key=lambda entry: entry[0])
+        results = [(best[1], best[2])]
+    if not extract:
+        return [product for product, _ in results]
+    if not needs_features:
+        return extract_all([product for product, _ in results])
+    return [features for _, features in results]
+
+
+def answer_locally(source, text, object_types):
+    """
+    Parses and answers a search query without the LLM.
+
+    Parameters:
+    - source: the IfcModel or ifcopenshell file to search.
+    - text: the user's search query.
+    - object_types: the word -> IFC class mapping.
+
+    Returns:
+    tuple: (query, results), or (None, None) if the query could not be parsed.
+    """
+    query = parse_query(text, object_types, storey_names_of(source))
+    if query is None:
+        return None, None
+    return query, run_query(source, query)
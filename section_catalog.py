@@ -0,0 +1,146 @@
+"""
+Process-wide catalog of AISC steel sections. The shapes database is parsed once, on first use, into a dict
+keyed by AISC manual label with the dimensions the profile builders need already converted to feet.
+"""
+import os
+import re
+import threading
+import pandas as pd
+
+CATALOG_PATH = os.getenv("AISC_CATALOG_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "aisc-shapes-database-v15.0.csv"))
+
+# Columns of the database that are lengths in inches. They are stored in feet, the model's unit.
+LENGTH_COLUMNS = ("d", "bf", "tw", "tf", "kdes", "kdet", "k", "T", "b", "h", "t", "tnom", "tdes", "OD", "ID", "r")
+
+# Splits a label such as W12X53 into its shape type, nominal depth and weight.
+LABEL_PATTERN = re.compile(r"^([A-Z]+)(\d+(?:\.\d+)?)X(\d+(?:\.\d+)?)")
+
+
+def normalize_label(section_name):
+    """
+    Returns the catalog key of a section name: upper case, without spaces.
+    """
+    return str(section_name).strip().upper().replace(" ", "")
+
+
+class SectionCatalog:
+    def __init__(self, path):
+        """
+        Initializes an empty catalog. The database is read the first time a section is asked for.
+
+        Parameters:
+        - path: the AISC shapes database csv.
+        """
+        self.path = path
+        self._sections = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def sections(self):
+        """
+        The sections keyed by label, loading the database if it has not been read yet.
+        """
+        if self._sections is None:
+            with self._load_lock:
+                if self._sections is None:
+                    self._sections = self._load()
+        return self._sections
+
+    def _load(self):
+        """
+        Reads the shapes database and returns its sections keyed by label.
+        """
+        # 1. Read in the csv file with profile data.
+        try:
+            shapes_df = pd.read_csv(self.path, encoding='utf-8')
+        except UnicodeDecodeError:
+            shapes_df = pd.read_csv(self.path, encoding='ISO-8859-1')
+        except FileNotFoundError:
+            print(f'File not found: {self.path}')
+            raise
+
+        # 2. Keep every numeric value, converting lengths to feet.
+        sections = {}
+        for row in shapes_df.to_dict("records"):
+            label = normalize_label(row["AISC_Manual_Label"])
+            section = {"label": label, "type": str(row["Type"]).strip().upper()}
+            for column, value in row.items():
+                if column in ("Type", "AISC_Manual_Label", "EDI_Std_Nomenclature", "T_F"):
+                    continue
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    continue
+                if value != value:  # NaN
+                    continue
+                section[column] = value / 12 if column in LENGTH_COLUMNS else value
+            sections[label] = section
+        print(f"Loaded {len(sections)} sections from {self.path}")
+        return sections
+
+    def get(self, section_name):
+        """
+        Returns the section with the given label, or None if the catalog does not have it.
+
+        Parameters:
+        - section_name: the AISC manual label, e.g. W12X53.
+        """
+        return self.sections.get(normalize_label(section_name))
+
+    def require(self, section_name):
+        """
+        Returns the section with the given label, raising ValueError with the nearest size if there is none.
+
+        Parameters:
+        - section_name: the AISC manual label, e.g. W12X53.
+        """
+        section = self.get(section_name)
+        if section is None:
+            nearest = self.nearest(section_name)
+            hint = f" Nearest size: {nearest['label']}." if nearest else ""
+            raise ValueError(
+                f"Section {section_name} not found in AISC database.{hint}")
+        return section
+
+    def with_prefix(self, prefix):
+        """
+        Returns the labels that start with the given prefix, e.g. W12 or HSS6X6, lightest first.
+
+        Parameters:
+        - prefix: the start of the label.
+        """
+        prefix = normalize_label(prefix)
+        return sorted((label for label in self.sections if label.startswith(prefix)),
+                      key=lambda label: (self.sections[label].get("W", 0.0), label))
+
+    def nearest(self, section_name):
+        """
+        Returns the catalog section closest to the given label: the same label if it exists, otherwise the
+        same shape type and nominal depth with the closest weight, otherwise the same type with the closest
+        depth. Returns None if the label cannot be read or the type is not in the catalog.
+
+        Parameters:
+        - section_name: the AISC manual label, e.g. W12X52.
+        """
+        label = normalize_label(section_name)
+        if label in self.sections:
+            return self.sections[label]
+        match = LABEL_PATTERN.match(label)
+        if match is None:
+            return None
+        shape_type, depth, weight = match.group(1), float(match.group(2)), float(match.group(3))
+        candidates = []
+        for candidate in self.sections.values():
+            candidate_match = LABEL_PATTERN.match(candidate["label"])
+            if candidate_match is None or candidate_match.group(1) != shape_type:
+                continue
+            candidates.append((abs(float(candidate_match.group(2)) - depth),
+                               abs(float(candidate_match.group(3)) - weight), candidate["label"], candidate))
+        if not candidates:
+            return None
+        return min(candidates)[3]
+
+
+# Singleton catalog shared by every model.
+section_catalog = SectionCatalog(CATALOG_PATH)
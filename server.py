@@ -12,9 +12,13 @@ from fastapi import Header, HTTPException
 import uvicorn
 from starlette.middleware.cors import CORSMiddleware
 from socket_server import sio
-from agent_graph import model_streamer
+from agent_graph import memory, model_streamer, tool_node
 from fastapi.staticfiles import StaticFiles
-from tools_graph import create_on_start
+from tools_graph import create_session
+from model_pool import model_pool
+from query_engine import query_stats
+from parsed_file_cache import parsed_file_cache
+from llm_clients import llm_metrics
 import hashlib
 import time
 import logging
@@ -52,10 +56,17 @@ app.mount("/public", StaticFiles(directory="public"), name="public")
 combined_asgi_app = socketio.ASGIApp(sio, app)
 
 
+@app.on_event("startup")
+async def warm_model_pool():
+    # Fill the IfcModel pool in the background so the first session does not wait on a build.
+    model_pool.start()
+
+
 @ sio.event
 async def DOMContentLoaded(sid):
     try:
-        await create_on_start()
+        if sid not in global_store.sid_to_ifc_model:
+            await asyncio.to_thread(create_session, sid)
         print("Created session start load with sid", sid)
     except Exception as e:
         logger.exception(f"Error in DOMContentLoaded: {str(e)}")
@@ -95,6 +106,40 @@ async def upload_file(file: UploadFile = File(...), sid: str = Form(None)):
             status_code=500, detail=f"File upload failed: {str(e)}")
 
 
+@app.get("/delta/{sid}")
+async def canvas_delta(sid: str, since: int = 0):
+    """
+    Returns the changes to the session's canvas since the given version, keyed by GlobalId.
+    """
+    ifc_model = global_store.sid_to_ifc_model.get(sid, None)
+    if ifc_model is None:
+        raise HTTPException(status_code=404, detail="No IFC model found for this session")
+    return ifc_model.get_delta(since)
+
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Returns the server's runtime metrics.
+    """
+    interning = {"requests": 0, "created": 0}
+    feature_cache = {"entries": 0, "hits": 0, "misses": 0, "invalidations": 0}
+    for ifc_model in list(global_store.sid_to_ifc_model.values()):
+        stats = ifc_model.interning_stats()
+        interning["requests"] += stats["requests"]
+        interning["created"] += stats["created"]
+        stats = ifc_model.feature_cache.stats()
+        for key in feature_cache:
+            feature_cache[key] += stats[key]
+    interning["dedup_ratio"] = 1 - interning["created"] / \
+        interning["requests"] if interning["requests"] else 0.0
+    lookups = feature_cache["hits"] + feature_cache["misses"]
+    feature_cache["hit_rate"] = feature_cache["hits"] / lookups if lookups else None
+    return {"model_pool": model_pool.metrics(), "interning": interning, "search_canvas": dict(query_stats),
+            "parsed_file_cache": parsed_file_cache.stats(), "feature_cache": feature_cache, "llm": llm_metrics(),
+            "conversation_memory": memory.stats(), "tool_batches": tool_node.stats()}
+
+
 @ sio.event
 async def userAction(sid, data):
     try:
@@ -1,8 +1,8 @@
-import asyncio
 import socketio
 from global_store import global_store
 import os
 import shutil
+from parsed_file_cache import parsed_file_cache
 
 
 # Create a Socket.IO server allowing CORS for specific origins
@@ -10,17 +10,40 @@ sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins=[
                            "http://localhost:5173", "http://34.44.107.80:5173", "http://localhost:3001", "http://localhost:3000", "https://client-next-supabase.vercel.app", "https://buildsync-playground.app"])
 
 
+# The longest session id a client may send on connect.
+MAX_SESSION_ID_LENGTH = 128
+
+
 @sio.event
 async def connection(sid):
     print("Client connected to server")
 
 
+@sio.event
+async def connect(sid, environ, auth=None):
+    """
+    Records the session id the client sends in its auth payload ({"sessionId": ...}). A client that reconnects
+    under a new sid, e.g. after a restart, sends the same one and resumes its persisted conversation and model.
+    """
+    session_id = auth.get("sessionId") if isinstance(auth, dict) else None
+    if isinstance(session_id, str) and 0 < len(session_id) <= MAX_SESSION_ID_LENGTH:
+        global_store.sid_to_session[sid] = session_id
+
+
 @sio.event
 async def disconnect(sid):
     print("User Disconnected from server")
-    global_store.sid_to_ifc_model.pop(sid, None)
+    ifc_model = global_store.sid_to_ifc_model.pop(sid, None)
+    if ifc_model is not None:
+        ifc_model.close()
+    global_store.sid_to_search_results.pop(sid, None)
+    global_store.sid_to_lock.pop(sid, None)
+    # The session's history and model snapshot are kept for its client to reconnect; they expire after
+    # DURABLE_SESSION_TTL.
+    global_store.sid_to_session.pop(sid, None)
 
     directory_path = os.path.join('public', sid)
+    parsed_file_cache.forget_directory(directory_path)
     if os.path.exists(directory_path) and os.path.isdir(directory_path):
         shutil.rmtree(directory_path)
         print(f"Deleted directory: {directory_path}")
@@ -0,0 +1,394 @@
+"""
+Per-session spatial index of element bounding boxes. Boxes are computed from each product's placement chain and
+its representation items (extrusions, polylines and mapped items), without running a geometry kernel, and kept
+in a uniform grid so nearest, range, extreme and containment questions can be answered without an LLM.
+"""
+import math
+import os
+import numpy as np
+
+# Edge length of a grid cell, in model units (feet).
+SPATIAL_CELL_SIZE = float(os.getenv("IFC_SPATIAL_CELL_SIZE", "10.0"))
+# Boxes spanning more cells than this are kept in a separate list that every query checks.
+MAX_CELLS_PER_BOX = int(os.getenv("IFC_SPATIAL_MAX_CELLS", "512"))
+
+AXES = {"x": 0, "y": 1, "z": 2}
+
+
+def axis2placement_matrix(placement):
+    """
+    Returns the 4x4 matrix of an IfcAxis2Placement2D/3D. A missing placement is the identity.
+    """
+    matrix = np.eye(4)
+    if placement is None:
+        return matrix
+    location = list(placement.Location.Coordinates) + [0.0] * (3 - len(placement.Location.Coordinates))
+    z_axis = np.array([0., 0., 1.])
+    x_axis = np.array([1., 0., 0.])
+    if placement.is_a("IfcAxis2Placement3D"):
+        if placement.Axis is not None:
+            z_axis = np.array(placement.Axis.DirectionRatios, dtype=float)
+        if placement.RefDirection is not None:
+            x_axis = np.array(placement.RefDirection.DirectionRatios, dtype=float)
+    elif placement.RefDirection is not None:
+        x_axis = np.array(list(placement.RefDirection.DirectionRatios) + [0.0], dtype=float)
+    # Gram-Schmidt, as the schema does when RefDirection is not exactly perpendicular to Axis.
+    z_axis = z_axis / np.linalg.norm(z_axis)
+    x_axis = x_axis - np.dot(x_axis, z_axis) * z_axis
+    if np.linalg.norm(x_axis) < 1e-12:
+        x_axis = np.array([1., 0., 0.]) if abs(z_axis[0]) < 0.9 else np.array([0., 1., 0.])
+        x_axis = x_axis - np.dot(x_axis, z_axis) * z_axis
+    x_axis = x_axis / np.linalg.norm(x_axis)
+    y_axis = np.cross(z_axis, x_axis)
+    matrix[:3, 0] = x_axis
+    matrix[:3, 1] = y_axis
+    matrix[:3, 2] = z_axis
+    matrix[:3, 3] = location
+    return matrix
+
+
+def placement_matrix(object_placement):
+    """
+    Returns the world matrix of an IfcLocalPlacement by composing it with everything it is placed relative to.
+    """
+    matrix = np.eye(4)
+    placement = object_placement
+    while placement is not None and placement.is_a("IfcLocalPlacement"):
+        matrix = axis2placement_matrix(placement.RelativePlacement) @ matrix
+        placement = placement.PlacementRelTo
+    return matrix
+
+
+def transform_operator_matrix(operator):
+    """
+    Returns the matrix of an IfcCartesianTransformationOperator (mapping target).
+    """
+    matrix = np.eye(4)
+    if operator is None:
+        return matrix
+    scale = operator.Scale if operator.Scale is not None else 1.0
+    axis1 = getattr(operator, "Axis1", None)
+    axis2 = getattr(operator, "Axis2", None)
+    axis3 = getattr(operator, "Axis3", None)
+    if axis1 is not None:
+        matrix[:3, 0] = np.resize(np.array(axis1.DirectionRatios, dtype=float), 3)
+    if axis2 is not None:
+        matrix[:3, 1] = np.resize(np.array(axis2.DirectionRatios, dtype=float), 3)
+    if axis3 is not None:
+        matrix[:3, 2] = np.array(axis3.DirectionRatios, dtype=float)
+    matrix[:3, :3] *= scale
+    origin = list(operator.LocalOrigin.Coordinates)
+    matrix[:3, 3] = origin + [0.0] * (3 - len(origin))
+    return matrix
+
+
+def apply_matrix(matrix, points):
+    """
+    Transforms an (n, 3) array of points.
+    """
+    if len(points) == 0:
+        return points
+    return points @ matrix[:3, :3].T + matrix[:3, 3]
+
+
+def as_points(coordinates):
+    """
+    Returns coordinate tuples as an (n, 3) array, padding 2D coordinates with z = 0.
+    """
+    points = np.zeros((len(coordinates), 3))
+    for i, coordinate in enumerate(coordinates):
+        points[i, :len(coordinate)] = coordinate
+    return points
+
+
+def profile_points(profile):
+    """
+    Returns the outline points of a profile definition in its own 2D plane (z = 0).
+    """
+    if profile.is_a("IfcCompositeProfileDef"):
+        parts = [profile_points(part) for part in profile.Profiles]
+        return np.vstack(parts) if parts else np.zeros((0, 3))
+    if profile.is_a("IfcArbitraryClosedProfileDef"):
+        return curve_points(profile.OuterCurve)
+    points = np.zeros((0, 3))
+    if profile.is_a("IfcRectangleProfileDef"):
+        half_x, half_y = profile.XDim / 2, profile.YDim / 2
+        points = as_points([(-half_x, -half_y), (half_x, half_y)])
+    elif profile.is_a("IfcCircleProfileDef"):
+        points = as_points([(-profile.Radius, -profile.Radius), (profile.Radius, profile.Radius)])
+    if getattr(profile, "Position", None) is not None:
+        points = apply_matrix(axis2placement_matrix(profile.Position), points)
+    return points
+
+
+def curve_points(curve):
+    """
+    Returns the points of a polyline or indexed poly curve.
+    """
+    if curve.is_a("IfcPolyline"):
+        return as_points([point.Coordinates for point in curve.Points])
+    if curve.is_a("IfcIndexedPolyCurve"):
+        return as_points(curve.Points.CoordList)
+    return np.zeros((0, 3))
+
+
+def item_points(item):
+    """
+    Returns points whose bounding box is the bounding box of a representation item, in the item's
+    representation coordinates.
+    """
+    if item.is_a("IfcMappedItem"):
+        source = item.MappingSource
+        matrix = transform_operator_matrix(item.MappingTarget) @ axis2placement_matrix(source.MappingOrigin)
+        parts = [item_points(part) for part in source.MappedRepresentation.Items]
+        return apply_matrix(matrix, np.vstack(parts)) if parts else np.zeros((0, 3))
+    if item.is_a("IfcExtrudedAreaSolid"):
+        base = profile_points(item.SweptArea)
+        direction = np.array(item.ExtrudedDirection.DirectionRatios, dtype=float)
+        points = np.vstack([base, base + direction * item.Depth])
+        return apply_matrix(axis2placement_matrix(item.Position), points)
+    if item.is_a("IfcBooleanResult"):
+        return item_points(item.FirstOperand)
+    if item.is_a("IfcGeometricSet"):
+        parts = [item_points(element) for element in item.Elements]
+        return np.vstack(parts) if parts else np.zeros((0, 3))
+    if item.is_a("IfcCurve"):
+        return curve_points(item)
+    if item.is_a("IfcCartesianPoint"):
+        return as_points([item.Coordinates])
+    return np.zeros((0, 3))
+
+
+def element_bounds(product):
+    """
+    Returns the world-aligned bounding box of a product as (min, max) tuples, or None if it has no geometry the
+    index can read. Body representations are used when there are any.
+    """
+    shape = getattr(product, "Representation", None)
+    if shape is None or not shape.Representations:
+        return None
+    representations = [rep for rep in shape.Representations if rep.RepresentationIdentifier == "Body"]
+    parts = [item_points(item) for rep in (representations or shape.Representations) for item in rep.Items]
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return None
+    points = apply_matrix(placement_matrix(product.ObjectPlacement), np.vstack(parts))
+    return tuple(float(value) for value in points.min(axis=0)), tuple(float(value) for value in points.max(axis=0))
+
+
+def box_distance(point, box):
+    """
+    Returns the distance from a point to a box, 0 if it is inside.
+    """
+    lower, upper = box
+    return math.sqrt(sum(max(lower[i] - point[i], 0.0, point[i] - upper[i]) ** 2 for i in range(3)))
+
+
+class SpatialIndex:
+    def __init__(self, cell_size=SPATIAL_CELL_SIZE):
+        """
+        Initializes an empty index.
+
+        Parameters:
+        - cell_size: the edge length of a grid cell, in model units.
+        """
+        self.cell_size = cell_size
+        self.boxes = dict()
+        self.products = dict()
+        self.classes = dict()
+        self._cells = dict()
+        self._cells_of = dict()
+        self._oversized = set()
+        # Which concrete classes satisfy an is_a filter, so queries compare strings instead of calling is_a.
+        self._class_filters = dict()
+        # Smallest and largest occupied cell index on each axis; only ever grows, which keeps it a safe bound.
+        self._cell_bounds = None
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def _cell(self, point):
+        return tuple(int(math.floor(value / self.cell_size)) for value in point)
+
+    def _cell_range(self, lower, upper):
+        low, high = self._cell(lower), self._cell(upper)
+        return [(i, j, k) for i in range(low[0], high[0] + 1)
+                for j in range(low[1], high[1] + 1)
+                for k in range(low[2], high[2] + 1)]
+
+    def update(self, product, box=None):
+        """
+        Inserts a product or moves it to its current box. Products without readable geometry are left out.
+
+        Parameters:
+        - product: the IfcProduct.
+        - box: the product's bounding box if it is already known, e.g. from a snapshot. Computed otherwise.
+        """
+        guid = product.GlobalId
+        self.remove(guid)
+        if box is None:
+            try:
+                box = element_bounds(product)
+            except Exception as e:
+                print(f"Could not compute the bounding box of {guid}: {e}")
+                box = None
+        if box is None:
+            return
+        self.boxes[guid] = box
+        self.products[guid] = product
+        self.classes[guid] = product.is_a()
+        low, high = self._cell(box[0]), self._cell(box[1])
+        count = (high[0] - low[0] + 1) * (high[1] - low[1] + 1) * (high[2] - low[2] + 1)
+        if count > MAX_CELLS_PER_BOX:
+            self._oversized.add(guid)
+            return
+        cells = self._cell_range(*box)
+        if self._cell_bounds is None:
+            self._cell_bounds = (list(low), list(high))
+        for axis in range(3):
+            self._cell_bounds[0][axis] = min(self._cell_bounds[0][axis], low[axis])
+            self._cell_bounds[1][axis] = max(self._cell_bounds[1][axis], high[axis])
+        for cell in cells:
+            self._cells.setdefault(cell, set()).add(guid)
+        self._cells_of[guid] = cells
+
+    def remove(self, guid):
+        """
+        Removes a product from the index.
+
+        Parameters:
+        - guid: the product's GlobalId.
+        """
+        if self.boxes.pop(guid, None) is None:
+            return
+        self.products.pop(guid, None)
+        self.classes.pop(guid, None)
+        self._oversized.discard(guid)
+        for cell in self._cells_of.pop(guid, ()):
+            bucket = self._cells.get(cell)
+            if bucket is not None:
+                bucket.discard(guid)
+                if not bucket:
+                    del self._cells[cell]
+
+    def _matches(self, guid, ifc_class):
+        if ifc_class is None:
+            return True
+        matching = self._class_filters.setdefault(ifc_class, dict())
+        class_name = self.classes[guid]
+        if class_name not in matching:
+            matching[class_name] = self.products[guid].is_a(ifc_class)
+        return matching[class_name]
+
+    def range(self, lower, upper, ifc_class=None):
+        """
+        Returns the GlobalIds of products whose boxes intersect the given box.
+
+        Parameters:
+        - lower: the (x, y, z) minimum corner.
+        - upper: the (x, y, z) maximum corner.
+        - ifc_class: only return products of this IFC class.
+        """
+        candidates = set(self._oversized)
+        for cell in self._cell_range(lower, upper):
+            candidates.update(self._cells.get(cell, ()))
+        result = []
+        for guid in candidates:
+            box_lower, box_upper = self.boxes[guid]
+            if all(box_lower[i] <= upper[i] and box_upper[i] >= lower[i] for i in range(3)) and self._matches(guid, ifc_class):
+                result.append(guid)
+        return result
+
+    def containing(self, point, ifc_class=None):
+        """
+        Returns the GlobalIds of products whose boxes contain a point.
+
+        Parameters:
+        - point: the (x, y, z) point.
+        - ifc_class: only return products of this IFC class.
+        """
+        return self.range(point, point, ifc_class)
+
+    def within(self, lower, upper, ifc_class=None):
+        """
+        Returns the GlobalIds of products whose boxes lie entirely inside the given box.
+
+        Parameters:
+        - lower: the (x, y, z) minimum corner.
+        - upper: the (x, y, z) maximum corner.
+        - ifc_class: only return products of this IFC class.
+        """
+        return [guid for guid in self.range(lower, upper, ifc_class)
+                if all(self.boxes[guid][0][i] >= lower[i] and self.boxes[guid][1][i] <= upper[i] for i in range(3))]
+
+    def nearest(self, point, k=1, ifc_class=None, exclude=()):
+        """
+        Returns the GlobalIds of the k products closest to a point, closest first.
+
+        Parameters:
+        - point: the (x, y, z) point.
+        - k: how many products to return.
+        - ifc_class: only consider products of this IFC class.
+        - exclude: GlobalIds to leave out, e.g. the product the point came from.
+        """
+        if not self.boxes:
+            return []
+        found = dict()
+        for guid in self._oversized:
+            if guid not in exclude and self._matches(guid, ifc_class):
+                found[guid] = box_distance(point, self.boxes[guid])
+        if self._cell_bounds is None:
+            return [guid for guid, _ in sorted(found.items(), key=lambda entry: entry[1])[:k]]
+        # Search rings of cells outwards, clipped to the occupied part of the grid, until no unvisited cell can
+        # hold anything closer. If the rings cover more cells than there are occupied ones, scanning every box
+        # is cheaper, so fall back to that.
+        center = self._cell(point)
+        lower, upper = self._cell_bounds
+        max_ring = max(max(abs(lower[i] - center[i]), abs(upper[i] - center[i])) for i in range(3))
+        visited = 0
+        for ring in range(max_ring + 1):
+            for i in range(max(center[0] - ring, lower[0]), min(center[0] + ring, upper[0]) + 1):
+                for j in range(max(center[1] - ring, lower[1]), min(center[1] + ring, upper[1]) + 1):
+                    for l in range(max(center[2] - ring, lower[2]), min(center[2] + ring, upper[2]) + 1):
+                        if max(abs(i - center[0]), abs(j - center[1]), abs(l - center[2])) != ring:
+                            continue
+                        visited += 1
+                        for guid in self._cells.get((i, j, l), ()):
+                            if guid not in found and guid not in exclude and self._matches(guid, ifc_class):
+                                found[guid] = box_distance(point, self.boxes[guid])
+            closest = sorted(found.values())[:k]
+            if len(closest) == k and closest[-1] <= ring * self.cell_size:
+                break
+            if visited > 4 * len(self._cells):
+                for guid in self.boxes:
+                    if guid not in found and guid not in exclude and self._matches(guid, ifc_class):
+                        found[guid] = box_distance(point, self.boxes[guid])
+                break
+        return [guid for guid, _ in sorted(found.items(), key=lambda entry: entry[1])[:k]]
+
+    def extreme(self, axis, largest=False, ifc_class=None):
+        """
+        Returns the GlobalId of the product furthest along an axis, e.g. the leftmost wall is
+        extreme("x", ifc_class="IfcWall"). Returns None if there is no such product.
+
+        Parameters:
+        - axis: "x", "y" or "z".
+        - largest: whether to look for the maximum (right, back, top) instead of the minimum.
+        - ifc_class: only consider products of this IFC class.
+        """
+        index = AXES[axis]
+        best_guid, best_value = None, None
+        for guid, (lower, upper) in self.boxes.items():
+            if not self._matches(guid, ifc_class):
+                continue
+            value = upper[index] if largest else lower[index]
+            if best_value is None or (value > best_value if largest else value < best_value):
+                best_guid, best_value = guid, value
+        return best_guid
+
+    def stats(self):
+        """
+        Returns the number of indexed products, occupied cells and oversized boxes.
+        """
+        return {"products": len(self.boxes), "cells": len(self._cells), "oversized": len(self._oversized),
+                "cell_size": self.cell_size}
@@ -0,0 +1,9 @@
+"""
+Makes the repository's flat modules importable from the tests. Run from the repository root:
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+"""
+Tests of IfcModel batches: a failed batch leaves the model as it was, and nothing is saved or versioned while a
+batch is being applied.
+"""
+import pytest
+
+pytest.importorskip("ifcopenshell")
+from model_pool import new_session_model  # noqa: E402
+
+X = 1., 0., 0.
+Z = 0., 0., 1.
+
+
+@pytest.fixture
+def model(tmp_path):
+    model = new_session_model()
+    model.create_building_stories(0.0, "Level 1")
+    add_column(model, 0.0)
+    model.flush_idle_window = None
+    model.mark_dirty(str(tmp_path / "canvas.ifc"))
+    model.flush(wait=True)
+    return model
+
+
+def add_column(model, x):
+    story = model.building_story_list[0]
+    placement = model.create_ifclocalplacement((x, 0.0, 0.0), Z, X, relative_to=story.ObjectPlacement)
+    column = model.create_column(model.model_context, model.owner_history, placement, 10.0, "W12X53", "steel")
+    model.ifcfile.createIfcRelContainedInSpatialStructure(
+        model.create_guid(), model.owner_history, "Building story Container", None, [column], story)
+    model.record_added(column)
+    model.mark_dirty()
+    return column
+
+
+def state(model):
+    return (sorted(entity.id() for entity in model.ifcfile), sorted(product.GlobalId
+            for product in model.query_products()), model.version, len(model.building_story_list))
+
+
+@pytest.mark.parametrize("full", [True, False])
+def test_rollback_restores_the_model(model, full):
+    before = state(model)
+    snapshot = model.begin_batch(full=full)
+    add_column(model, 10.0)
+    model.create_building_stories(10.0, "Level 2")
+    model.end_batch(snapshot)
+    assert state(model) == before
+    # Cached handles to the removed entities are gone, so the model keeps working.
+    add_column(model, 20.0)
+    assert len(model.query_products("IfcColumn")) == 2
+
+
+def test_flush_waits_for_the_batch(model):
+    version = model.version
+    model.begin_batch(snapshot=False)
+    add_column(model, 10.0)
+    model.flush(wait=True)
+    assert model.version == version and model.dirty
+    model.end_batch()
+    model.flush(wait=True)
+    assert model.version == version + 1 and not model.dirty
@@ -0,0 +1,87 @@
+"""
+Tests of compact_messages: cuts only at user turns, keeps each turn's context, truncates earlier tool outputs.
+Also checks that the saver's published stats never name a thread, and that a new worker resumes a session by the
+session id its client sends.
+"""
+import asyncio
+import pytest
+
+pytest.importorskip("langgraph")
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage  # noqa: E402
+from langgraph.checkpoint.base import empty_checkpoint  # noqa: E402
+from checkpointer import BoundedMemorySaver, SqliteCheckpointer, compact_messages  # noqa: E402
+
+
+def turn(number, context=False, tool_output="ok"):
+    messages = [SystemMessage(content=f"selection {number}")] if context else []
+    return messages + [
+        HumanMessage(content=f"request {number}"),
+        AIMessage(content=f"calling a tool {number}"),
+        ToolMessage(content=tool_output, tool_call_id=f"call-{number}"),
+        AIMessage(content=f"done {number}"),
+    ]
+
+
+def test_short_conversations_are_kept():
+    messages = turn(1) + turn(2)
+    assert compact_messages(messages, max_messages=40) == messages
+
+
+def test_cut_keeps_whole_turns():
+    messages = turn(1) + turn(2) + turn(3)
+    compacted = compact_messages(messages, max_messages=9)
+    assert [message.content for message in compacted][0] == "request 2"
+    assert len(compacted) == 8
+
+
+def test_cut_keeps_the_context_sent_with_a_turn():
+    messages = turn(1, context=True) + turn(2, context=True) + turn(3, context=True)
+    compacted = compact_messages(messages, max_messages=11)
+    assert compacted[0].type == "system" and compacted[0].content == "selection 2"
+    assert compacted[1].content == "request 2"
+
+
+def test_earlier_tool_outputs_are_truncated():
+    messages = turn(1, tool_output="x" * 5000) + turn(2, context=True, tool_output="y" * 5000)
+    compacted = compact_messages(messages, max_messages=40, tool_chars=100)
+    assert compacted[2].content.startswith("x" * 100) and len(compacted[2].content) < 200
+    assert compacted[-2].content == "y" * 5000
+    assert messages[2].content == "x" * 5000
+
+
+def test_stats_are_aggregates_without_thread_ids():
+    saver = BoundedMemorySaver()
+    for thread_id in ("secret-sid-1", "secret-sid-2"):
+        config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}
+        checkpoint = empty_checkpoint()
+        checkpoint["channel_values"] = {"messages": turn(1)}
+        saver.put(config, checkpoint, {"source": "loop", "step": 0, "writes": None}, {})
+    stats = saver.stats()
+    assert stats["threads"] == 2 and stats["bytes_max"] <= stats["bytes"]
+    assert "secret-sid" not in repr(stats)
+
+
+def test_a_new_worker_resumes_a_session_by_its_id(tmp_path):
+    path = str(tmp_path / "checkpoints.sqlite3")
+    config = {"configurable": {"thread_id": "client-session", "checkpoint_ns": ""}}
+    saver = SqliteCheckpointer(path)
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": turn(1)}
+    saver.put(config, checkpoint, {"source": "loop", "step": 0, "writes": None}, {})
+    saver.persist_turn("client-session")
+
+    resumed = asyncio.run(SqliteCheckpointer(path).aget_tuple(config))
+    assert [message.content for message in resumed.checkpoint["channel_values"]["messages"]] == \
+        [message.content for message in turn(1)]
+
+
+def test_connect_maps_the_sid_to_the_client_session():
+    socket_server = pytest.importorskip("socket_server")
+    from global_store import global_store
+    asyncio.run(socket_server.connect("sid-1", {}, {"sessionId": "client-session"}))
+    asyncio.run(socket_server.connect("sid-2", {}, {"sessionId": 42}))
+    asyncio.run(socket_server.connect("sid-3", {}))
+    assert [global_store.session_id(sid) for sid in ("sid-1", "sid-2", "sid-3")] == \
+        ["client-session", "sid-2", "sid-3"]
+    for sid in ("sid-1", "sid-2", "sid-3"):
+        global_store.sid_to_session.pop(sid, None)
@@ -0,0 +1,88 @@
+"""
+Tests of find_delete_targets: a delete is only resolved locally when every part of the request was understood.
+None means the request goes to the LLM.
+"""
+import pytest
+
+tools_graph = pytest.importorskip("tools_graph")
+from model_pool import new_session_model  # noqa: E402
+
+X = 1., 0., 0.
+Z = 0., 0., 1.
+
+
+@pytest.fixture(scope="module")
+def model():
+    """
+    A model with walls 10, 25 and 30 feet long and columns 10 and 15 feet tall, on Level 1, and an empty Level 2.
+    """
+    model = new_session_model()
+    model.create_building_stories(0.0, "Level 1")
+    model.create_building_stories(10.0, "Level 2")
+    story = model.building_story_list[0]
+    products = {}
+    for length in (10.0, 25.0, 30.0):
+        placement = model.create_ifclocalplacement((0.0, length, 0.0), Z, X, relative_to=story.ObjectPlacement)
+        products[f"wall {length:g}"] = model.create_wall(model.model_context, model.owner_history, placement,
+                                                         length, 9.0, 0.75, "concrete")
+    for height in (10.0, 15.0):
+        placement = model.create_ifclocalplacement((height, 0.0, 0.0), Z, X, relative_to=story.ObjectPlacement)
+        products[f"column {height:g}"] = model.create_column(model.model_context, model.owner_history, placement,
+                                                             height, "W12X53", "steel")
+    model.ifcfile.createIfcRelContainedInSpatialStructure(
+        model.create_guid(), model.owner_history, "Building story Container", None, list(products.values()), story)
+    for product in products.values():
+        model.record_added(product)
+    model.guids = {name: product.GlobalId for name, product in products.items()}
+    return model
+
+
+def targets(model, **request):
+    guids = tools_graph.find_delete_targets(model, **request)
+    if guids is None:
+        return None
+    names = {guid: name for name, guid in model.guids.items()}
+    return sorted(names[guid] for guid in guids)
+
+
+def test_comparatives_delete_only_the_matches(model):
+    assert targets(model, delete_query="delete walls longer than 20 feet") == ["wall 25", "wall 30"]
+    assert targets(model, delete_query="delete columns taller than 12") == ["column 15"]
+
+
+@pytest.mark.parametrize("delete_query", [
+    "delete the walls that are red",
+    "delete 3 columns",
+    "delete the wall",
+    "delete the column on the left of the door",
+])
+def test_unparsed_or_ambiguous_queries_go_to_the_llm(model, delete_query):
+    assert targets(model, delete_query=delete_query) is None
+
+
+def test_structured_condition(model):
+    assert targets(model, object_type="column", condition="taller than 10") == ["column 15"]
+    assert targets(model, object_type="wall", condition="length > 20") == ["wall 25", "wall 30"]
+
+
+@pytest.mark.parametrize("request_", [
+    {"object_type": "column", "condition": "height above ten"},
+    {"object_type": "column", "condition": "red"},
+    {"object_type": "wall", "condition": "taller than 10 and painted"},
+    {"object_type": "pergola"},
+])
+def test_structured_filters_it_cannot_read_go_to_the_llm(model, request_):
+    assert targets(model, **request_) is None
+
+
+def test_global_ids(model):
+    assert targets(model, global_ids=[model.guids["wall 10"], "not-a-guid"]) == ["wall 10"]
+
+
+@pytest.mark.parametrize("request_", [
+    {"delete_query": "delete the storey Level 2"},
+    {"delete_query": "delete level 2"},
+    {"object_type": "storey", "storey": "Level 2"},
+])
+def test_deleting_a_storey_goes_to_the_llm(model, request_):
+    assert targets(model, **request_) is None
@@ -0,0 +1,42 @@
+"""
+Tests of FeatureCache: an entity's cached features must not depend on which extraction path filled the entry.
+"""
+import pytest
+
+pytest.importorskip("ifcopenshell")
+from feature_cache import FeatureCache  # noqa: E402
+from model_pool import new_session_model  # noqa: E402
+from test_feature_extractor import X, Z, add_beam  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def model():
+    """
+    A model with a wall, a column and a beam whose Axis is not a unit vector, on Level 1.
+    """
+    model = new_session_model()
+    model.create_building_stories(0.0, "Level 1")
+    story = model.building_story_list[0]
+    placement = model.create_ifclocalplacement((0.0, 0.0, 0.0), Z, X, relative_to=story.ObjectPlacement)
+    wall = model.create_wall(model.model_context, model.owner_history, placement, 20.0, 9.0, 0.75, "concrete")
+    placement = model.create_ifclocalplacement((5.0, 5.0, 0.0), Z, X, relative_to=story.ObjectPlacement)
+    column = model.create_column(model.model_context, model.owner_history, placement, 10.0, "W12X53", "steel")
+    beam = add_beam(model, story, (3.0, 3.0, 10.0), (8.0, 3.0, 10.0))
+    model.ifcfile.createIfcRelContainedInSpatialStructure(
+        model.create_guid(), model.owner_history, "Building story Container", None, [wall, column, beam], story)
+    model.products = [wall, column, beam]
+    return model
+
+
+def test_cached_entries_do_not_depend_on_the_path_that_filled_them(model):
+    one_by_one = FeatureCache(model)
+    batched = FeatureCache(model)
+    for entity in model.products:
+        one_by_one.extract_entity_features(entity)
+    batched.extract_features_batched(model.products)
+
+    # Read each cache through the other path, so every lookup is served from the entry.
+    assert one_by_one.extract_features_batched(model.products) == \
+        [batched.extract_entity_features(entity) for entity in model.products]
+    assert one_by_one.stats()["hits"] == len(model.products)
+    assert batched.stats()["hits"] == len(model.products)
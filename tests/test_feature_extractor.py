@@ -0,0 +1,58 @@
+"""
+Tests of the batched feature extraction: extract_batch and batch_rows must give the same features as
+extract_entity_features, one entity at a time.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("ifcopenshell")
+from feature_extractor import IfcEntityFeatureExtractor  # noqa: E402
+from model_pool import new_session_model  # noqa: E402
+
+X = 1., 0., 0.
+Z = 0., 0., 1.
+
+
+def add_beam(model, story, start, end):
+    """
+    Adds a beam from `start` to `end` the way the create_beam tool does, with its Axis left unnormalized.
+    """
+    direction = model.calc_direction(start, end)
+    placement = model.ifcfile.createIfcAxis2Placement3D(model.intern_point(start))
+    placement.Axis = model.intern_direction(direction)
+    placement.RefDirection = model.intern_direction(model.calc_cross(direction, Z))
+    local_placement = model.ifcfile.createIfcLocalPlacement(story.ObjectPlacement, placement)
+    return model.create_beam(model.model_context, model.owner_history, local_placement,
+                             model.calc_length(start, end), "W16X40", "steel")
+
+
+@pytest.fixture(scope="module")
+def products():
+    """
+    A wall, a column and a beam from (3,3,10) to (8,3,10), on Level 1.
+    """
+    model = new_session_model()
+    model.create_building_stories(0.0, "Level 1")
+    story = model.building_story_list[0]
+    placement = model.create_ifclocalplacement((0.0, 0.0, 0.0), Z, X, relative_to=story.ObjectPlacement)
+    wall = model.create_wall(model.model_context, model.owner_history, placement, 20.0, 9.0, 0.75, "concrete")
+    placement = model.create_ifclocalplacement((5.0, 5.0, 0.0), Z, X, relative_to=story.ObjectPlacement)
+    column = model.create_column(model.model_context, model.owner_history, placement, 10.0, "W12X53", "steel")
+    beam = add_beam(model, story, (3.0, 3.0, 10.0), (8.0, 3.0, 10.0))
+    model.ifcfile.createIfcRelContainedInSpatialStructure(
+        model.create_guid(), model.owner_history, "Building story Container", None, [wall, column, beam], story)
+    return {"wall": wall, "column": column, "beam": beam}
+
+
+@pytest.mark.parametrize("name", ["wall", "column", "beam"])
+def test_batch_rows_match_extract_entity_features(products, name):
+    extractor = IfcEntityFeatureExtractor()
+    entity = products[name]
+    [row] = extractor.batch_rows(extractor.extract_batch([entity]))
+    assert row == extractor.extract_entity_features(entity)
+
+
+def test_beam_end_follows_its_length_not_its_axis_magnitude(products):
+    extractor = IfcEntityFeatureExtractor()
+    [row] = extractor.batch_rows(extractor.extract_batch([products["beam"]]))
+    assert row["end_coord"] == str(np.array([8.0, 3.0, 10.0]))
@@ -0,0 +1,117 @@
+"""
+Tests of the local query parser: what it answers itself, and what it must leave to the LLM.
+"""
+import pytest
+from query_engine import _numeric, answer_locally, parse_condition, parse_query, wants_many
+
+OBJECT_TYPES = {
+    "wall": "IfcWall", "window": "IfcWindow", "column": "IfcColumn", "roof": "IfcRoof", "building": "IfcBuilding",
+    "door": "IfcDoor", "beam": "IfcBeam", "slab": "IfcSlab", "floor": "IfcSlab", "story": "IfcBuildingStorey",
+}
+STOREYS = ["Level 1", "Level 2"]
+
+
+def parse(text):
+    return parse_query(text, OBJECT_TYPES, STOREYS)
+
+
+@pytest.mark.parametrize("text, classes, storey, predicates, section, extreme", [
+    ("find all walls", ["IfcWall"], None, [], None, None),
+    ("find all the walls.", ["IfcWall"], None, [], None, None),
+    ("walls on level 2 with height > 10", ["IfcWall"], "Level 2", [("height", ">", 10.0)], None, None),
+    ("columns with section W16X40", ["IfcColumn"], None, [], "W16X40", None),
+    ("leftmost wall", ["IfcWall"], None, [], None, ("axis", "x", False)),
+    ("tallest column on Level 1", ["IfcColumn"], "Level 1", [], None, ("field", "height", True)),
+    ("show me every beam with length >= 12.5 ft", ["IfcBeam"], None, [("length", ">=", 12.5)], None, None),
+    ("walls with thickness of 0.75", ["IfcWall"], None, [("thickness", "of", 0.75)], None, None),
+])
+def test_parses(text, classes, storey, predicates, section, extreme):
+    query = parse(text)
+    assert query == {"classes": classes, "storey": storey, "predicates": predicates, "section": section,
+                     "extreme": extreme}
+
+
+@pytest.mark.parametrize("text, predicate", [
+    ("columns taller than 12", ("height", "taller than", 12.0)),
+    ("walls longer than 20 feet", ("length", "longer than", 20.0)),
+    ("delete walls longer than 20 feet", ("length", "longer than", 20.0)),
+    ("delete columns taller than 12", ("height", "taller than", 12.0)),
+    ("slabs thicker than 1'", ("thickness", "thicker than", 1.0)),
+    ("walls shorter than 8 ft", ("height", "shorter than", 8.0)),
+])
+def test_comparatives_name_their_field(text, predicate):
+    assert parse(text)["predicates"] == [predicate]
+
+
+@pytest.mark.parametrize("text", [
+    "delete the walls that are red",
+    "delete 3 columns",
+    "the 3 longest beams",
+    "find wall 2O2Fr$t4X7Zf8NOew3FLOH",
+    "columns taller than the beams",
+    "beams near column 3",
+    "walls except on level 2",
+    "what is the total wall area",
+])
+def test_unparsed_words_go_to_the_llm(text):
+    assert parse(text) is None
+
+
+@pytest.mark.parametrize("text, many", [
+    ("delete all walls", True),
+    ("delete the walls", True),
+    ("delete every column", True),
+    ("delete the wall", False),
+    ("delete the leftmost column", False),
+])
+def test_wants_many(text, many):
+    assert wants_many(text, OBJECT_TYPES) is many
+
+
+@pytest.mark.parametrize("text, predicates", [
+    ("height > 10", [("height", ">", 10.0)]),
+    ("taller than 10", [("height", "taller than", 10.0)]),
+    ("length >= 12 ft and thickness < 1", [("length", ">=", 12.0), ("thickness", "<", 1.0)]),
+])
+def test_parse_condition(text, predicates):
+    assert parse_condition(text) == predicates
+
+
+@pytest.mark.parametrize("text", ["", "red", "height above ten", "taller than 10 and red", "tall"])
+def test_parse_condition_rejects_what_it_does_not_understand(text):
+    assert parse_condition(text) is None
+
+
+def test_wall_length_comes_from_its_end_points():
+    features = {"type": "IfcWallStandardCase", "start_coord": "[0. 3. 0.]", "end_coord": "[ 0. 15.  0.]"}
+    assert _numeric(features, "length") == 12.0
+    assert _numeric({"length": 5.0, "start_coord": [0, 0, 0], "end_coord": [9, 0, 0]}, "length") == 5.0
+    assert _numeric({"type": "IfcColumn"}, "length") is None
+
+
+@pytest.fixture(scope="module")
+def storeys_model():
+    """
+    A model with Level 1 and Level 2, and a column on Level 2.
+    """
+    pytest.importorskip("ifcopenshell")
+    from model_pool import new_session_model
+    model = new_session_model()
+    model.create_building_stories(0.0, "Level 1")
+    model.create_building_stories(10.0, "Level 2")
+    story = model.building_story_list[1]
+    placement = model.create_ifclocalplacement((0.0, 0.0, 0.0), (0., 0., 1.), (1., 0., 0.),
+                                               relative_to=story.ObjectPlacement)
+    column = model.create_column(model.model_context, model.owner_history, placement, 10.0, "W12X53", "steel")
+    model.ifcfile.createIfcRelContainedInSpatialStructure(
+        model.create_guid(), model.owner_history, "Building story Container", None, [column], story)
+    model.record_added(column)
+    return model
+
+
+@pytest.mark.parametrize("source", ["model", "file"])
+def test_a_named_storey_is_found_by_name(storeys_model, source):
+    searched = storeys_model if source == "model" else storeys_model.ifcfile
+    query, results = answer_locally(searched, "find storey Level 2", storeys_model.object_types)
+    assert query["classes"] == ["IfcBuildingStorey"] and query["storey"] == "Level 2"
+    assert [features["name"] for features in results] == ["Level 2"]
@@ -1,11 +1,79 @@
-def format_output_search_canvas(data_list):
-    formatted_output = "Relevant IFC Objects found through search_canvas:\n\n"
-    for index, item in enumerate(data_list, 1):
-        formatted_output += f"Object {index}:\n"
-        for key, value in item.items():
-            formatted_output += f"  {key}: {value}\n"
-        formatted_output += "\n"
-    return formatted_output
+import os
+import re
+from collections import Counter
+
+# Most characters of search results put in one tool message (about 4 characters per token), and most objects.
+SEARCH_RESULT_CHAR_BUDGET = int(os.getenv("SEARCH_RESULT_CHAR_BUDGET", "6000"))
+SEARCH_RESULT_TOP_K = int(os.getenv("SEARCH_RESULT_TOP_K", "20"))
+
+NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?")
+
+
+def summarize_search_results(data_list):
+    """
+    Returns aggregate statistics of search results: the count per type, the storeys, the sections used and
+    the extents of the objects' start and end coordinates.
+    """
+    types = Counter(item.get("type") for item in data_list)
+    storeys = Counter(item.get("storey_name") for item in data_list if item.get("storey_name"))
+    sections = Counter(item.get("section_name") for item in data_list if item.get("section_name"))
+    low, high = [None] * 3, [None] * 3
+    for item in data_list:
+        for key in ("start_coord", "end_coord"):
+            values = NUMBER_PATTERN.findall(str(item.get(key) or ""))
+            if len(values) != 3:
+                continue
+            for axis, value in enumerate(map(float, values)):
+                low[axis] = value if low[axis] is None else min(low[axis], value)
+                high[axis] = value if high[axis] is None else max(high[axis], value)
+
+    lines = [f"Matches: {len(data_list)}"]
+    if types:
+        lines[0] += " (" + ", ".join(f"{name}: {count}" for name, count in types.most_common()) + ")"
+    if storeys:
+        lines.append("Storeys: " + ", ".join(f"{name} ({count})" for name, count in storeys.most_common()))
+    if sections:
+        lines.append("Sections used: " + ", ".join(f"{name} ({count})" for name, count in sections.most_common()))
+    if low[0] is not None:
+        lines.append("Extents: " + ", ".join(
+            f"{axis} [{low[index]:g}, {high[index]:g}]" for index, axis in enumerate("xyz")))
+    return "\n".join(lines) + "\n"
+
+
+def format_output_search_canvas(data_list, offset=0, cursor_id=None, budget=SEARCH_RESULT_CHAR_BUDGET,
+                                top_k=SEARCH_RESULT_TOP_K):
+    """
+    Renders search results for the agent: aggregate statistics, then objects from offset on until top_k objects
+    or the character budget is reached, then a cursor to the next page if objects are left over.
+
+    Parameters:
+    - data_list: the feature dicts of every matching object.
+    - offset: the index of the first object to render.
+    - cursor_id: the id of the stored results the cursor refers to. Without one, no cursor is printed.
+    - budget: the most characters to render, or None for no limit.
+    - top_k: the most objects to render, or None for no limit.
+    """
+    # 1. Aggregates over every match, so the agent sees the whole result even when it is paged.
+    parts = ["Relevant IFC Objects found through search_canvas:\n\n", summarize_search_results(data_list), "\n"]
+    used = sum(len(part) for part in parts)
+
+    # 2. As many objects as fit; at least one so every page makes progress.
+    end = offset
+    while end < len(data_list) and (top_k is None or end - offset < top_k):
+        block = f"Object {end + 1}:\n" + "".join(f"  {key}: {value}\n" for key, value in data_list[end].items()) + "\n"
+        if budget is not None and end > offset and used + len(block) > budget:
+            break
+        parts.append(block)
+        used += len(block)
+        end += 1
+
+    # 3. Where the next page starts.
+    if end < len(data_list):
+        parts.append(f"Showing objects {offset + 1}-{end} of {len(data_list)}.")
+        if cursor_id is not None:
+            parts.append(f' To see more, call search_canvas with cursor="{cursor_id}:{end}".')
+        parts.append("\n")
+    return "".join(parts)
 
 def format_output_search_result(data_list):
     formatted_output = ""
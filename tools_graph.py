@@ -7,25 +7,35 @@ from ifcopenshell.api import run
 import asyncio
 from socket_server import sio
 from collections import OrderedDict
-from openai import OpenAI
-import os
 from dotenv import load_dotenv
 import json
 import numpy as np
 from feature_extractor import IfcEntityFeatureExtractor
 from tool_helpers import format_output_search_canvas
-from groq import Groq
+from llm_clients import cached_chat_content, chat_completion
 from global_store import global_store
+from model_pool import model_pool
+from query_engine import answer_locally, class_vocabulary, parse_condition, parse_query, record_query, run_query, storey_names_of, wants_many
+from parsed_file_cache import parsed_file_cache
+from checkpointer import checkpointer
+import time
+import uuid
+import functools
+import threading
 
 load_dotenv()
 
 global levels_dict
 levels_dict = {}
 
-global openai_client
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-global groq_client
-groq_client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+# System prompt of step_by_step_planner.
+ARCHITECT_PROMPT = """You are an experienced architect and structural engineer planning work for an AI BIM modeler.
+The modeler can create building stories, grids, walls, columns, beams, floors (slabs), roofs, isolated and strip
+footings and voids in walls, search the model, and delete objects. Units are feet.
+Turn the user's request into a short, numbered, step by step plan the modeler can follow with those tools.
+Fill in any missing dimensions, story heights, spacings, section sizes and materials with sensible values, state
+every coordinate explicitly, and build from the bottom up: stories, then footings, columns, beams, walls, floors
+and roofs. Return only the plan."""
 
 
 ## ---- TOOLS FOR MODEL TO CALL ----- #
@@ -37,6 +47,24 @@ X = 1., 0., 0.
 Y = 0., 1., 0.
 Z = 0., 0., 1.
 
+# Held while a session's model is created, so concurrent callers for one sid do not each take a pooled model.
+_create_session_lock = threading.Lock()
+
+
+def locked_model(func):
+    """
+    Runs a tool that changes the session's model while holding the model's lock, which saves also hold while they
+    serialize the file, so a save never writes a half-made change.
+    Goes under @tool; the session's model is created first if there is none.
+    """
+    @functools.wraps(func)
+    def wrapper(sid, *args, **kwargs):
+        if global_store.sid_to_ifc_model.get(sid, None) is None:
+            create_session(sid)
+        with global_store.sid_to_ifc_model[sid].lock:
+            return func(sid, *args, **kwargs)
+    return wrapper
+
 
 @tool
 async def create_on_start():
@@ -67,22 +95,28 @@ async def create_on_start():
 @tool
 def create_session(sid: Annotated[str, InjectedToolArg]) -> bool:
     """
-    Creates a new IFC model for the user.
+    Creates a new IFC model for the user, or resumes the session's persisted model after a restart or a move
+    to another worker. A session that already has a model keeps it.
     """
     # 1. Tries to make the session.
     try:
-        # 2. Writes info in the IFC model.
-        print('Creating a new IFC model for session', sid)
-        ifc_model = IfcModel(
-            creator="Aliyan",
-            organization="BuildSync",
-            application="IfcOpenShell",
-            application_version="0.5",
-            project_name="Modular IFC Project",
-            filename=None
-        )
-        global_store.sid_to_ifc_model[sid] = ifc_model
-        ifc_model.save_ifc(f"public/{sid}/canvas.ifc")
+        with _create_session_lock:
+            if global_store.sid_to_ifc_model.get(sid, None) is not None:
+                return True
+            # 2. Takes a ready model from the pool and points it at the session's canvas.
+            print('Creating a new IFC model for session', sid)
+            ifc_model = model_pool.acquire()
+            ifc_model.save_path = f"public/{sid}/canvas.ifc"
+            # 3. Restores the session's last persisted state, if there is one.
+            session_id = global_store.session_id(sid)
+            snapshot = (checkpointer.load_model_snapshot(session_id)
+                        if hasattr(checkpointer, "load_model_snapshot") else None)
+            if snapshot is not None:
+                print('Resuming the persisted IFC model of session', sid)
+                ifc_model.restore_snapshot(snapshot)
+            global_store.sid_to_ifc_model[sid] = ifc_model
+        # 4. Writes the canvas file outside the lock; other sessions need not wait for it.
+        ifc_model.save_ifc(ifc_model.save_path).result()
         return True
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -90,6 +124,7 @@ def create_session(sid: Annotated[str, InjectedToolArg]) -> bool:
 
 
 @tool
+@locked_model
 def create_building_story(sid: Annotated[str, InjectedToolArg], elevation: float = 0.0, name: str = "Level 1") -> bool:
     """
     Creates building stories with the specified amount, elevation, and height.
@@ -108,7 +143,7 @@ def create_building_story(sid: Annotated[str, InjectedToolArg], elevation: float
     try:
         # 1. Create the building story
         IFC_MODEL.create_building_stories(elevation, name)
-        IFC_MODEL.save_ifc(f"public/{sid}/canvas.ifc")
+        IFC_MODEL.mark_dirty(f"public/{sid}/canvas.ifc")
 
         # 2. Update the global dictionary
         levels_dict[name] = elevation
@@ -120,6 +155,7 @@ def create_building_story(sid: Annotated[str, InjectedToolArg], elevation: float
 
 
 @tool
+@locked_model
 def create_beam(sid: Annotated[str, InjectedToolArg], start_coord: str = "0,0,0", end_coord: str = "1,0,0", section_name: str = 'W16X40', story_n: int = 1, material: str = None,) -> None:
     """
     Creates a beam at the specified start coordinate with the given dimensions.
@@ -147,70 +183,40 @@ def create_beam(sid: Annotated[str, InjectedToolArg], start_coord: str = "0,0,0"
         length = IFC_MODEL.calc_length(start_coord, end_coord)
 
         # 2. Setup the IFC model.
-        context = IFC_MODEL.ifcfile.by_type(
-            "IfcGeometricRepresentationContext")[0]
-        owner_history = IFC_MODEL.ifcfile.by_type("IfcOwnerHistory")[0]
+        context = IFC_MODEL.model_context
+        owner_history = IFC_MODEL.owner_history
         if len(IFC_MODEL.building_story_list) < story_n:
             IFC_MODEL.create_building_stories(
                 elevation=0, name="Level 1")
         story = IFC_MODEL.building_story_list[story_n - 1]
 
-        # 3. Initiate beam creation.
-        # Note: eventually, we'll want to pass in various beam names.
-        bm = IFC_MODEL.ifcfile.createIfcBeam(
-            IFC_MODEL.create_guid(), owner_history, "Beam")
-
-        # 4. Define beam placement
+        # 3. Define beam placement
         Z = (0.0, 0.0, 1.0)
 
-        # 4-1. Define beam starting point, hosting axis, & direction.
+        # 3-1. Define beam starting point, hosting axis, & direction.
         bm_axis2placement = IFC_MODEL.ifcfile.createIfcAxis2Placement3D(
-            IFC_MODEL.ifcfile.createIfcCartesianPoint(start_coord))
-        bm_axis2placement.Axis = IFC_MODEL.ifcfile.createIfcDirection(
+            IFC_MODEL.intern_point(start_coord))
+        bm_axis2placement.Axis = IFC_MODEL.intern_direction(
             direction)
 
         crossprod = IFC_MODEL.calc_cross(direction, Z)
-        bm_axis2placement.RefDirection = IFC_MODEL.ifcfile.createIfcDirection(
+        bm_axis2placement.RefDirection = IFC_MODEL.intern_direction(
             crossprod)
 
-        # 4-2. Create LocalPlacement for beam.
+        # 3-2. Create LocalPlacement for beam.
         bm_placement = IFC_MODEL.ifcfile.createIfcLocalPlacement(
-            story, bm_axis2placement)  # can pass building stories as host
-        bm.ObjectPlacement = bm_placement
-
-        # 4-3. Create 3D axis placement for extrusion.
-        bm_extrudePlacement = IFC_MODEL.ifcfile.createIfcAxis2Placement3D(
-            IFC_MODEL.ifcfile.createIfcCartesianPoint((0., 0., 0.)))
-
-        # 4-4. Create extruded area section for beam.
-        bm_extrusion = IFC_MODEL.ifcfile.createIfcExtrudedAreaSolid()
-        ifcclosedprofile = IFC_MODEL.get_wshape_profile(section_name)
-
-        ifcclosedprofile.ProfileName = section_name
-        bm_extrusion.SweptArea = ifcclosedprofile
-        bm_extrusion.Position = bm_extrudePlacement
-        bm_extrusion.ExtrudedDirection = IFC_MODEL.ifcfile.createIfcDirection(
-            (0.0, 0.0, 1.0))
-        bm_extrusion.Depth = length
-        print(f"bm_extrusion: {bm_extrusion}")
-
-        # 5. Create shape representation for beam.
-        bm_rep = IFC_MODEL.ifcfile.createIfcShapeRepresentation(
-            context, "Body", "SweptSolid", [bm_extrusion])
+            story.ObjectPlacement, bm_axis2placement)
 
-        IFC_MODEL.add_style_to_product(material, bm)
+        # 4. Create the beam, instancing the shared section extrusion for its section, length and material.
+        bm = IFC_MODEL.create_beam(context=context, owner_history=owner_history, beam_placement=bm_placement,
+                                   length=length, section_name=section_name, material=material)
 
-        # 6. Create a product shape for beam.
-        bm_prod = IFC_MODEL.ifcfile.createIfcProductDefinitionShape()
-        bm_prod.Representations = [bm_rep]
-
-        bm.Representation = bm_prod
-
-        # 7. Add beam to IFC file & save
+        # 5. Add beam to IFC file & save
         IFC_MODEL.ifcfile.createIfcRelContainedInSpatialStructure(IFC_MODEL.create_guid(
         ), owner_history, "Building story Container", None, [bm], story)
+        IFC_MODEL.record_added(bm)
 
-        IFC_MODEL.save_ifc(f"public/{sid}/canvas.ifc")
+        IFC_MODEL.mark_dirty(f"public/{sid}/canvas.ifc")
         return True
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -218,6 +224,7 @@ def create_beam(sid: Annotated[str, InjectedToolArg], start_coord: str = "0,0,0"
 
 
 @tool
+@locked_model
 def create_column(sid: Annotated[str, InjectedToolArg], story_n: int = 1, start_coord: str = "0,0,0", height: float = 30, section_name: str = "W12X53", material: str = None) -> bool:
     """
     Creates a single column in the Revit document based on specified location, width, depth, and height.
@@ -250,9 +257,8 @@ def create_column(sid: Annotated[str, InjectedToolArg], story_n: int = 1, start_
         start_coord = tuple(start_coord)
 
         # 3. Set up the IFC model.
-        context = IFC_MODEL.ifcfile.by_type(
-            "IfcGeometricRepresentationContext")[0]
-        owner_history = IFC_MODEL.ifcfile.by_type("IfcOwnerHistory")[0]
+        context = IFC_MODEL.model_context
+        owner_history = IFC_MODEL.owner_history
 
         # 4. Get the story's placement.
         story_placement = story.ObjectPlacement
@@ -266,9 +272,10 @@ def create_column(sid: Annotated[str, InjectedToolArg], story_n: int = 1, start_
             context=context, owner_history=owner_history, column_placement=column_placement, height=height, section_name=section_name, material=material)
         IFC_MODEL.ifcfile.createIfcRelContainedInSpatialStructure(IFC_MODEL.create_guid(
         ), owner_history, "Building story Container", None, [column], story)
+        IFC_MODEL.record_added(column)
 
-        # 7. Save structure
-        IFC_MODEL.save_ifc(f"public/{sid}/canvas.ifc")
+        # 7. Mark the structure for saving
+        IFC_MODEL.mark_dirty(f"public/{sid}/canvas.ifc")
         return True
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -276,6 +283,7 @@ def create_column(sid: Annotated[str, InjectedToolArg], story_n: int = 1, start_
 
 
 @tool
+@locked_model
 def create_grid(sid: Annotated[str, InjectedToolArg], grids_x_distance_between: float = 10.0, grids_y_distance_between: float = 10.0, grids_x_direction_amount: int = 5, grids_y_direction_amount: int = 5, grid_extends: float = 50.0) -> bool:
     """
     Creates a grid of lines in the given document based on the specified number of rows and columns,
@@ -336,9 +344,9 @@ def create_grid(sid: Annotated[str, InjectedToolArg], grids_x_distance_between:
         for i_grid in grids_x_dictionary.items():
             print(f"Creating X grid line at {i_grid[1]}")
 
-            point_1 = IFC_MODEL.ifcfile.createIfcCartesianPoint(
+            point_1 = IFC_MODEL.intern_point(
                 (i_grid[1], y_min_overlap))
-            point_2 = IFC_MODEL.ifcfile.createIfcCartesianPoint(
+            point_2 = IFC_MODEL.intern_point(
                 (i_grid[1], y_max_overlap))
 
             Line = IFC_MODEL.ifcfile.createIfcPolyline([point_1, point_2])
@@ -353,9 +361,9 @@ def create_grid(sid: Annotated[str, InjectedToolArg], grids_x_distance_between:
         for i_grid in grids_y_dictionary.items():
             print(f"Creating Y grid line at {i_grid[1]}")
 
-            point_1 = IFC_MODEL.ifcfile.createIfcCartesianPoint(
+            point_1 = IFC_MODEL.intern_point(
                 (x_min_overlap, i_grid[1]))
-            point_2 = IFC_MODEL.ifcfile.createIfcCartesianPoint(
+            point_2 = IFC_MODEL.intern_point(
                 (x_max_overlap, i_grid[1]))
 
             Line = IFC_MODEL.ifcfile.createIfcPolyline([point_1, point_2])
@@ -372,12 +380,12 @@ def create_grid(sid: Annotated[str, InjectedToolArg], grids_x_distance_between:
         print(f"gridY: {gridY}")
 
         # Defining the grid
-        PntGrid = IFC_MODEL.ifcfile.createIfcCartesianPoint(O)
+        PntGrid = IFC_MODEL.intern_point(O)
 
         myGridCoordinateSystem = IFC_MODEL.ifcfile.createIfcAxis2Placement3D()
         myGridCoordinateSystem.Location = PntGrid
-        myGridCoordinateSystem.Axis = IFC_MODEL.ifcfile.createIfcDirection(Z)
-        myGridCoordinateSystem.RefDirection = IFC_MODEL.ifcfile.createIfcDirection(
+        myGridCoordinateSystem.Axis = IFC_MODEL.intern_direction(Z)
+        myGridCoordinateSystem.RefDirection = IFC_MODEL.intern_direction(
             X)
 
         grid_placement = IFC_MODEL.ifcfile.createIfcLocalPlacement()
@@ -419,11 +427,12 @@ def create_grid(sid: Annotated[str, InjectedToolArg], grids_x_distance_between:
         container_SpatialStructure.Description = 'BuildingstoryContainer for Elements'
         container_SpatialStructure.RelatingStructure = IFC_MODEL.site
         container_SpatialStructure.RelatedElements = [myGrid]
+        IFC_MODEL.record_added(myGrid)
         print(f"Container Spatial Structure: {container_SpatialStructure}")
 
         print("Grid creation completed.")
 
-        IFC_MODEL.save_ifc(f"public/{sid}/canvas.ifc")
+        IFC_MODEL.mark_dirty(f"public/{sid}/canvas.ifc")
         return True
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -431,6 +440,7 @@ def create_grid(sid: Annotated[str, InjectedToolArg], grids_x_distance_between:
 
 
 @tool
+@locked_model
 def create_wall(sid: Annotated[str, InjectedToolArg], story_n: int = 1, start_coord: str = "10,0,0", end_coord: str = "0,0,0", height: float = 30.0, thickness: float = 1.0, material: str = None, ) -> bool:
     """
     Creates a single wall in the Revit document based on specified start and end coordinates, level, wall type, structural flag, height, and thickness.
@@ -485,9 +495,8 @@ def create_wall(sid: Annotated[str, InjectedToolArg], story_n: int = 1, start_co
             )
 
             # 3. IFC model setup
-            context = IFC_MODEL.ifcfile.by_type(
-                "IfcGeometricRepresentationContext")[0]
-            owner_history = IFC_MODEL.ifcfile.by_type("IfcOwnerHistory")[0]
+            context = IFC_MODEL.model_context
+            owner_history = IFC_MODEL.owner_history
             # 4. Create the wall placement with correct direction
             wall_placement = IFC_MODEL.create_ifclocalplacement(
                 start_coord, Z, direction, relative_to=story_placement)
@@ -497,8 +506,9 @@ def create_wall(sid: Annotated[str, InjectedToolArg], story_n: int = 1, start_co
             wall_guid = wall.GlobalId
             IFC_MODEL.ifcfile.createIfcRelContainedInSpatialStructure(IFC_MODEL.create_guid(
             ), owner_history, "Building story Container", None, [wall], story)
+            IFC_MODEL.record_added(wall)
 
-            IFC_MODEL.save_ifc(f"public/{sid}/canvas.ifc")
+            IFC_MODEL.mark_dirty(f"public/{sid}/canvas.ifc")
         return True, wall_guid
     except Exception as e:
         print(f"Error creating wall: {e}")
@@ -506,6 +516,7 @@ def create_wall(sid: Annotated[str, InjectedToolArg], story_n: int = 1, start_co
 
 
 @tool
+@locked_model
 def create_isolated_footing(sid: Annotated[str, InjectedToolArg], story_n: int = 1, location: tuple = (0.0, 0.0, 0.0), length: float = 10.0, width: float = 10.0, thickness: float = 1.0) -> bool:
     """
     Creates a shallow isolated structural foundation footing on the specified story.
@@ -538,16 +549,17 @@ def create_isolated_footing(sid: Annotated[str, InjectedToolArg], story_n: int =
         location = (location[0], location[1], location[2] + elevation)
 
         # IFC model information
-        owner_history = IFC_MODEL.ifcfile.by_type("IfcOwnerHistory")[0]
+        owner_history = IFC_MODEL.owner_history
 
         # Call the function in ifc.py to create the footing
         footing = IFC_MODEL.create_isolated_footing(
             location, length, width, thickness)
         IFC_MODEL.ifcfile.createIfcRelContainedInSpatialStructure(IFC_MODEL.create_guid(
         ), owner_history, "Building story Container", None, [footing], story)
+        IFC_MODEL.record_added(footing)
 
         # Save structure
-        IFC_MODEL.save_ifc(f"public/{sid}/canvas.ifc")
+        IFC_MODEL.mark_dirty(f"public/{sid}/canvas.ifc")
         retrieval_tool = parse_ifc()
 
         return True
@@ -557,6 +569,7 @@ def create_isolated_footing(sid: Annotated[str, InjectedToolArg], story_n: int =
 
 
 @tool
+@locked_model
 def create_strip_footing(sid: Annotated[str, InjectedToolArg], story_n: int = 1, start_point: tuple = (0.0, 0.0, 0.0), end_point: tuple = (10.0, 0.0, 0.0), width: float = 1.0, depth: float = 1.0) -> bool:
     """
     Creates a continuous footing (strip footing) on the specified story.
@@ -591,16 +604,17 @@ def create_strip_footing(sid: Annotated[str, InjectedToolArg], story_n: int = 1,
         end_point = (end_point[0], end_point[1], end_point[2] + elevation)
 
         # IFC model information
-        owner_history = IFC_MODEL.ifcfile.by_type("IfcOwnerHistory")[0]
+        owner_history = IFC_MODEL.owner_history
 
         # Call the function in ifc.py to create the continuous footing
         footing = IFC_MODEL.create_strip_footing(
             start_point, end_point, width, depth)
         IFC_MODEL.ifcfile.createIfcRelContainedInSpatialStructure(IFC_MODEL.create_guid(
         ), owner_history, "Building story Container", None, [footing], story)
+        IFC_MODEL.record_added(footing)
 
         # Save structure
-        IFC_MODEL.save_ifc(f"public/{sid}/canvas.ifc")
+        IFC_MODEL.mark_dirty(f"public/{sid}/canvas.ifc")
         # retrieval_tool = parse_ifc()
 
         return True
@@ -610,6 +624,7 @@ def create_strip_footing(sid: Annotated[str, InjectedToolArg], story_n: int = 1,
 
 
 @tool
+@locked_model
 def create_void_in_wall(sid: Annotated[str, InjectedToolArg], host_wall_id=None, width=1.0, height=1.0, depth=2.0, void_location=(1.0, 0.0, 1.0)) -> bool:
     """
     Creates a void in the specified host element and commits it to the IFC file.
@@ -629,14 +644,8 @@ def create_void_in_wall(sid: Annotated[str, InjectedToolArg], host_wall_id=None,
             IFC_MODEL = global_store.sid_to_ifc_model.get(sid, None)
 
         # Retrieve wall with element ID
-        walls = IFC_MODEL.ifcfile.by_type("IfcWall")
-        host_wall = None
-        for wall in walls:
-            if str(wall.GlobalId).strip() == str(host_wall_id).strip():
-                host_wall = wall
-                break
-
-        if host_wall is None:
+        host_wall = IFC_MODEL.get_by_guid(host_wall_id)
+        if host_wall is None or not host_wall.is_a("IfcWall"):
             raise ValueError(f"No wall found with GlobalId: {host_wall_id}")
 
         # Convert void_location to list of floats
@@ -661,7 +670,7 @@ def create_void_in_wall(sid: Annotated[str, InjectedToolArg], host_wall_id=None,
         )
 
         # Save structure
-        IFC_MODEL.save_ifc(f"public/{sid}/canvas.ifc")
+        IFC_MODEL.mark_dirty(f"public/{sid}/canvas.ifc")
         print("Void created and committed to the IFC file successfully.")
         return True
     except Exception as e:
@@ -670,6 +679,7 @@ def create_void_in_wall(sid: Annotated[str, InjectedToolArg], host_wall_id=None,
 
 
 @tool
+@locked_model
 def create_floor(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_list: list = [(0., 0., 0.), (0., 100., 0.), (100., 100., 0.), (100., 0., 0.)], slab_thickness: float = 1.0) -> bool:
     """
     Creates a floor in the specified story with given dimensions and thickness.
@@ -692,14 +702,13 @@ def create_floor(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_l
 
         # 1. Get model information.
         try:
-            context = IFC_MODEL.ifcfile.by_type(
-                "IfcGeometricRepresentationContext")[0]
+            context = IFC_MODEL.model_context
         except Exception as e:
             print(f"Error getting model context: {e}")
             raise
 
         try:
-            owner_history = IFC_MODEL.ifcfile.by_type("IfcOwnerHistory")[0]
+            owner_history = IFC_MODEL.owner_history
             owner_history.CreationDate = int(owner_history.CreationDate)
         except Exception as e:
             print(f"Error getting owner_history: {e}")
@@ -739,7 +748,7 @@ def create_floor(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_l
 
         # 4. Create points for slab boundary
         try:
-            points = [IFC_MODEL.ifcfile.createIfcCartesianPoint(
+            points = [IFC_MODEL.intern_point(
                 (x, y, z)) for x, y, z in point_list]
             points.append(points[0])  # close loop
 
@@ -747,16 +756,16 @@ def create_floor(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_l
             slab_line = IFC_MODEL.ifcfile.createIfcPolyline(points)
             slab_profile = IFC_MODEL.ifcfile.createIfcArbitraryClosedProfileDef(
                 "AREA", None, slab_line)
-            ifc_direction = IFC_MODEL.ifcfile.createIfcDirection(Z)
+            ifc_direction = IFC_MODEL.intern_direction(Z)
         except Exception as e:
             print(f"Error creating points for slab boundary: {e}")
             raise
 
         # 6. Create local axis placement
         try:
-            point = IFC_MODEL.ifcfile.createIfcCartesianPoint((0.0, 0.0, 0.0))
-            dir1 = IFC_MODEL.ifcfile.createIfcDirection((0., 0., 1.0))
-            dir2 = IFC_MODEL.ifcfile.createIfcDirection((1.0, 0., 0.0))
+            point = IFC_MODEL.intern_point((0.0, 0.0, 0.0))
+            dir1 = IFC_MODEL.intern_direction((0., 0., 1.0))
+            dir2 = IFC_MODEL.intern_direction((1.0, 0., 0.0))
             axis2placement = IFC_MODEL.ifcfile.createIfcAxis2Placement3D(
                 point, dir1, dir2)
         except Exception as e:
@@ -785,6 +794,7 @@ def create_floor(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_l
                                  product=ifc_slabtype, representation=shape_representation)
             IFC_MODEL.ifcfile.createIfcRelContainedInSpatialStructure(IFC_MODEL.create_guid(
             ), owner_history, "Building story Container", None, [slab], story)
+            IFC_MODEL.record_added(slab)
         except Exception as e:
             print(
                 f"Error creating product entity and assigning to spatial container: {e}")
@@ -792,7 +802,7 @@ def create_floor(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_l
 
         # 9. Save the structure
         try:
-            IFC_MODEL.save_ifc(f"public/{sid}/canvas.ifc")
+            IFC_MODEL.mark_dirty(f"public/{sid}/canvas.ifc")
         except Exception as e:
             print(f"Error saving structure: {e}")
             raise
@@ -804,6 +814,7 @@ def create_floor(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_l
 
 
 @tool
+@locked_model
 def create_roof(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_list: list = [(0, 0, 0), (0, 100, 0), (100, 100, 0), (100, 0, 0)], roof_thickness: float = 1.0) -> bool:
     """
     Creates a roof on the specified story with given dimensions and thickness.
@@ -825,14 +836,13 @@ def create_roof(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_li
             f"story_n: {story_n}, point_list: {point_list}, roof_thickness: {roof_thickness}")
         try:
             # 1. Get model information
-            context = IFC_MODEL.ifcfile.by_type(
-                "IfcGeometricRepresentationContext")[0]
+            context = IFC_MODEL.model_context
         except Exception as e:
             print(f"Error getting context: {e}")
             raise
 
         try:
-            owner_history = IFC_MODEL.ifcfile.by_type("IfcOwnerHistory")[0]
+            owner_history = IFC_MODEL.owner_history
             owner_history.CreationDate = int(owner_history.CreationDate)
         except Exception as e:
             print(f"Error getting owner_history: {e}")
@@ -891,7 +901,7 @@ def create_roof(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_li
 
         try:
             # 4. Create points for roof boundary
-            points = [IFC_MODEL.ifcfile.createIfcCartesianPoint(
+            points = [IFC_MODEL.intern_point(
                 [float(x), float(y), float(z)]) for x, y, z in point_list]
         except Exception as e:
             print(f"Error creating points: {e}")
@@ -918,26 +928,26 @@ def create_roof(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_li
             raise
 
         try:
-            ifc_direction = IFC_MODEL.ifcfile.createIfcDirection(Z)
+            ifc_direction = IFC_MODEL.intern_direction(Z)
         except Exception as e:
             print(f"Error creating ifc_direction: {e}")
             raise
 
         try:
             # 6. Create local axis placement
-            point = IFC_MODEL.ifcfile.createIfcCartesianPoint([0.0, 0.0, 0.0])
+            point = IFC_MODEL.intern_point([0.0, 0.0, 0.0])
         except Exception as e:
             print(f"Error creating point: {e}")
             raise
 
         try:
-            dir1 = IFC_MODEL.ifcfile.createIfcDirection([0., 0., 1.])
+            dir1 = IFC_MODEL.intern_direction([0., 0., 1.])
         except Exception as e:
             print(f"Error creating dir1: {e}")
             raise
 
         try:
-            dir2 = IFC_MODEL.ifcfile.createIfcDirection([1., 0., 0.])
+            dir2 = IFC_MODEL.intern_direction([1., 0., 0.])
         except Exception as e:
             print(f"Error creating dir2: {e}")
             raise
@@ -984,13 +994,14 @@ def create_roof(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_li
             # 9. Create product entity and assign to spatial container
             IFC_MODEL.ifcfile.createIfcRelContainedInSpatialStructure(IFC_MODEL.create_guid(
             ), owner_history, "Building story Container", None, [roof], story)
+            IFC_MODEL.record_added(roof)
         except Exception as e:
             print(f"Error assigning container: {e}")
             raise
 
         try:
             # 10. Save structure
-            IFC_MODEL.save_ifc(f"public/{sid}/canvas.ifc")
+            IFC_MODEL.mark_dirty(f"public/{sid}/canvas.ifc")
         except Exception as e:
             print(f"Error saving IFC file: {e}")
             raise
@@ -1001,24 +1012,48 @@ def create_roof(sid: Annotated[str, InjectedToolArg], story_n: int = 1, point_li
         raise
 
 
-@tool
-def search_canvas(sid: Annotated[str, InjectedToolArg], search_query: str, search_file: str = 'canvas.ifc') -> str:
+async def find_relevant_objects(sid, search_query, search_file='canvas.ifc'):
     """
-    Provided a user query, this function will search the IFC file and return the relevant objects in a string format.
+    Finds the objects a search query is about, answering it locally when the query can be parsed and asking the
+    LLM which IFC classes it means otherwise.
+
     Parameters:
-    - search_query (str): The user query that the user inputs. e.g. find all walls, find all columns, find all beams, find left most wall
-    - search file (str): The file to be searched. If the user wants to search the canvas (the current file they are working on), the value should be canvas.ifc. If the user wants to search the loaded file, the value should be user.ifc
+    - sid: the session id.
+    - search_query: the user's search query.
+    - search_file: canvas.ifc for the session's model, or the name of an uploaded file.
+
+    Returns:
+    tuple: (the feature dicts of the relevant objects, which path answered and how long it took),
+    or (None, None) if the LLM named no objects.
     """
-    global openai_client
     try:
         IFC_MODEL = global_store.sid_to_ifc_model.get(sid, None)
         if IFC_MODEL is None:
             print("No IFC model found for the given session.")
-            create_session(sid)
+            await asyncio.to_thread(create_session, sid)
             IFC_MODEL = global_store.sid_to_ifc_model.get(sid, None)
 
-        loaded_file = ifcopenshell.open(f"public/{sid}/" + search_file)
-        res = openai_client.chat.completions.create(
+        # 1. Fast path: parse the query locally and answer it from the in-memory model's indexes.
+        # The canvas is the live session model; uploaded files are parsed once and cached.
+        # Parsing and searching run in a worker thread so the event loop keeps serving other sessions.
+        start = time.perf_counter()
+        if search_file == 'canvas.ifc':
+            source = IFC_MODEL
+        else:
+            source = await asyncio.to_thread(parsed_file_cache.open, f"public/{sid}/" + search_file)
+        query, local_results = await asyncio.to_thread(
+            answer_locally, source, search_query, IFC_MODEL.object_types)
+        if query is not None:
+            elapsed = time.perf_counter() - start
+            record_query("local", elapsed)
+            print(f"search_canvas answered locally in {elapsed * 1000:.1f} ms: {query}")
+            return local_results, f"Answered by: local query engine ({elapsed * 1000:.1f} ms)\n"
+
+        # 2. Otherwise ask the LLM which IFC classes the query is about. The answer is a list of classes and the
+        # only user text is the short query, so the cache may ignore its filler words.
+        content = await cached_chat_content(
+            "openai",
+            drop_filler=True,
             model='gpt-4o',
             response_format={"type": "json_object"},
             messages=[
@@ -1049,43 +1084,142 @@ def search_canvas(sid: Annotated[str, InjectedToolArg], search_query: str, searc
             ]
         )
         try:
-            json_object = json.loads(res.choices[0].message.content) or {}
+            json_object = json.loads(content) or {}
         except json.JSONDecodeError:
             print("Invalid JSON response.")
             raise
         if json_object:
             objects_list = json_object.get('objects', [])
-            all_entities_list = []
-            for object in objects_list:
-                try:
-                    all_entities_list.extend(loaded_file.by_type(object))
-                except:
-                    raise Exception('No such object found in IFC file', object)
-            print(all_entities_list)
-
-            all_relevant_objects = []
-            feature_extractor = IfcEntityFeatureExtractor()
-            for entity in all_entities_list:
-                features = feature_extractor.extract_entity_features(entity)
-                if features:
-                    all_relevant_objects.append(features)
-            # Format the output as a string
-            formatted_output = format_output_search_canvas(
-                all_relevant_objects)
-            return formatted_output
+
+            def extract_relevant_objects():
+                all_entities_list = []
+                for object in objects_list:
+                    try:
+                        if source is IFC_MODEL:
+                            all_entities_list.extend(IFC_MODEL.products_of_class(object))
+                        else:
+                            all_entities_list.extend(source.by_type(object))
+                    except:
+                        raise Exception('No such object found in IFC file', object)
+                print(all_entities_list)
+
+                if source is IFC_MODEL:
+                    feature_extractor = IFC_MODEL.feature_cache
+                else:
+                    feature_extractor = IfcEntityFeatureExtractor()
+                return feature_extractor.extract_features_batched(all_entities_list)
+
+            all_relevant_objects = await asyncio.to_thread(extract_relevant_objects)
+            elapsed = time.perf_counter() - start
+            record_query("llm", elapsed)
+            return all_relevant_objects, f"Answered by: LLM ({elapsed * 1000:.1f} ms)\n"
+        return None, None
     except Exception as e:
         print(f"An error occurred: {e}")
         raise
 
 
 @tool
-def delete_objects(sid: Annotated[str, InjectedToolArg], delete_query: str) -> bool:
+async def search_canvas(sid: Annotated[str, InjectedToolArg], search_query: str = "", search_file: str = 'canvas.ifc', cursor: str = None) -> str:
+    """
+    Provided a user query, this function will search the IFC file and return the relevant objects in a string format.
+    Large results are summarized and paged: the output ends with a cursor when more objects are left.
+    Parameters:
+    - search_query (str): The user query that the user inputs. e.g. find all walls, find all columns, find all beams, find left most wall
+    - search file (str): The file to be searched. If the user wants to search the canvas (the current file they are working on), the value should be canvas.ifc. If the user wants to search the loaded file, the value should be user.ifc
+    - cursor (str): The cursor printed at the end of a previous search_canvas result, to get its next page of objects. The search query is not needed with a cursor.
+    """
+    # 1. A cursor pages through the results of the session's last search.
+    if cursor:
+        stored = global_store.sid_to_search_results.get(sid)
+        search_id, _, offset = str(cursor).partition(":")
+        if stored is None or stored["id"] != search_id or not offset.isdigit():
+            return "This cursor has expired. Run search_canvas again with the search query."
+        return format_output_search_canvas(stored["results"], offset=int(offset), cursor_id=search_id)
+
+    # 2. Otherwise search, keep the results for paging, and render the first page.
+    if not str(search_query or "").strip():
+        return "No search query was given. Call search_canvas with a search_query, or with the cursor of a previous search."
+    results, answered_by = await find_relevant_objects(sid, search_query, search_file)
+    if results is None:
+        return None
+    search_id = uuid.uuid4().hex[:8]
+    global_store.sid_to_search_results[sid] = {
+        "id": search_id, "query": search_query, "results": results}
+    return format_output_search_canvas(results, cursor_id=search_id) + answered_by
+
+
+def find_delete_targets(IFC_MODEL, delete_query="", global_ids=None, object_type=None, storey=None, section_name=None, condition=None):
+    """
+    Resolves the objects a delete request names without the LLM: explicit GlobalIds, a structured filter, or a
+    query the local query engine can parse. Anything the parser does not fully understand (an unknown object
+    type, a condition with words left over or no predicate, free text with unparsed words) is left to the LLM,
+    as is a singular query ("delete the wall") matching several objects, or one naming storeys, whose products
+    would be left without a container.
+
+    Parameters:
+    - IFC_MODEL: the session's model.
+    - delete_query: the user's delete query.
+    - global_ids: the GlobalIds to delete.
+    - object_type, storey, section_name, condition: a structured filter, e.g. column, Level 2, W12X53, height > 10.
+
+    Returns:
+    list: the GlobalIds to delete, or None if the request needs the LLM.
+    """
+    # 1. Explicit GlobalIds, e.g. of the objects the user selected.
+    if global_ids:
+        return [str(guid).strip() for guid in global_ids if IFC_MODEL.get_by_guid(guid) is not None]
+
+    # 2. A structured filter, answered from the model's indexes.
+    if object_type or storey or section_name or condition:
+        ifc_class = "IfcElement"
+        if object_type:
+            word = str(object_type).strip().lower()
+            ifc_class = class_vocabulary(IFC_MODEL.object_types).get(word)
+            if ifc_class is None and word.startswith("ifc") and word.isalpha():
+                ifc_class = str(object_type).strip()
+            if ifc_class is None:
+                return None
+        predicates = []
+        if condition:
+            predicates = parse_condition(condition)
+            if predicates is None:
+                return None
+        query = {
+            "classes": [ifc_class],
+            "storey": storey,
+            "predicates": predicates,
+            "section": str(section_name).strip().upper() if section_name else None,
+            "extreme": None,
+        }
+        if ifc_class == "IfcBuildingStorey":
+            return None
+        return [product.GlobalId for product in run_query(IFC_MODEL, query, extract=False)]
+
+    # 3. Free text the local query engine can parse, unless it is ambiguous.
+    query = parse_query(delete_query, IFC_MODEL.object_types, storey_names_of(IFC_MODEL))
+    if query is None or "IfcBuildingStorey" in query["classes"]:
+        return None
+    products = run_query(IFC_MODEL, query, extract=False)
+    if len(products) > 1 and not wants_many(delete_query, IFC_MODEL.object_types):
+        return None
+    return [product.GlobalId for product in products]
+
+
+@tool
+async def delete_objects(sid: Annotated[str, InjectedToolArg], delete_query: str = "", global_ids: list = None, object_type: str = None, storey: str = None, section_name: str = None, condition: str = None) -> bool:
     """
     Provided a user query, this function will delete the relevant objects from the ifc file.
+    Prefer global_ids when the objects are known (e.g. the user selected them) and the structured filter when the request names a type,
+    story, section or condition; these are deleted immediately. Free-text queries are only interpreted by the LLM when they are ambiguous.
     Parameters:
     - delete_query (str): The user query that the user inputs. e.g. delete the right most wall, delete all the columns etc.
+    - global_ids (list): The GlobalIds of the objects to delete, e.g. from the selected objects.
+    - object_type (str): Delete objects of this type, e.g. wall, column, beam, slab.
+    - storey (str): Delete objects on this story, e.g. Level 2.
+    - section_name (str): Delete members of this section, e.g. W12X53.
+    - condition (str): Delete objects meeting a condition on height, length, thickness or elevation, e.g. height > 10.
     """
-    global openai_client
     print('[delete_objects] sid', sid)
     print('[delete_objects] delete_query', delete_query)
     try:
@@ -1093,20 +1227,34 @@ def delete_objects(sid: Annotated[str, InjectedToolArg], delete_query: str) -> b
         print('[delete_objects] IFC_MODEL', IFC_MODEL)
         if IFC_MODEL is None:
             print("No IFC model found for the given session.")
-            create_session(sid)
+            await asyncio.to_thread(create_session, sid)
             IFC_MODEL = global_store.sid_to_ifc_model.get(sid, None)
+        if not (delete_query or global_ids or object_type or storey or section_name or condition):
+            return False
+
+        # 1. Explicit, structured and unambiguous requests are resolved and deleted locally.
+        start = time.perf_counter()
+        targets = await asyncio.to_thread(find_delete_targets, IFC_MODEL, delete_query, global_ids, object_type,
+                                          storey, section_name, condition)
+        if targets is not None:
+            removed = await asyncio.to_thread(IFC_MODEL.remove_products, targets)
+            elapsed = time.perf_counter() - start
+            print(f"[delete_objects] deleted {len(removed)} objects locally in {elapsed * 1000:.1f} ms")
+            return bool(removed)
+
+        # 2. Otherwise the LLM picks the GlobalIds to delete from every match.
         try:
-            tool_input = {
-                "sid": sid,
-                "search_query": delete_query,
-                "search_file": "canvas.ifc"
-            }
-            relevant_objects = search_canvas(tool_input)
+            # Every match, unpaged.
+            results, _ = await find_relevant_objects(sid, delete_query, "canvas.ifc")
+            relevant_objects = format_output_search_canvas(
+                results or [], budget=None, top_k=None)
             print('[delete_objects] relevant_objects', relevant_objects)
         except Exception as e:
             print('[delete_objects][search_canvas] An error occurred: ', e)
             raise
-        res = openai_client.chat.completions.create(
+        # The selection is never cached: "delete the wall" must not replay an earlier "delete every wall".
+        response = await chat_completion(
+            "openai",
             model='gpt-4o',
             response_format={"type": "json_object"},
             messages=[
@@ -1123,19 +1271,17 @@ def delete_objects(sid: Annotated[str, InjectedToolArg], delete_query: str) -> b
                 }
             ]
         )
-        print('[delete_objects] res', res)
+        content = response.choices[0].message.content
+        print('[delete_objects] res', content)
         try:
-            json_object = json.loads(res.choices[0].message.content) or {}
+            json_object = json.loads(content) or {}
         except json.JSONDecodeError:
             print("Invalid JSON response.")
             raise
         if json_object:
             objects_ids_list = json_object.get('objects', [])
             print('[delete_objects] objects_ids_list', objects_ids_list)
-            for object_id in objects_ids_list:
-                ifc_object = IFC_MODEL.ifcfile.by_guid(object_id)
-                IFC_MODEL.ifcfile.remove(ifc_object)
-                IFC_MODEL.save_ifc(f"public/{sid}/canvas.ifc")
+            await asyncio.to_thread(IFC_MODEL.remove_products, objects_ids_list)
             return True
     except Exception as e:
         print('[delete_objects] An error occurred: ', e)
@@ -1150,6 +1296,9 @@ def refresh_canvas(sid: Annotated[str, InjectedToolArg]) -> bool:
     The function is invoked when user types in 'refresh', 'refresh canvas' or 'refresh the canvas'
     """
     try:
+        IFC_MODEL = global_store.sid_to_ifc_model.get(sid, None)
+        if IFC_MODEL is not None:
+            IFC_MODEL.flush(wait=True)
         sio.emit('fileChange', {
                  'userId': 'BuildSync', 'message': 'A new change has been made to the file', 'file_name': f'public/{sid}/canvas.ifc'})
         return True
@@ -1173,25 +1322,29 @@ async def step_by_step_planner(sid: Annotated[str, InjectedToolArg], user_reques
     Returns:
     - step_by_step_plan (str): The step by step plan to perform the user's request.
     """
-    global groq_client
     try:
         IFC_MODEL = global_store.sid_to_ifc_model.get(sid, None)
         if IFC_MODEL is None:
             print("No IFC model found for the given session.")
-            create_session(sid)
+            await asyncio.to_thread(create_session, sid)
 
-        completion = await groq_client.chat.completions.create(
+        plan = await cached_chat_content(
+            "groq",
             model="llama-3.1-70b-versatile",
             messages=[
+                {
+                    "role": "system",
+                    "content": ARCHITECT_PROMPT
+                },
                 {
                     "role": "user",
-                    "content": architect_prompt
+                    "content": user_request
                 }
             ],
             temperature=0.8,
         )
-        print(completion.choices[0].message.content)
-        return completion.choices[0].message.content
+        print(plan)
+        return plan
     except Exception as e:
         print('[tools_graph.py] step_by_step_planner: ', e)
         return ''
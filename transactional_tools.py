@@ -0,0 +1,130 @@
+"""
+Transactional execution of the tool calls of one AI message. When the model asks for several tools at once,
+ToolNode would run them concurrently against the session's shared ifcfile. TransactionalToolNode instead
+applies them in order under a per-session lock as one batch: the file is written and announced once, by the
+tools step in model_streamer, and if any call raises, the model is rolled back to the state before the batch.
+"""
+import asyncio
+from langchain_core.messages import ToolMessage
+from langgraph.prebuilt import ToolNode
+from langgraph.prebuilt.tool_node import str_output
+from global_store import global_store
+
+# Tools that never change the model. A message that only calls these keeps ToolNode's concurrent execution;
+# any other tool, including one added later, makes its message a transaction.
+READ_ONLY_TOOLS = {"search_canvas", "step_by_step_planner", "refresh_canvas"}
+
+TOOL_ERROR_MESSAGE = "Error: {error}\n Please fix your mistakes."
+ROLLED_BACK_MESSAGE = ("Rolled back: {name} failed in the same batch of tool calls, so none of the batch's "
+                       "changes were kept. Error: {error}")
+SKIPPED_MESSAGE = "Not run: {name} failed earlier in the same batch of tool calls. Error: {error}"
+
+
+def session_lock(sid):
+    """
+    Returns the lock that serializes changes to a session's model.
+
+    Parameters:
+    - sid: the session id.
+    """
+    lock = global_store.sid_to_lock.get(sid)
+    if lock is None:
+        lock = global_store.sid_to_lock.setdefault(sid, asyncio.Lock())
+    return lock
+
+
+class TransactionalToolNode(ToolNode):
+    def __init__(self, tools, **kwargs):
+        """
+        Initializes the node. Tool errors are always turned into tool messages, since a failed call has to
+        report the rollback to the model rather than end the turn.
+
+        Parameters:
+        - tools: the tools the model can call.
+        """
+        kwargs["handle_tool_errors"] = True
+        super().__init__(tools, **kwargs)
+        self.batches = 0
+        self.rollbacks = 0
+
+    async def _afunc(self, input, config):
+        tool_calls, output_type = self._parse_input(input)
+        sid = config.get("configurable", {}).get("sid")
+        if sid is None or all(call["name"] in READ_ONLY_TOOLS for call in tool_calls):
+            return await super()._afunc(input, config)
+
+        async with session_lock(sid):
+            # 1. The batch needs the session's model to snapshot. A full snapshot serializes the whole file, so
+            # only batches of several calls take one; a single call is undone by removing what it created.
+            if sid not in global_store.sid_to_ifc_model:
+                from tools_graph import create_session
+                await asyncio.to_thread(create_session, sid)
+            ifc_model = global_store.sid_to_ifc_model[sid]
+            snapshot = await asyncio.to_thread(ifc_model.begin_batch, True, len(tool_calls) > 1)
+            self.batches += 1
+
+            # 2. Apply the calls in order, stopping at the first one that raises.
+            outputs = []
+            applied = []
+            failed = None
+            try:
+                for position, call in enumerate(tool_calls):
+                    if failed is not None:
+                        outputs.append(ToolMessage(SKIPPED_MESSAGE.format(name=failed[0], error=failed[1]),
+                                                   name=call["name"], tool_call_id=call["id"]))
+                        continue
+                    message, error = await self._arun_transactional(call, config)
+                    if error is not None:
+                        failed = (call["name"], repr(error))
+                    else:
+                        applied.append(position)
+                    outputs.append(message)
+            except BaseException:
+                # The turn was cancelled mid-batch: leave the model as it was before the batch. The rollback runs
+                # off the event loop, and the session lock is held until it is done even if the turn is cancelled
+                # again meanwhile.
+                self.rollbacks += 1
+                rollback = asyncio.ensure_future(asyncio.to_thread(ifc_model.end_batch, snapshot))
+                while not rollback.done():
+                    try:
+                        await asyncio.shield(rollback)
+                    except asyncio.CancelledError:
+                        pass
+                raise
+
+            # 3. Keep the batch, or roll back the model and tell the model which results were discarded.
+            if failed is None:
+                await asyncio.to_thread(ifc_model.end_batch)
+            else:
+                print(f"Rolling back the batch of {len(tool_calls)} tool calls for session {sid}: {failed[1]}")
+                self.rollbacks += 1
+                await asyncio.to_thread(ifc_model.end_batch, snapshot)
+                for position in applied:
+                    call = tool_calls[position]
+                    outputs[position] = ToolMessage(ROLLED_BACK_MESSAGE.format(name=failed[0], error=failed[1]),
+                                                    name=call["name"], tool_call_id=call["id"])
+        return outputs if output_type == "list" else {"messages": outputs}
+
+    async def _arun_transactional(self, call, config):
+        """
+        Runs one tool call.
+
+        Returns:
+        tuple: the tool message and the exception the tool raised, or None. A call to an unknown tool changed
+        nothing, so it is reported to the model without failing the batch.
+        """
+        if invalid_tool_message := self._validate_tool_call(call):
+            return invalid_tool_message, None
+        try:
+            message = await self.tools_by_name[call["name"]].ainvoke({**call, "type": "tool_call"}, config)
+            message.content = str_output(message.content)
+            return message, None
+        except Exception as e:
+            return ToolMessage(TOOL_ERROR_MESSAGE.format(error=repr(e)), name=call["name"],
+                               tool_call_id=call["id"]), e
+
+    def stats(self):
+        """
+        Returns the number of batches applied and rolled back.
+        """
+        return {"batches": self.batches, "rollbacks": self.rollbacks}